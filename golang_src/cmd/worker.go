@@ -137,7 +137,8 @@ loop:
 		if err == nil {
 			email, err = mongoClient.FetchReadyEmail(workerId)
 			if email != nil {
-				log.Printf("Got email %s Worker ID: %s\n", email.ID, workerId)
+				log.Printf("Got email %s Worker ID: %s Correlation ID: %s\n",
+					email.ID, workerId, email.CorrelationId)
 
 				emailUpdate := babymailgun.EmailUpdate{}
 				emailUpdate.FromEmail(email)
@@ -151,6 +152,7 @@ loop:
 				log.Printf("Updating and releasing email %s\n", email.ID)
 				mongoClient.UpdateEmail(email, &emailUpdate)
 			}
+			babymailgun.ReleaseSMTPServer(smtpServer)
 		}
 
 		if err != nil || smtpServer == nil || email == nil {
@@ -9,6 +9,7 @@ import (
 	"log"
 	"math/rand"
 	"strings"
+	"sync"
 	"time"
 )
 
@@ -41,18 +42,34 @@ type EmailRecipient struct {
 	Type    RecipientType
 }
 
+// Recipient addresses grouped by destination domain at ingest
+type RecipientDomain struct {
+	Domain    string
+	Addresses []string
+}
+
 type Email struct {
-	ID         string `_id`
-	Subject    string
-	Body       string
-	Recipients []EmailRecipient
-	MailFrom   string `sender`
-	CreatedAt  string // Go to Golang date
-	UpdatedAt  string // Go to Golang date
-	Status     EmailStatus
-	Reason     EmailReason
-	Tries      int
-	WorkerId   string `worker_id`
+	ID            string `_id`
+	Subject       string
+	Body          string
+	BodyHash      string `body_hash`
+	Recipients    []EmailRecipient
+	Domains       []RecipientDomain
+	MailFrom      string `sender`
+	CreatedAt     string // Go to Golang date
+	UpdatedAt     string // Go to Golang date
+	Status        EmailStatus
+	Reason        EmailReason
+	Tries         int
+	WorkerId      string `worker_id`
+	CorrelationId string `correlation_id`
+}
+
+// Bodies shared by many emails are stored once, keyed by their sha256, and
+// referenced from the email by BodyHash
+type StoredBody struct {
+	ID   string `_id`
+	Body string
 }
 
 type EmailUpdate struct {
@@ -74,8 +91,10 @@ type MongoClientConfig struct {
 }
 
 type MongoClient struct {
-	Config  *MongoClientConfig
-	session *mgo.Session
+	Config      *MongoClientConfig
+	session     *mgo.Session
+	serverTable *ServerTable
+	nextSlot    int
 }
 
 // NOTE In a real production environment we wouldn't store the credentials in mongo. Instead we'd use
@@ -85,15 +104,33 @@ type MongoClient struct {
 //			Lastly, I'm choosing not to model failing servers out here. I think such logic is better served
 //			by a load balancer capable of dynamicaly adding and removing hosts from a pool (Such as HAProxy).
 type SMTPServer struct {
-	ID       string `_id`
-	Username string
-	Password string
-	Hostname string
-	Port     int
+	ID             string `_id`
+	Username       string
+	Password       string
+	Hostname       string
+	Port           int
+	Weight         int
+	MaxConcurrency int `max_concurrency`
+}
+
+// The API precomputes a weighted round robin over the enabled servers every time the registry
+// changes. Slots holds indexes into Servers, each server appearing in proportion to its weight
+type ServerTable struct {
+	Version int
+	Servers []SMTPServer
+	Slots   []int
 }
 
+// Sends in flight per server across every goroutine in this process, used to respect
+// MaxConcurrency. Other worker processes keep their own counts
+var (
+	serverLoadLock sync.Mutex
+	serverLoad     = map[string]int{}
+)
+
 var (
 	NoServersFoundError   = errors.New("No SMTP servers are available to send emails")
+	ServersBusyError      = errors.New("Every SMTP server is at its concurrency limit")
 	InvalidRecipientError = errors.New("Malformatted email, recipient type is invalid")
 )
 
@@ -107,6 +144,57 @@ func (e *EmailUpdate) FromEmail(email *Email) {
 	}
 }
 
+func acquireSMTPServer(server *SMTPServer) bool {
+	serverLoadLock.Lock()
+	defer serverLoadLock.Unlock()
+	if server.MaxConcurrency > 0 && serverLoad[server.ID] >= server.MaxConcurrency {
+		return false
+	}
+	serverLoad[server.ID]++
+	return true
+}
+
+// Must be called once the send using a server returned by GetSMTPServer is done
+func ReleaseSMTPServer(server *SMTPServer) {
+	serverLoadLock.Lock()
+	defer serverLoadLock.Unlock()
+	serverLoad[server.ID]--
+	if serverLoad[server.ID] <= 0 {
+		delete(serverLoad, server.ID)
+	}
+}
+
+func (m *MongoClient) loadServerTable(session *mgo.Session) error {
+	tableCollection := session.DB(m.Config.DatabaseName).C("server_tables")
+
+	// The table only changes when a server is added, edited or removed, so each loop checks
+	// the version alone and downloads the full table again only when it has moved
+	var current struct{ Version int }
+	err := tableCollection.FindId("current").Select(bson.M{"version": 1}).One(&current)
+	if err != nil {
+		if err == mgo.ErrNotFound {
+			return NoServersFoundError
+		}
+		return err
+	}
+	if m.serverTable != nil && m.serverTable.Version == current.Version {
+		return nil
+	}
+
+	table := ServerTable{}
+	if err = tableCollection.FindId("current").One(&table); err != nil {
+		return err
+	}
+	m.serverTable = &table
+	m.nextSlot = 0
+	if len(table.Slots) > 0 {
+		// Keep the goroutines from marching through the table in lock step
+		m.nextSlot = rand.Intn(len(table.Slots))
+	}
+	log.Printf("Loaded server table version %d with %d server(s)", table.Version, len(table.Servers))
+	return nil
+}
+
 func (m *MongoClient) GetSMTPServer() (*SMTPServer, error) {
 	// NOTE In a production environment, we may want to restructure this to be a pipeline
 	//			of sorts, where emails are logically assigned to SMTP servers based on some
@@ -120,24 +208,28 @@ func (m *MongoClient) GetSMTPServer() (*SMTPServer, error) {
 	if err != nil {
 		return nil, err
 	}
+	defer session.Close()
 	session.SetMode(mgo.Strong, false)
-	smtpCollection := session.DB(m.Config.DatabaseName).C("servers")
-	query := bson.M{}
-	var smtpServers []SMTPServer
-
-	// Yes, this is naive. If we had a couple hundred thousand servers this would
-	// be a disaster. We'd likely want to replace this with round-robin selection
-	// at the very least, but optimally instead something like the NOTE above
-	err = smtpCollection.Find(query).All(&smtpServers)
-	if err != nil {
+
+	if err = m.loadServerTable(session); err != nil {
 		return nil, err
 	}
-	if len(smtpServers) == 0 {
+	table := m.serverTable
+	if len(table.Slots) == 0 {
 		return nil, NoServersFoundError
 	}
-	server := &smtpServers[rand.Intn(len(smtpServers))]
-	log.Printf("Found %d server(s), using %s:%d", len(smtpServers), server.Hostname, server.Port)
-	return server, nil
+
+	// Walk the table from where this goroutine left off, passing over servers that are
+	// already at their concurrency limit
+	for i := 0; i < len(table.Slots); i++ {
+		server := &table.Servers[table.Slots[m.nextSlot]]
+		m.nextSlot = (m.nextSlot + 1) % len(table.Slots)
+		if acquireSMTPServer(server) {
+			log.Printf("Using %s:%d from server table version %d", server.Hostname, server.Port, table.Version)
+			return server, nil
+		}
+	}
+	return nil, ServersBusyError
 }
 
 func (e *Email) FormattedMessage() []byte {
@@ -224,13 +316,28 @@ func (m *MongoClient) FetchReadyEmail(workerId string) (*Email, error) {
 	session.SetMode(mgo.Strong, true)
 	emailCollection := session.DB(m.Config.DatabaseName).C("emails")
 	email := Email{}
+	// Clear whatever a reaped lease left behind, so the reaper judges this claim by claimed_at alone
 	change := mgo.Change{
-		Update:    bson.M{"$set": bson.M{"worker_id": workerId}},
+		Update: bson.M{"$set": bson.M{
+			"worker_id":        workerId,
+			"claimed_at":       time.Now(),
+			"leased_by":        nil,
+			"lease_id":         nil,
+			"lease_expires_at": nil}},
 		ReturnNew: true}
 
-	// Fetch emails that are incomplete and N seconds old or older
-	olderThan := bson.M{"$lt": time.Now().Add(-time.Duration(m.Config.SendRetryInterval) * time.Second)}
-	_, err = emailCollection.Find(bson.M{"worker_id": nil, "status": "incomplete", "updated_at": olderThan}).Apply(change, &email)
+	// Fetch emails that are incomplete, due and N seconds old or older. Mailing lists keep their
+	// recipients in a separate collection which the worker doesn't read yet, so skip them
+	now := time.Now()
+	olderThan := bson.M{"$lt": now.Add(-time.Duration(m.Config.SendRetryInterval) * time.Second)}
+	query := bson.M{
+		"worker_id":         nil,
+		"status":            "incomplete",
+		"send_at":           bson.M{"$lte": now},
+		"updated_at":        olderThan,
+		"recipient_storage": bson.M{"$ne": "external"}}
+	// Highest priority first, then whatever has been due the longest
+	_, err = emailCollection.Find(query).Sort("-priority", "send_at").Apply(change, &email)
 
 	if err != nil {
 		// We might have lost contact with Mongo, or there are simply no emails to send right now
@@ -241,6 +348,17 @@ func (m *MongoClient) FetchReadyEmail(workerId string) (*Email, error) {
 		return nil, err
 	}
 
+	if email.BodyHash != "" {
+		stored := StoredBody{}
+		err = session.DB(m.Config.DatabaseName).C("bodies").FindId(email.BodyHash).One(&stored)
+		if err != nil {
+			// Give the email back rather than holding it forever
+			emailCollection.UpdateId(email.ID, bson.M{"$set": bson.M{"worker_id": nil}})
+			return nil, err
+		}
+		email.Body = stored.Body
+	}
+
 	return &email, nil
 }
 
@@ -250,16 +368,21 @@ func (m *MongoClient) UpdateEmail(email *Email, emailUpdate *EmailUpdate) error
 		return err
 	}
 
+	// Every claim field is cleared, so neither a late lease renewal or release nor the reaper
+	// can mistake the email for one that's still held
 	emailCollection := session.DB(m.Config.DatabaseName).C("emails")
 	err = emailCollection.Update(
 		bson.M{"_id": email.ID},
 		bson.M{"$set": bson.M{
-			"worker_id":  nil,
-			"tries":      emailUpdate.Tries,
-			"status":     emailUpdate.Status,
-			"reason":     emailUpdate.Reason,
-			"updated_at": time.Now(),
-			"recipients": emailUpdate.Recipients}})
+			"worker_id":        nil,
+			"claimed_at":       nil,
+			"lease_id":         nil,
+			"lease_expires_at": nil,
+			"tries":            emailUpdate.Tries,
+			"status":           emailUpdate.Status,
+			"reason":           emailUpdate.Reason,
+			"updated_at":       time.Now(),
+			"recipients":       emailUpdate.Recipients}})
 
 	if err != nil {
 		return err
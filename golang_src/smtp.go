@@ -13,8 +13,15 @@ func SendMail(smtpServer *SMTPServer, email *Email) error {
 
 	hostPort := fmt.Sprintf("%s:%d", smtpServer.Hostname, smtpServer.Port)
 	var sendTo []string
-	for _, recipient := range email.Recipients {
-		sendTo = append(sendTo, recipient.Address)
+	if len(email.Domains) > 0 {
+		// Grouped by domain at ingest, so the relay sees each domain's recipients together
+		for _, group := range email.Domains {
+			sendTo = append(sendTo, group.Addresses...)
+		}
+	} else {
+		for _, recipient := range email.Recipients {
+			sendTo = append(sendTo, recipient.Address)
+		}
 	}
 
 	message := email.FormattedMessage()
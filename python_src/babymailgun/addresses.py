@@ -0,0 +1,114 @@
+import collections
+import functools
+import re
+
+RECIPIENT_TYPES = ["to", "cc", "bcc"]
+# Verdicts for this many distinct addresses are remembered
+DEFAULT_CACHE_SIZE = 100000
+
+# From http://emailregex.com/
+EMAIL_REGEX = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+
+
+def normalize_address(address):
+    # Domains are case insensitive, local parts technically aren't, so only
+    # the domain is rewritten. Duplicates are still found case insensitively
+    # by address_key
+    address = address.strip()
+    local, at, domain = address.rpartition("@")
+    if not at:
+        return address
+    return "{}@{}".format(local, domain.lower())
+
+
+def address_key(address):
+    return address.strip().lower()
+
+
+def domain_of(address):
+    return address.rpartition("@")[2].strip().lower()
+
+
+def normalize_recipients(email_dict):
+    # Returns a copy of the email with every address normalized and each
+    # recipient kept only once. The first appearance wins, so someone listed
+    # in both to and bcc stays a to recipient
+    normalized = dict(email_dict)
+    seen = set()
+    for recipient_type in RECIPIENT_TYPES:
+        unique = []
+        for address in email_dict.get(recipient_type, []):
+            key = address_key(address)
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(normalize_address(address))
+        normalized[recipient_type] = unique
+    return normalized
+
+
+def normalize_template_recipients(recipients):
+    seen = set()
+    unique = []
+    for recipient in recipients:
+        key = address_key(recipient["address"])
+        if key in seen:
+            continue
+        seen.add(key)
+        recipient = dict(recipient)
+        recipient["address"] = normalize_address(recipient["address"])
+        unique.append(recipient)
+    return unique
+
+
+def group_by_domain(addresses):
+    # Domains come out in the order they were first seen, each with its
+    # addresses in submission order
+    groups = collections.OrderedDict()
+    for address in addresses:
+        groups.setdefault(domain_of(address), []).append(address)
+    return [{"domain": domain, "addresses": grouped}
+            for domain, grouped in groups.items()]
+
+
+def is_valid_address(address):
+    return EMAIL_REGEX.match(address) is not None
+
+
+class AddressValidator(object):
+    # Remembers the verdict for the addresses submitted most recently. The
+    # same senders and recipients come up over and over, and a cache lookup
+    # costs a fraction of a match. Verdicts are keyed on the address exactly
+    # as submitted: normalizing it first would cost about what's saved, and
+    # " a@b.com" must not share a verdict with "a@b.com"
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._is_valid = is_valid_address
+        if cache_size:
+            self._is_valid = functools.lru_cache(maxsize=cache_size)(
+                is_valid_address)
+
+    def is_valid(self, address):
+        return self._is_valid(address)
+
+    def invalid_addresses(self, addresses):
+        # A list longer than the whole cache would only push out the
+        # addresses that keep coming back, so big mailing lists skip it
+        is_valid = self._is_valid
+        if len(addresses) > self.cache_size:
+            is_valid = is_valid_address
+        return [address for address in addresses if not is_valid(address)]
+
+    @property
+    def stats(self):
+        if not self.cache_size:
+            return {"enabled": False, "size": 0, "max_size": 0, "hits": 0,
+                    "misses": 0, "hit_rate": 0.0}
+        info = self._is_valid.cache_info()
+        lookups = info.hits + info.misses
+        return {"enabled": True,
+                "size": info.currsize,
+                "max_size": info.maxsize,
+                "hits": info.hits,
+                "misses": info.misses,
+                "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,137 @@
+import datetime
+import logging
+import math
+import threading
+import time
+
+DEFAULT_REFRESH_INTERVAL = 5
+# Without an explicit low watermark, admission reopens once the backlog has
+# drained to this fraction of the high watermark
+DEFAULT_LOW_WATERMARK_RATIO = 0.8
+
+LOG = logging.getLogger(__name__)
+
+
+def queue_depth(db):
+    # The count command runs entirely server side on the status index and is
+    # spelled the same on every pymongo version
+    return int(db.command("count", "emails",
+                          query={"status": "incomplete"})["n"])
+
+
+# The backlog is counted at most once per refresh interval, by whichever
+# request notices the estimate has gone stale. Emails admitted in between are
+# added on top, so the estimate only drifts by what the worker sent since the
+# last count. Admission closes at the high watermark and stays closed until
+# the backlog drains to the low watermark, so it doesn't flap around a single
+# threshold
+class AdmissionController(object):
+    def __init__(self, get_db, high_watermark, low_watermark=None,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        if low_watermark is None:
+            low_watermark = int(high_watermark * DEFAULT_LOW_WATERMARK_RATIO)
+        self._get_db = get_db
+        self._high = high_watermark
+        self._low = low_watermark
+        self._interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counted = None
+        self._admitted = 0
+        self._refreshed_at = None
+        self._shedding = False
+        self._stats = {"admitted": 0,
+                       "rejected": 0,
+                       "refreshes": 0,
+                       "errors": 0,
+                       "last_refresh_at": None}
+
+    @property
+    def enabled(self):
+        return self._high > 0
+
+    @property
+    def estimate(self):
+        with self._lock:
+            if self._counted is None:
+                return None
+            return self._counted + self._admitted
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["shedding"] = self._shedding
+        stats["enabled"] = self.enabled
+        stats["estimate"] = self.estimate
+        stats["high_watermark"] = self._high
+        stats["low_watermark"] = self._low
+        stats["refresh_interval"] = self._interval
+        return stats
+
+    def _stale(self):
+        return (self._refreshed_at is None or
+                self._clock() - self._refreshed_at >= self._interval)
+
+    def refresh(self):
+        depth = queue_depth(self._get_db())
+        with self._lock:
+            self._counted = depth
+            self._admitted = 0
+            self._refreshed_at = self._clock()
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh_at"] = datetime.datetime.now()
+            if depth >= self._high:
+                self._shedding = True
+            elif depth <= self._low:
+                self._shedding = False
+        return depth
+
+    def _maybe_refresh(self):
+        # Only one request pays for the count, the rest carry on with the
+        # estimate they already have
+        if not self._stale() or not self._refresh_lock.acquire(False):
+            return
+        try:
+            self.refresh()
+        except Exception:
+            LOG.exception("Refreshing the queue depth estimate failed")
+            with self._lock:
+                self._stats["errors"] += 1
+                # Back off for a full interval instead of retrying the count
+                # on every request while the database is unhappy
+                self._refreshed_at = self._clock()
+        finally:
+            self._refresh_lock.release()
+
+    def retry_after(self):
+        # Nothing can change before the next count, so that's the earliest
+        # a retry could succeed
+        if self._refreshed_at is None:
+            return max(1, int(math.ceil(self._interval)))
+        remaining = self._interval - (self._clock() - self._refreshed_at)
+        return max(1, int(math.ceil(remaining)))
+
+    def check(self):
+        # None admits the email. Otherwise the HTTP status to reject it with,
+        # 429 while the backlog is over the watermark and 503 if it has never
+        # been measured
+        if not self.enabled:
+            return None
+
+        self._maybe_refresh()
+        with self._lock:
+            if self._counted is None:
+                status = 503
+            elif self._shedding or \
+                    self._counted + self._admitted >= self._high:
+                self._shedding = True
+                status = 429
+            else:
+                self._admitted += 1
+                self._stats["admitted"] += 1
+                return None
+            self._stats["rejected"] += 1
+        return status
@@ -1,17 +1,47 @@
 import datetime
 import os
 import re
+import threading
+import time
 import uuid
 
 import flask
 import pymongo
 
+from babymailgun import addresses
+from babymailgun import admission
+from babymailgun import bodies
+from babymailgun import compression
+from babymailgun import ids
+from babymailgun import leases
+from babymailgun import limits
+from babymailgun import reaper
+from babymailgun import recipient_store
+from babymailgun import retention
+from babymailgun import servers
+from babymailgun import storage
+from babymailgun import templating
+from babymailgun import tracing
+
 MAX_RECIPIENTS = 100
+# Mailing lists keep their recipients outside the email document, so they
+# can be far larger
+MAX_LIST_RECIPIENTS = 250000
+MAX_VARIABLE_LENGTH = 1024
 MAX_SUBJECT_LENGTH = 255
 MAX_BODY_LENGTH = 16384
 
-# From http://emailregex.com/
-EMAIL_REGEX = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+EMAIL_STATUSES = ["incomplete", "complete", "failed"]
+# Higher numbers are delivered first
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+DEFAULT_PRIORITY = "normal"
+DELETE_BATCH_SIZE = 1000
+# Submission flags for kinds of email nothing can deliver yet, see
+# send_email
+UNDELIVERABLE = [("mailing_list", "Mailing lists"),
+                 ("template", "Template emails")]
+DATETIME_FORMATS = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
 SUBJECT_REGEX = re.compile(r"^[a-zA-Z0-9 ]*$")
 
 
@@ -29,11 +59,50 @@ class ConfigTypeError(MailgunException):
     message = "The key '%(key)s' must be of type %(key_type)s"
 
 
+class ConfigValueError(MailgunException):
+    message = "The key '%(key)s' must be one of %(choices)s"
+
+
+class StorageNotSupported(MailgunException):
+    message = "%(feature)s requires the mongo storage backend"
+
+
+class DeliveryNotSupported(MailgunException):
+    message = "%(feature)s can't be delivered yet"
+
+
+class InvalidWatermarks(MailgunException):
+    message = ("ADMISSION_LOW_WATERMARK (%(low)s) must not be greater than "
+               "ADMISSION_HIGH_WATERMARK (%(high)s)")
+
+
+class MissingServerField(MailgunException):
+    message = "The server field '%(field)s' is required"
+
+
+class UnknownServerField(MailgunException):
+    message = "'%(field)s' is not a server field"
+
+
+class InvalidServerField(MailgunException):
+    message = "The server field '%(field)s' must be %(expected)s"
+
+
+class DatabaseUnavailable(MailgunException):
+    message = ("Could not reach the database at %(host)s:%(port)s after "
+               "%(tries)s tries: %(reason)s")
+
+
 class TooManyRecipients(MailgunException):
     message = ("The number of recipients for any given email may not "
                "exceed {}".format(MAX_RECIPIENTS))
 
 
+class TooManyListRecipients(MailgunException):
+    message = ("The number of recipients for any given mailing list may not "
+               "exceed {}".format(MAX_LIST_RECIPIENTS))
+
+
 class SubjectTooLong(MailgunException):
     message = ("The length of the subject may not exceed {} "
                "characters".format(MAX_SUBJECT_LENGTH))
@@ -53,24 +122,228 @@ class InvalidSubject(MailgunException):
                "A-Z and 0-9 are allowed")
 
 
+class InvalidPriority(MailgunException):
+    message = "The priority '%(priority)s' must be one of low, normal or high"
+
+
+class InvalidSendAt(MailgunException):
+    message = ("The send_at '%(send_at)s' must be a date of the form "
+               "YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
+
+
+class NoRecipients(MailgunException):
+    message = "A template email must have at least one recipient"
+
+
+class MissingTemplateVariable(MailgunException):
+    message = ("The recipient '%(email)s' is missing the template "
+               "variable '%(variable)s'")
+
+
+class InvalidTemplateVariable(MailgunException):
+    message = ("The template variable '%(variable)s' for recipient "
+               "'%(email)s' is invalid: %(reason)s")
+
+
+class RenderedTooLong(MailgunException):
+    message = ("The %(field)s rendered for recipient '%(email)s' is longer "
+               "than %(limit)d characters")
+
+
+class InvalidFilter(MailgunException):
+    message = "Invalid filter '%(key)s': %(reason)s"
+
+
+class MissingFilter(MailgunException):
+    message = ("At least one of the status, sender or before filters "
+               "is required")
+
+
 def get_env(key):
     if key not in os.environ:
         raise ConfigKeyNotFound(key=key)
     return os.environ[key]
 
 
+def get_env_int(key, default=None):
+    if key not in os.environ:
+        return default
+    try:
+        return int(os.environ[key])
+    except ValueError:
+        raise ConfigTypeError(key=key, key_type="int")
+
+
+def get_env_bool(key, default=False):
+    if key not in os.environ:
+        return default
+    value = os.environ[key].lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    raise ConfigTypeError(key=key, key_type="bool")
+
+
 app = flask.Flask(__name__)
 
 
-@app.before_first_request
+class Resources(object):
+    # Everything the app builds on first use and then shares between
+    # requests. One MongoClient per process: pymongo pools connections
+    # internally and is thread safe, but a client must never be carried
+    # across a fork, so pre-fork servers call reset_db_client() in each
+    # child
+    def __init__(self):
+        self.db_client = None
+        self.db_client_lock = threading.Lock()
+        self.reaper = None
+        self.admission = None
+        self.trace_exporter = None
+        self.memory_storage = None
+        self.address_validator = None
+
+
+resources = Resources()
+
+
 def setup_app():
-    app.config["DB_HOST"] = get_env("DB_HOST")
-    try:
-        app.config["DB_PORT"] = int(get_env("DB_PORT"))
-    except ValueError:
-        raise ConfigTypeError(key="DB_PORT", key_type="int")
+    backend = os.environ.get("STORAGE_BACKEND", "mongo")
+    if backend not in storage.STORAGE_BACKENDS:
+        raise ConfigValueError(key="STORAGE_BACKEND",
+                               choices=", ".join(storage.STORAGE_BACKENDS))
+    app.config["STORAGE_BACKEND"] = backend
+
+    # The memory backend runs without a database at all
+    if backend == "mongo":
+        app.config["DB_HOST"] = get_env("DB_HOST")
+        try:
+            app.config["DB_PORT"] = int(get_env("DB_PORT"))
+        except ValueError:
+            raise ConfigTypeError(key="DB_PORT", key_type="int")
+
+        app.config["DB_NAME"] = get_env("DB_NAME")
+    app.config["DB_CONNECT_RETRIES"] = get_env_int("DB_CONNECT_RETRIES", 5)
+    app.config["DB_CONNECT_TIMEOUT"] = get_env_int("DB_CONNECT_TIMEOUT", 5)
+    app.config["RETENTION_DAYS"] = get_env_int("RETENTION_DAYS", 30)
+    app.config["ARCHIVE_TTL_DAYS"] = get_env_int("ARCHIVE_TTL_DAYS")
+    app.config["DEDUPLICATE_BODIES"] = get_env_bool("DEDUPLICATE_BODIES")
+    # Shared with the Go worker, keep the default in step with it
+    app.config["SEND_RETRY_INTERVAL"] = get_env_int("SEND_RETRY_INTERVAL", 600)
+    app.config["LEASE_DURATION"] = get_env_int("LEASE_DURATION",
+                                               reaper.DEFAULT_LEASE_SECONDS)
+    # Seconds between background stale lease sweeps, 0 disables them
+    app.config["REAPER_INTERVAL"] = get_env_int("REAPER_INTERVAL", 0)
+
+    id_scheme = os.environ.get("EMAIL_ID_SCHEME", "uuid4")
+    if id_scheme not in ids.ID_SCHEMES:
+        raise ConfigValueError(key="EMAIL_ID_SCHEME",
+                               choices=", ".join(ids.ID_SCHEMES))
+    app.config["EMAIL_ID_SCHEME"] = id_scheme
+
+    # Incomplete emails at which new submissions are turned away, 0 disables
+    # admission control
+    high = get_env_int("ADMISSION_HIGH_WATERMARK", 0)
+    low = get_env_int("ADMISSION_LOW_WATERMARK")
+    if high and low is not None and low > high:
+        raise InvalidWatermarks(low=low, high=high)
+    app.config["ADMISSION_HIGH_WATERMARK"] = high
+    app.config["ADMISSION_LOW_WATERMARK"] = low
+    app.config["ADMISSION_REFRESH_INTERVAL"] = get_env_int(
+        "ADMISSION_REFRESH_INTERVAL", admission.DEFAULT_REFRESH_INTERVAL)
+
+    trace_export = os.environ.get("TRACE_EXPORT", "none")
+    if trace_export not in tracing.EXPORTERS:
+        raise ConfigValueError(key="TRACE_EXPORT",
+                               choices=", ".join(tracing.EXPORTERS))
+    app.config["TRACE_EXPORT"] = trace_export
+    app.config["TRACE_FILE"] = os.environ.get("TRACE_FILE",
+                                              tracing.DEFAULT_TRACE_FILE)
+    # Only requests at least this slow are exported
+    app.config["TRACE_SLOW_MS"] = get_env_int("TRACE_SLOW_MS", 0)
+
+    # Distinct addresses whose verdicts are cached, 0 disables the cache
+    app.config["ADDRESS_CACHE_SIZE"] = get_env_int(
+        "ADDRESS_CACHE_SIZE", addresses.DEFAULT_CACHE_SIZE)
+
+    # Flask's own setting, so form bodies are held to it too
+    app.config["MAX_CONTENT_LENGTH"] = get_env_int(
+        "MAX_CONTENT_LENGTH", limits.DEFAULT_MAX_CONTENT_LENGTH)
 
-    app.config["DB_NAME"] = get_env("DB_NAME")
+    app.config["COMPRESS_RESPONSES"] = get_env_bool("COMPRESS_RESPONSES",
+                                                    True)
+    # Smaller responses gain little and still cost a compressor each
+    app.config["COMPRESS_MIN_SIZE"] = get_env_int(
+        "COMPRESS_MIN_SIZE", compression.DEFAULT_MIN_SIZE)
+
+    if backend == "memory":
+        for key in ("DEDUPLICATE_BODIES", "ADMISSION_HIGH_WATERMARK",
+                    "REAPER_INTERVAL"):
+            if app.config[key]:
+                raise StorageNotSupported(feature=key)
+
+
+def _is_int(value):
+    # bool is an int as far as isinstance is concerned
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_server(server_dict, partial=False):
+    if not isinstance(server_dict, dict):
+        raise MissingServerField(field="hostname")
+
+    for field in server_dict:
+        if field not in servers.SERVER_FIELDS:
+            raise UnknownServerField(field=field)
+
+    if not partial:
+        for field in ("hostname", "port"):
+            if field not in server_dict:
+                raise MissingServerField(field=field)
+
+    for field in ("hostname", "username", "password"):
+        if field in server_dict and \
+                not isinstance(server_dict[field], str):
+            raise InvalidServerField(field=field, expected="a string")
+
+    if "hostname" in server_dict and not server_dict["hostname"]:
+        raise InvalidServerField(field="hostname", expected="a string")
+
+    port = server_dict.get("port", 1)
+    if not _is_int(port) or not 0 < port < 65536:
+        raise InvalidServerField(field="port",
+                                 expected="an integer from 1 to 65535")
+
+    weight = server_dict.get("weight", servers.DEFAULT_WEIGHT)
+    if not _is_int(weight) or not 0 <= weight <= servers.MAX_WEIGHT:
+        raise InvalidServerField(
+            field="weight",
+            expected="an integer from 0 to {}".format(servers.MAX_WEIGHT))
+
+    max_concurrency = server_dict.get("max_concurrency",
+                                      servers.DEFAULT_MAX_CONCURRENCY)
+    if not _is_int(max_concurrency) or max_concurrency < 1:
+        raise InvalidServerField(field="max_concurrency",
+                                 expected="a positive integer")
+
+    if not isinstance(server_dict.get("enabled", True), bool):
+        raise InvalidServerField(field="enabled", expected="true or false")
+
+
+def to_schedule(email_dict):
+    priority = email_dict.get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITIES:
+        raise InvalidPriority(priority=priority)
+
+    # send_at is UTC, the clock the worker compares it against. Emails
+    # without one are due as soon as they're queued
+    send_at = email_dict.get("send_at")
+    if send_at is None:
+        return PRIORITIES[priority], datetime.datetime.utcnow()
+    try:
+        return PRIORITIES[priority], parse_datetime(send_at)
+    except (TypeError, ValueError):
+        raise InvalidSendAt(send_at=send_at)
 
 
 def validate_email(email_dict):
@@ -79,7 +352,10 @@ def validate_email(email_dict):
     to = email_dict["to"]
     cc = email_dict["cc"]
     bcc = email_dict["bcc"]
-    if len(to) + len(cc) + len(bcc) > MAX_RECIPIENTS:
+    if email_dict.get("mailing_list"):
+        if len(to) + len(cc) + len(bcc) > MAX_LIST_RECIPIENTS:
+            raise TooManyListRecipients()
+    elif len(to) + len(cc) + len(bcc) > MAX_RECIPIENTS:
         raise TooManyRecipients()
 
     if len(email_dict["subject"]) > MAX_SUBJECT_LENGTH:
@@ -93,14 +369,89 @@ def validate_email(email_dict):
     if not SUBJECT_REGEX.match(email_dict["subject"]):
         raise InvalidSubject()
 
-    if not EMAIL_REGEX.match(email_dict["from"]):
+    validator = _get_address_validator()
+    if not validator.is_valid(email_dict["from"]):
         raise InvalidEmailAddress(email=email_dict["from"],
                                   header="from")
 
     for header in ["to", "cc", "bcc"]:
-        for email in email_dict[header]:
-            if not EMAIL_REGEX.match(email):
-                raise InvalidEmailAddress(email=email, header=header)
+        invalid = validator.invalid_addresses(email_dict[header])
+        if invalid:
+            raise InvalidEmailAddress(email=invalid[0], header=header)
+
+    to_schedule(email_dict)
+
+
+def validate_template_email(email_dict):
+    # Only the template itself is checked against the subject and body
+    # limits. Rendering every recipient's copy here would cost exactly what
+    # templates exist to avoid, so variables are bounded instead
+    template_recipients = email_dict["recipients"]
+    if not template_recipients:
+        raise NoRecipients()
+    if len(template_recipients) > MAX_LIST_RECIPIENTS:
+        raise TooManyListRecipients()
+
+    if len(email_dict["subject"]) > MAX_SUBJECT_LENGTH:
+        raise SubjectTooLong()
+
+    if len(email_dict["body"]) > MAX_BODY_LENGTH:
+        raise BodyTooLong()
+
+    if not SUBJECT_REGEX.match(
+            templating.strip_placeholders(email_dict["subject"])):
+        raise InvalidSubject()
+
+    validator = _get_address_validator()
+    if not validator.is_valid(email_dict["from"]):
+        raise InvalidEmailAddress(email=email_dict["from"],
+                                  header="from")
+
+    to_schedule(email_dict)
+
+    invalid = validator.invalid_addresses(
+        [recipient.get("address", "") for recipient in template_recipients])
+    if invalid:
+        raise InvalidEmailAddress(email=invalid[0], header="to")
+
+    # Variables may each be up to MAX_VARIABLE_LENGTH and appear any number
+    # of times, so a template within the limits can still render past them.
+    # The rendered length is worked out from the counts instead
+    lengths = {}
+    for field, limit in (("subject", MAX_SUBJECT_LENGTH),
+                         ("body", MAX_BODY_LENGTH)):
+        lengths[field] = (
+            len(templating.strip_placeholders(email_dict[field])),
+            templating.placeholder_counts(email_dict[field]), limit)
+
+    subject_variables = set(lengths["subject"][1])
+    required = subject_variables | set(lengths["body"][1])
+    for recipient in template_recipients:
+        address = recipient["address"]
+
+        variables = recipient.get("variables", {})
+        for variable in required:
+            if variable not in variables:
+                raise MissingTemplateVariable(email=address,
+                                              variable=variable)
+
+            value = str(variables[variable])
+            if len(value) > MAX_VARIABLE_LENGTH:
+                raise InvalidTemplateVariable(
+                    email=address, variable=variable,
+                    reason="longer than {} characters".format(
+                        MAX_VARIABLE_LENGTH))
+            if variable in subject_variables and \
+                    not SUBJECT_REGEX.match(value):
+                raise InvalidTemplateVariable(
+                    email=address, variable=variable,
+                    reason="only a-z, A-Z and 0-9 are allowed in the subject")
+
+        for field, (static_length, counts, limit) in lengths.items():
+            if templating.rendered_length(static_length, counts,
+                                          variables) > limit:
+                raise RenderedTooLong(field=field, email=address,
+                                      limit=limit)
 
 
 def to_email_model(email_id, email_dict):
@@ -112,36 +463,362 @@ def to_email_model(email_id, email_dict):
                  "status": 0,
                  "reason": ""} for a in recipients]
 
-    for receiver_type in ["to", "cc", "bcc"]:
-        recipients.extend(to_recipients(email_dict[receiver_type],
-                                        receiver_type))
+    # Mailing list recipients go to their own collection, see
+    # recipient_store.insert_recipients
+    mailing_list = email_dict.get("mailing_list", False)
+    if not mailing_list:
+        for receiver_type in ["to", "cc", "bcc"]:
+            recipients.extend(to_recipients(email_dict[receiver_type],
+                                            receiver_type))
+
+    priority, send_at = to_schedule(email_dict)
+    model = {"_id": email_id,
+             "headers": [],
+             "subject": email_dict["subject"],
+             "body": email_dict["body"],
+             "sender": email_dict["from"],
+             "recipients": recipients,
+             "created_at": datetime.datetime.now(),
+             "updated_at": datetime.datetime.fromtimestamp(0),
+             "status": "incomplete",
+             "reason": "",
+             "tries": 0,
+             "priority": priority,
+             "send_at": send_at,
+             "worker_id": None}
+
+    if mailing_list:
+        model["recipient_storage"] = recipient_store.STORAGE_EXTERNAL
+        model["recipient_count"] = sum(len(email_dict[t])
+                                       for t in ["to", "cc", "bcc"])
+    else:
+        # Lets delivery handle each destination domain in one go. List
+        # recipients carry their domain in the recipients collection instead
+        model["domains"] = addresses.group_by_domain(
+            [r["address"] for r in recipients])
+    return model
+
+
+def to_template_model(email_id, email_dict):
+    model = to_email_model(email_id, {"subject": email_dict["subject"],
+                                      "body": email_dict["body"],
+                                      "from": email_dict["from"],
+                                      "to": [], "cc": [], "bcc": [],
+                                      "priority": email_dict.get(
+                                          "priority", DEFAULT_PRIORITY),
+                                      "send_at": email_dict.get("send_at"),
+                                      "mailing_list": True})
+    model["template"] = True
+    model["recipient_count"] = len(email_dict["recipients"])
+    return model
+
+
+def parse_datetime(value):
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError("'{}' is not a date of the form YYYY-MM-DD or "
+                     "YYYY-MM-DDTHH:MM:SS".format(value))
+
+
+def to_delete_filter(args):
+    query = {}
+    if "status" in args:
+        if args["status"] not in EMAIL_STATUSES:
+            raise InvalidFilter(key="status",
+                                reason="must be one of {}".format(
+                                    ", ".join(EMAIL_STATUSES)))
+        query["status"] = args["status"]
+
+    if "sender" in args:
+        query["sender"] = args["sender"]
+
+    if "before" in args:
+        try:
+            query["created_at"] = {"$lt": parse_datetime(args["before"])}
+        except ValueError as e:
+            raise InvalidFilter(key="before", reason=str(e))
+
+    if not query:
+        raise MissingFilter()
+
+    # Never pull an email out from under a worker that's sending it
+    query["worker_id"] = None
+    return query
+
+
+def count_matching(collection, query):
+    # The count command runs on the server, so a dry run over millions of
+    # emails doesn't pull each of their ids back to count them
+    return int(collection.database.command("count", collection.name,
+                                           query=query)["n"])
+
+
+def delete_matching(db, query, batch_size=DELETE_BATCH_SIZE):
+    # Deleted a chunk at a time so the shared bodies and external
+    # recipients each email references are released along with it
+    deleted = 0
+    projection = {"_id": 1, "body_hash": 1, "recipient_storage": 1}
+    while True:
+        batch = list(db.emails.find(query, projection).limit(batch_size))
+        if not batch:
+            break
+
+        email_ids = [email["_id"] for email in batch]
+        chunk_query = dict(query)
+        chunk_query["_id"] = {"$in": email_ids}
+        count = db.emails.delete_many(chunk_query).deleted_count
+        if count < len(batch):
+            remaining = {e["_id"] for e in db.emails.find(
+                {"_id": {"$in": email_ids}}, {"_id": 1})}
+            batch = [e for e in batch if e["_id"] not in remaining]
+
+        recipient_store.delete_recipients(
+            db, [e["_id"] for e in batch
+                 if e.get("recipient_storage") ==
+                 recipient_store.STORAGE_EXTERNAL])
+        bodies.release_bodies(db, [e.get("body_hash") for e in batch])
+
+        deleted += count
+        if count == 0:
+            break
+    return deleted
 
-    return {"_id": email_id,
-            "headers": [],
-            "subject": email_dict["subject"],
-            "body": email_dict["body"],
-            "sender": email_dict["from"],
-            "recipients": recipients,
-            "created_at": datetime.datetime.now(),
-            "updated_at": datetime.datetime.fromtimestamp(0),
-            "status": "incomplete",
-            "reason": "",
-            "tries": 0,
-            "worker_id": None}
 
+def _get_flag(args, key):
+    return args.get(key, "false").lower() in ("1", "true", "yes")
 
-def _get_db_client():
-    client = pymongo.MongoClient(app.config["DB_HOST"], app.config["DB_PORT"])
-    db = client[app.config["DB_NAME"]]
-    return db
+
+def get_db_client():
+    if _using_memory_storage():
+        raise StorageNotSupported(feature=flask.request.path
+                                  if flask.has_request_context()
+                                  else "The database")
+    if resources.db_client is None:
+        with resources.db_client_lock:
+            if resources.db_client is None:
+                timeout_ms = app.config["DB_CONNECT_TIMEOUT"] * 1000
+                resources.db_client = pymongo.MongoClient(
+                    app.config["DB_HOST"], app.config["DB_PORT"],
+                    connect=False, serverSelectionTimeoutMS=timeout_ms)
+    return resources.db_client[app.config["DB_NAME"]]
+
+
+def _using_memory_storage():
+    return app.config.get("STORAGE_BACKEND", "mongo") == "memory"
+
+
+def _get_storage():
+    if _using_memory_storage():
+        if resources.memory_storage is None:
+            resources.memory_storage = storage.MemoryStorage()
+        return resources.memory_storage
+    return storage.MongoStorage(get_db_client())
+
+
+def reset_db_client():
+    # Dropped rather than closed. After a fork any sockets the old client
+    # holds belong to the parent process
+    with resources.db_client_lock:
+        resources.db_client = None
+
+
+def priority_name(priority):
+    for name, value in PRIORITIES.items():
+        if value == priority:
+            return name
+    return DEFAULT_PRIORITY
+
+
+def backfill_schedule(db):
+    # Queued emails from before priorities existed are normal priority and
+    # due immediately. Once filled in, the claim query never has to special
+    # case a missing field. Only the queue matters, so both the probe and
+    # the update stay on the claim index, and once everything is filled in
+    # a startup costs a lookup rather than a write over every email
+    for field, value in (("priority", PRIORITIES[DEFAULT_PRIORITY]),
+                         ("send_at", datetime.datetime.fromtimestamp(0))):
+        query = {"status": "incomplete", field: {"$exists": False}}
+        if db.emails.find_one(query, {"_id": 1}) is not None:
+            db.emails.update_many(query, {"$set": {field: value}})
+
+
+def ensure_indexes(db):
+    # Backs the worker's FetchReadyEmail claim query, which takes the
+    # highest priority due email first
+    db.emails.create_index([("status", pymongo.ASCENDING),
+                            ("worker_id", pymongo.ASCENDING),
+                            ("priority", pymongo.DESCENDING),
+                            ("send_at", pymongo.ASCENDING)])
+    backfill_schedule(db)
+    retention.ensure_indexes(db, app.config["ARCHIVE_TTL_DAYS"])
+    recipient_store.ensure_indexes(db)
+    leases.ensure_indexes(db)
+    reaper.ensure_indexes(db)
+    servers.ensure_table(db)
+
+
+def wait_for_db(db):
+    retries = max(1, app.config["DB_CONNECT_RETRIES"])
+    error = None
+    for i in range(retries):
+        try:
+            db.command("ping")
+            return
+        except pymongo.errors.PyMongoError as e:
+            app.logger.warning("Database ping failed, %d tries remaining",
+                               retries - i - 1)
+            error = e
+            if i < retries - 1:
+                time.sleep(1)
+    raise DatabaseUnavailable(host=app.config["DB_HOST"],
+                              port=app.config["DB_PORT"],
+                              tries=retries, reason=error)
+
+
+def warm_up():
+    if not _using_memory_storage():
+        db = get_db_client()
+        wait_for_db(db)
+        ensure_indexes(db)
+    app.config["READY"] = True
+
+
+def _get_reaper():
+    if resources.reaper is None:
+        resources.reaper = reaper.Reaper(
+            get_db_client,
+            lease_seconds=app.config["LEASE_DURATION"],
+            interval=app.config["REAPER_INTERVAL"])
+    return resources.reaper
+
+
+def _get_admission():
+    if resources.admission is None:
+        resources.admission = admission.AdmissionController(
+            get_db_client,
+            app.config["ADMISSION_HIGH_WATERMARK"],
+            low_watermark=app.config["ADMISSION_LOW_WATERMARK"],
+            refresh_interval=app.config["ADMISSION_REFRESH_INTERVAL"])
+    return resources.admission
+
+
+def _get_address_validator():
+    if resources.address_validator is None:
+        resources.address_validator = addresses.AddressValidator(
+            app.config.get("ADDRESS_CACHE_SIZE",
+                           addresses.DEFAULT_CACHE_SIZE))
+    return resources.address_validator
+
+
+def _get_trace_exporter():
+    if resources.trace_exporter is None:
+        # Requests can arrive before setup_app in tests, so fall back to not
+        # exporting anything
+        resources.trace_exporter = tracing.Exporter(
+            app.config.get("TRACE_EXPORT", "none"),
+            path=app.config.get("TRACE_FILE", tracing.DEFAULT_TRACE_FILE),
+            slow_ms=app.config.get("TRACE_SLOW_MS", 0))
+    return resources.trace_exporter
+
+
+@app.before_request
+def start_trace():
+    correlation_id = tracing.to_correlation_id(
+        flask.request.headers.get(tracing.HEADER))
+    flask.g.trace = tracing.Trace(correlation_id, "{} {}".format(
+        flask.request.method, flask.request.path))
+
+
+@app.after_request
+def finish_trace(response):
+    trace = tracing.current()
+    if trace is None:
+        return response
+    response.headers[tracing.HEADER] = trace.correlation_id
+    _get_trace_exporter().export(trace.finish(status=response.status_code))
+    return response
+
+
+# Registered after finish_trace so it runs before it, and the trace
+# includes the time spent compressing
+@app.after_request
+def compress_response(response):
+    if not app.config.get("COMPRESS_RESPONSES", True):
+        return response
+    with tracing.span("compress"):
+        return compression.compress_response(
+            response, flask.request.headers.get("Accept-Encoding"),
+            min_size=app.config.get("COMPRESS_MIN_SIZE",
+                                    compression.DEFAULT_MIN_SIZE))
+
+
+def create_app():
+    # Entry point for WSGI servers and the dev server. Everything the first
+    # request would otherwise pay for happens here, so a misconfigured or
+    # disconnected instance fails at boot instead of under traffic
+    app.config["READY"] = False
+    setup_app()
+    warm_up()
+    _get_reaper().start()
+    return app
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    if not app.config.get("READY"):
+        return ("Warming up", 503)
+
+    try:
+        _get_storage().ping()
+    except pymongo.errors.PyMongoError:
+        return ("Database unavailable", 503)
+    return ("", 204)
+
+
+@app.errorhandler(StorageNotSupported)
+def storage_not_supported(e):
+    return (str(e), 501)
+
+
+@app.errorhandler(DeliveryNotSupported)
+def delivery_not_supported(e):
+    return (str(e), 501)
 
 
 @app.route("/emails", methods=["GET"])
 def list_emails():
     app.logger.debug("GET /emails")
-    db = _get_db_client()
+    args = flask.request.args
+    # Without a limit every email comes back in one response, as it always
+    # has
+    try:
+        limit = int(args["limit"]) if "limit" in args else None
+    except ValueError:
+        return ("limit must be an integer", 400)
+
+    if limit is not None and not 0 < limit <= storage.MAX_PAGE_SIZE:
+        return ("limit must be between 1 and {}".format(
+            storage.MAX_PAGE_SIZE), 400)
+
+    status = args.get("status")
+    if status is not None and status not in EMAIL_STATUSES:
+        return ("status must be one of {}".format(
+            ", ".join(EMAIL_STATUSES)), 400)
+
+    before = None
+    if "before" in args:
+        try:
+            before = parse_datetime(args["before"])
+        except ValueError as e:
+            return (str(e), 400)
+
+    stored, next_cursor = _get_storage().list_emails(
+        status=status, before=before, after=args.get("after"), limit=limit)
     emails = []
-    for email in db.emails.find():
+    for email in stored:
         emails.append({
             "id": email["_id"],
             "sender": email["sender"],
@@ -149,45 +826,216 @@ def list_emails():
             "reason": email["reason"],
             "created_at": email["created_at"],
             "updated_at": email["updated_at"],
+            "priority": priority_name(email.get("priority")),
+            "send_at": email.get("send_at"),
             "tries": email["tries"]})
-    return flask.jsonify(emails)
+
+    resp = flask.jsonify(emails)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
+
+
+@app.route("/storage", methods=["GET"])
+def storage_stats():
+    app.logger.debug("GET /storage")
+    return flask.jsonify(_get_storage().stats())
+
+
+@app.route("/schedule", methods=["GET"])
+def show_schedule():
+    app.logger.debug("GET /schedule")
+    try:
+        limit = int(flask.request.args.get("limit", 100))
+    except ValueError:
+        return ("limit must be an integer", 400)
+
+    if limit <= 0:
+        return ("limit must be > 0", 400)
+
+    # Everything still waiting to go out, in the order the worker will
+    # pick it up
+    db = get_db_client()
+    cursor = db.emails.find(
+        {"status": "incomplete", "worker_id": None},
+        {"sender": 1, "priority": 1, "send_at": 1, "tries": 1}).sort(
+            [("priority", pymongo.DESCENDING),
+             ("send_at", pymongo.ASCENDING)]).limit(limit)
+
+    now = datetime.datetime.utcnow()
+    schedule = []
+    for email in cursor:
+        send_at = email.get("send_at")
+        schedule.append({"id": email["_id"],
+                         "sender": email["sender"],
+                         "priority": priority_name(email.get("priority")),
+                         "send_at": send_at,
+                         "due": send_at is None or send_at <= now,
+                         "tries": email["tries"]})
+    return flask.jsonify(schedule)
 
 
 @app.route("/emails/<email_id>", methods=["GET"])
 def show_email(email_id):
     app.logger.debug("GET /emails/%s", email_id)
-    db = _get_db_client()
-    email = db.emails.find_one({"_id": email_id})
+    email = _get_storage().get_email(email_id)
     if not email:
         return ("", 404)
 
+    domains = [{"domain": group["domain"],
+                "count": len(group["addresses"])}
+               for group in email.get("domains", [])]
     email = {"id": email["_id"],
              "sender": email["sender"],
              "status": email["status"],
              "reason": email["reason"],
-             "body": email["body"],
+             "body": _resolve_body(email),
+             "template": email.get("template", False),
+             "domains": domains,
+             "correlation_id": email.get("correlation_id"),
              "created_at": email["created_at"],
              "updated_at": email["updated_at"],
+             "priority": priority_name(email.get("priority")),
+             "send_at": email.get("send_at"),
              "tries": email["tries"]}
     return flask.jsonify(email)
 
 
+def _resolve_body(email):
+    # Only shared bodies live outside the email, and only Mongo stores those
+    if not email.get("body_hash"):
+        return email.get("body", "")
+    return bodies.resolve_body(get_db_client(), email)
+
+
 @app.route("/emails/<email_id>/recipients", methods=["GET"])
 def show_email_recipients(email_id):
     # NOTE(mdietz): In the real world we'd stick a cache+rate limiting of some
     #               kind here as users would hammer this endpoint
     app.logger.debug("GET /emails/%s/recipients", email_id)
-    db = _get_db_client()
-    email = db.emails.find_one({"_id": email_id})
+    args = flask.request.args
+    try:
+        status = int(args["status"]) if "status" in args else None
+        limit = int(args.get("limit", recipient_store.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return ("status and limit must be integers", 400)
+
+    if not 0 < limit <= recipient_store.MAX_PAGE_SIZE:
+        return ("limit must be between 1 and {}".format(
+            recipient_store.MAX_PAGE_SIZE), 400)
+
+    domain = args.get("domain")
+    if domain is not None:
+        domain = domain.lower()
+
+    db = get_db_client()
+    email = db.emails.find_one({"_id": email_id},
+                               {"recipients": 1, "recipient_storage": 1})
     if not email:
         return ("", 404)
 
+    next_cursor = None
+    if email.get("recipient_storage") == recipient_store.STORAGE_EXTERNAL:
+        stored, next_cursor = recipient_store.list_recipients(
+            db, email_id, status=status, after=args.get("after"),
+            limit=limit, domain=domain)
+    else:
+        stored = [r for r in email["recipients"]
+                  if (status is None or r["status"] == status) and
+                  (domain is None or
+                   addresses.domain_of(r["address"]) == domain)]
+
     recipients = []
-    for recipient in email["recipients"]:
+    for recipient in stored:
         recipients.append({"address": recipient["address"],
                            "type": recipient["type"],
+                           "status": recipient["status"],
                            "reason": recipient["reason"]})
-    return flask.jsonify(recipients)
+
+    resp = flask.jsonify(recipients)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
+
+
+@app.route("/emails/<email_id>/preview", methods=["GET"])
+def preview_email(email_id):
+    app.logger.debug("GET /emails/%s/preview", email_id)
+    address = flask.request.args.get("address")
+    if not address:
+        return ("address is required", 400)
+
+    db = get_db_client()
+    email = db.emails.find_one({"_id": email_id},
+                               {"subject": 1, "body": 1, "body_hash": 1,
+                                "template": 1})
+    if not email:
+        return ("", 404)
+    email["body"] = bodies.resolve_body(db, email)
+
+    if not email.get("template"):
+        return flask.jsonify({"address": address,
+                              "subject": email["subject"],
+                              "body": email["body"]})
+
+    recipient = recipient_store.find_recipient(
+        db, email_id, addresses.normalize_address(address))
+    if not recipient:
+        return ("", 404)
+    return flask.jsonify(templating.render_email(email, recipient))
+
+
+@app.route("/emails/<email_id>/recipients/<address>", methods=["PATCH"])
+def update_email_recipient(email_id, address):
+    app.logger.debug("PATCH /emails/%s/recipients/%s", email_id, address)
+    headers = flask.request.headers
+    if ("content-type" not in headers or
+            headers["content-type"].lower() != "application/json"):
+        return ("Invalid content-type or no content-type specified", 415)
+
+    data = flask.request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get("status"), int):
+        return ("status is required and must be an integer", 400)
+    reason = data.get("reason", "")
+    # Stored addresses were normalized when the email was queued
+    address = addresses.normalize_address(address)
+
+    db = get_db_client()
+    email = db.emails.find_one({"_id": email_id}, {"recipient_storage": 1})
+    if not email:
+        return ("", 404)
+
+    if email.get("recipient_storage") == recipient_store.STORAGE_EXTERNAL:
+        matched = recipient_store.update_recipient(db, email_id, address,
+                                                   data["status"], reason)
+    else:
+        matched = db.emails.update_one(
+            {"_id": email_id, "recipients.address": address},
+            {"$set": {"recipients.$.status": data["status"],
+                      "recipients.$.reason": reason}}).matched_count
+
+    if not matched:
+        return ("", 404)
+    return ("", 204)
+
+
+def _too_large(reason):
+    # The rest of the body is never read, so the connection can't be reused
+    return (reason, 413, {"Connection": "close"})
+
+
+def read_email_json():
+    # Turns away what can't be valid as early as possible: on the declared
+    # length before reading anything, then while the body streams in
+    max_length = app.config.get("MAX_CONTENT_LENGTH") or \
+        limits.DEFAULT_MAX_CONTENT_LENGTH
+    if (flask.request.content_length or 0) > max_length:
+        raise limits.LimitExceeded("The request body is larger than {} "
+                                   "bytes".format(max_length))
+
+    scanner = limits.EmailScanner(
+        MAX_LIST_RECIPIENTS, limits.max_string_length(MAX_BODY_LENGTH))
+    return limits.read_json(flask.request.stream, max_length, scanner)
 
 
 @app.route("/emails", methods=["POST"])
@@ -199,17 +1047,88 @@ def send_email():
              headers["content-type"].lower() != "application/json")):
         return ("Invalid content-type or no content-type specified", 415)
 
-    data = flask.request.get_json()
+    try:
+        with tracing.span("parse_json"):
+            data = read_email_json()
+    except limits.LimitExceeded as e:
+        return _too_large(str(e))
+    except ValueError:
+        return ("The request body is not valid JSON", 400)
+
+    if not isinstance(data, dict):
+        return ("The request body must be a JSON object", 400)
+    # Neither the worker nor /leases reads recipients kept in their own
+    # collection or renders templates, so these would sit in the queue
+    # forever. Turned away until something can deliver them
+    for flag, feature in UNDELIVERABLE:
+        if data.get(flag):
+            raise DeliveryNotSupported(feature=feature)
+    is_template = data.get("template", False)
 
     try:
-        validate_email(data)
+        with tracing.span("validate"):
+            if is_template:
+                validate_template_email(data)
+            else:
+                validate_email(data)
     except Exception as e:
         return (str(e), 400)
 
-    db = _get_db_client()
-    email_id = str(uuid.uuid4())
-    email = to_email_model(email_id, data)
-    db.emails.insert_one(email)
+    with tracing.span("normalize"):
+        if is_template:
+            data["recipients"] = addresses.normalize_template_recipients(
+                data["recipients"])
+        else:
+            data = addresses.normalize_recipients(data)
+
+    # Invalid submissions are answered first, retrying those would be
+    # pointless
+    controller = _get_admission()
+    with tracing.span("admission"):
+        rejected = controller.check()
+    if rejected:
+        reason = "The delivery queue is full, try again later"
+        if rejected == 503:
+            reason = "The delivery queue depth is unknown, try again later"
+        return (reason, rejected,
+                {"Retry-After": str(controller.retry_after())})
+
+    email_id = ids.new_email_id(app.config["EMAIL_ID_SCHEME"])
+    with tracing.span("build_model"):
+        if is_template:
+            email = to_template_model(email_id, data)
+            documents = recipient_store.to_template_recipient_documents(
+                email_id, data["recipients"])
+        else:
+            email = to_email_model(email_id, data)
+            documents = recipient_store.to_recipient_documents(email_id,
+                                                               data)
+    # Lets a slow or failed delivery be tied back to the request that
+    # queued it
+    email["correlation_id"] = tracing.current_correlation_id()
+
+    if email.get("recipient_storage") == recipient_store.STORAGE_EXTERNAL:
+        if _using_memory_storage():
+            raise StorageNotSupported(
+                feature="Storing mailing list and template recipients")
+        # Recipients first, so the email is never visible without them
+        db = get_db_client()
+        with tracing.span("db.insert_recipients"):
+            recipient_store.insert_recipients(db, documents)
+
+    if app.config["DEDUPLICATE_BODIES"]:
+        db = get_db_client()
+        with tracing.span("db.store_body"):
+            stored = bodies.deduplicate_model(db, email)
+        try:
+            with tracing.span("db.insert_email"):
+                db.emails.insert_one(stored)
+        except pymongo.errors.PyMongoError:
+            bodies.release_bodies(db, [stored["body_hash"]])
+            raise
+    else:
+        with tracing.span("db.insert_email"):
+            _get_storage().insert_email(email)
     email.pop("_id")
     email["id"] = email_id
 
@@ -219,9 +1138,297 @@ def send_email():
 @app.route("/emails/<email_id>", methods=["DELETE"])
 def delete_email(email_id):
     app.logger.debug("DELETE /emails/%s", email_id)
-    db = _get_db_client()
-    delete_result = db.emails.delete_one({"_id": email_id})
-    if delete_result.deleted_count == 0:
+    deleted = _get_storage().delete_email(
+        email_id, {"recipient_storage": 1, "body_hash": 1})
+    if not deleted:
+        return ("", 404)
+
+    if deleted.get("recipient_storage") == recipient_store.STORAGE_EXTERNAL:
+        recipient_store.delete_recipients(get_db_client(), [email_id])
+    if deleted.get("body_hash"):
+        bodies.release_bodies(get_db_client(), [deleted["body_hash"]])
+    return ("", 204)
+
+
+@app.route("/emails", methods=["DELETE"])
+def delete_emails():
+    app.logger.debug("DELETE /emails")
+    args = flask.request.args
+    try:
+        query = to_delete_filter(args)
+    except (InvalidFilter, MissingFilter) as e:
+        return (str(e), 400)
+
+    dry_run = _get_flag(args, "dry_run")
+
+    db = get_db_client()
+    if dry_run:
+        deleted = count_matching(db.emails, query)
+    else:
+        deleted = delete_matching(db, query)
+    return flask.jsonify({"deleted": deleted, "dry_run": dry_run})
+
+
+@app.route("/archive", methods=["POST"])
+def archive_emails():
+    app.logger.debug("POST /archive")
+    args = flask.request.args
+    try:
+        older_than = int(args.get("older_than",
+                                  app.config["RETENTION_DAYS"]))
+        batch_size = int(args.get("batch_size",
+                                  retention.DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return ("older_than and batch_size must be integers", 400)
+
+    if older_than < 0 or batch_size <= 0:
+        return ("older_than must be >= 0 and batch_size must be > 0", 400)
+
+    dry_run = _get_flag(args, "dry_run")
+
+    db = get_db_client()
+    archived = retention.archive_emails(db, older_than,
+                                        batch_size=batch_size,
+                                        dry_run=dry_run)
+    return flask.jsonify({"archived": archived,
+                          "older_than": older_than,
+                          "dry_run": dry_run})
+
+
+@app.route("/bodies/migrate", methods=["POST"])
+def migrate_bodies():
+    app.logger.debug("POST /bodies/migrate")
+    args = flask.request.args
+    try:
+        batch_size = int(args.get("batch_size", bodies.MIGRATE_BATCH_SIZE))
+    except ValueError:
+        return ("batch_size must be an integer", 400)
+
+    if batch_size <= 0:
+        return ("batch_size must be > 0", 400)
+
+    dry_run = _get_flag(args, "dry_run")
+    report = bodies.migrate_bodies(get_db_client(), batch_size=batch_size,
+                                   dry_run=dry_run)
+    report["dry_run"] = dry_run
+    return flask.jsonify(report)
+
+
+@app.route("/bodies/stats", methods=["GET"])
+def body_stats():
+    app.logger.debug("GET /bodies/stats")
+    return flask.jsonify(bodies.stats(get_db_client()))
+
+
+def _to_leased_email(email):
+    email["id"] = email.pop("_id")
+    email.pop("body_hash", None)
+    return email
+
+
+@app.route("/leases", methods=["POST"])
+def create_lease():
+    app.logger.debug("POST /leases")
+    args = flask.request.args
+    try:
+        batch = int(args.get("batch", leases.DEFAULT_BATCH))
+        lease_seconds = int(args.get("lease_seconds",
+                                     leases.DEFAULT_LEASE_SECONDS))
+    except ValueError:
+        return ("batch and lease_seconds must be integers", 400)
+
+    if not 0 < batch <= leases.MAX_BATCH:
+        return ("batch must be between 1 and {}".format(leases.MAX_BATCH),
+                400)
+    if not 0 < lease_seconds <= leases.MAX_LEASE_SECONDS:
+        return ("lease_seconds must be between 1 and {}".format(
+            leases.MAX_LEASE_SECONDS), 400)
+
+    lease = leases.claim_emails(get_db_client(), batch, lease_seconds,
+                                app.config["SEND_RETRY_INTERVAL"],
+                                worker_id=args.get("worker_id"))
+    lease["emails"] = [_to_leased_email(e) for e in lease["emails"]]
+    return flask.jsonify(lease)
+
+
+@app.route("/leases/<lease_id>", methods=["PUT"])
+def renew_lease(lease_id):
+    app.logger.debug("PUT /leases/%s", lease_id)
+    try:
+        lease_seconds = int(flask.request.args.get(
+            "lease_seconds", leases.DEFAULT_LEASE_SECONDS))
+    except ValueError:
+        return ("lease_seconds must be an integer", 400)
+
+    if not 0 < lease_seconds <= leases.MAX_LEASE_SECONDS:
+        return ("lease_seconds must be between 1 and {}".format(
+            leases.MAX_LEASE_SECONDS), 400)
+
+    renewed, expires_at = leases.renew_lease(get_db_client(), lease_id,
+                                             lease_seconds)
+    if not renewed:
         return ("", 404)
+    return flask.jsonify({"lease_id": lease_id,
+                          "renewed": renewed,
+                          "expires_at": expires_at})
+
 
+@app.route("/leases/<lease_id>", methods=["DELETE"])
+def release_lease(lease_id):
+    app.logger.debug("DELETE /leases/%s", lease_id)
+    email_ids = flask.request.args.getlist("email_id")
+    released = leases.release_lease(get_db_client(), lease_id,
+                                    email_ids=email_ids)
+    return flask.jsonify({"lease_id": lease_id, "released": released})
+
+
+@app.route("/admission", methods=["GET"])
+def admission_stats():
+    app.logger.debug("GET /admission")
+    return flask.jsonify(_get_admission().stats)
+
+
+@app.route("/addresses/cache", methods=["GET"])
+def address_cache_stats():
+    app.logger.debug("GET /addresses/cache")
+    return flask.jsonify(_get_address_validator().stats)
+
+
+@app.route("/reaper", methods=["GET"])
+def reaper_stats():
+    app.logger.debug("GET /reaper")
+    return flask.jsonify(_get_reaper().stats)
+
+
+@app.route("/reaper/run", methods=["POST"])
+def run_reaper():
+    app.logger.debug("POST /reaper/run")
+    args = flask.request.args
+    try:
+        lease_seconds = int(args.get("lease_seconds",
+                                     app.config["LEASE_DURATION"]))
+    except ValueError:
+        return ("lease_seconds must be an integer", 400)
+
+    if lease_seconds <= 0:
+        return ("lease_seconds must be > 0", 400)
+
+    dry_run = _get_flag(args, "dry_run")
+    recovered = _get_reaper().run_once(lease_seconds=lease_seconds,
+                                       dry_run=dry_run)
+    return flask.jsonify({"recovered": recovered,
+                          "lease_seconds": lease_seconds,
+                          "dry_run": dry_run})
+
+
+def _to_server_response(server):
+    # Credentials go to the workers through the database, never out of the
+    # API
+    return {"id": server["_id"],
+            "hostname": server["hostname"],
+            "port": server["port"],
+            "username": server.get("username", ""),
+            "weight": server.get("weight", servers.DEFAULT_WEIGHT),
+            "max_concurrency": server.get("max_concurrency",
+                                          servers.DEFAULT_MAX_CONCURRENCY),
+            "enabled": server.get("enabled", True)}
+
+
+def _get_server_json():
+    headers = flask.request.headers
+    if ("content-type" not in headers or
+            headers["content-type"].lower() != "application/json"):
+        return None
+    return flask.request.get_json()
+
+
+@app.route("/servers", methods=["GET"])
+def list_servers():
+    app.logger.debug("GET /servers")
+    return flask.jsonify([_to_server_response(s)
+                          for s in servers.list_servers(get_db_client())])
+
+
+@app.route("/servers", methods=["POST"])
+def add_server():
+    app.logger.debug("POST /servers")
+    data = _get_server_json()
+    if data is None:
+        return ("Invalid content-type or no content-type specified", 415)
+
+    try:
+        validate_server(data)
+    except MailgunException as e:
+        return (str(e), 400)
+
+    server = servers.to_server_model(str(uuid.uuid4()), data)
+    version = servers.add_server(get_db_client(), server)
+    response = _to_server_response(server)
+    response["table_version"] = version
+    return flask.jsonify(response)
+
+
+@app.route("/servers/table", methods=["GET"])
+def show_server_table():
+    app.logger.debug("GET /servers/table")
+    table = servers.get_table(get_db_client())
+    if table is None:
+        return ("", 404)
+
+    # Workers hold on to the table and only download it again when the
+    # version moves
+    etag = str(table["version"])
+    if flask.request.headers.get("If-None-Match", "").strip('"') == etag:
+        return ("", 304, {"ETag": '"{}"'.format(etag)})
+
+    resp = flask.jsonify({
+        "version": table["version"],
+        "built_at": table["built_at"],
+        "slots": table["slots"],
+        "servers": [{"id": e["_id"],
+                     "hostname": e["hostname"],
+                     "port": e["port"],
+                     "weight": e["weight"],
+                     "max_concurrency": e["max_concurrency"]}
+                    for e in table["servers"]]})
+    resp.headers["ETag"] = '"{}"'.format(etag)
+    return resp
+
+
+@app.route("/servers/<server_id>", methods=["GET"])
+def show_server(server_id):
+    app.logger.debug("GET /servers/%s", server_id)
+    server = servers.get_server(get_db_client(), server_id)
+    if not server:
+        return ("", 404)
+    return flask.jsonify(_to_server_response(server))
+
+
+@app.route("/servers/<server_id>", methods=["PATCH"])
+def update_server(server_id):
+    app.logger.debug("PATCH /servers/%s", server_id)
+    data = _get_server_json()
+    if data is None:
+        return ("Invalid content-type or no content-type specified", 415)
+
+    try:
+        validate_server(data, partial=True)
+    except MailgunException as e:
+        return (str(e), 400)
+
+    server, version = servers.update_server(get_db_client(), server_id,
+                                            data)
+    if not server:
+        return ("", 404)
+    response = _to_server_response(server)
+    response["table_version"] = version
+    return flask.jsonify(response)
+
+
+@app.route("/servers/<server_id>", methods=["DELETE"])
+def delete_server(server_id):
+    app.logger.debug("DELETE /servers/%s", server_id)
+    server, _version = servers.delete_server(get_db_client(), server_id)
+    if not server:
+        return ("", 404)
     return ("", 204)
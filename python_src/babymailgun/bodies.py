@@ -0,0 +1,143 @@
+import collections
+import datetime
+import hashlib
+
+BODY_COLLECTION = "bodies"
+MIGRATE_BATCH_SIZE = 500
+
+
+def body_hash(body):
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def store_body(db, body):
+    # The first email with a given body inserts it, every later one only
+    # bumps the reference count
+    digest = body_hash(body)
+    result = db[BODY_COLLECTION].update_one(
+        {"_id": digest},
+        {"$setOnInsert": {"body": body,
+                          "size": len(body.encode("utf-8")),
+                          "created_at": datetime.datetime.now()},
+         "$inc": {"refcount": 1}},
+        upsert=True)
+    return digest, result.upserted_id is not None
+
+
+def release_bodies(db, digests):
+    digests = collections.Counter(d for d in digests if d)
+    if not digests:
+        return 0
+
+    collection = db[BODY_COLLECTION]
+    for digest, count in digests.items():
+        collection.update_one({"_id": digest}, {"$inc": {"refcount": -count}})
+
+    # A concurrent store_body between the decrement and this delete pushes
+    # the count back above zero, so the body survives
+    return collection.delete_many({"_id": {"$in": list(digests)},
+                                   "refcount": {"$lte": 0}}).deleted_count
+
+
+def resolve_body(db, email):
+    if not email.get("body_hash"):
+        return email.get("body", "")
+
+    stored = db[BODY_COLLECTION].find_one({"_id": email["body_hash"]},
+                                          {"body": 1})
+    if not stored:
+        return ""
+    return stored["body"]
+
+
+def resolve_bodies(db, emails):
+    # Fills in "body" on every email in place with a single round trip
+    digests = {e["body_hash"] for e in emails if e.get("body_hash")}
+    if not digests:
+        return emails
+
+    stored = {b["_id"]: b["body"] for b in db[BODY_COLLECTION].find(
+        {"_id": {"$in": list(digests)}}, {"body": 1})}
+    for email in emails:
+        if email.get("body_hash"):
+            email["body"] = stored.get(email["body_hash"], "")
+    return emails
+
+
+def deduplicate_model(db, email):
+    # Swaps the inline body of an email model for a reference to the shared
+    # copy. Returns the document to insert, the model itself is left as is
+    digest, _created = store_body(db, email["body"])
+    stored = dict(email)
+    stored.pop("body")
+    stored["body_hash"] = digest
+    return stored
+
+
+def migrate_bodies(db, batch_size=MIGRATE_BATCH_SIZE, dry_run=False):
+    query = {"body": {"$exists": True}, "body_hash": {"$exists": False}}
+    report = {"migrated": 0, "bytes_before": 0, "bytes_stored": 0,
+              "bytes_saved": 0}
+
+    if dry_run:
+        seen = set()
+        for email in db.emails.find(query, {"body": 1}).batch_size(
+                batch_size):
+            size = len(email["body"].encode("utf-8"))
+            digest = body_hash(email["body"])
+            report["migrated"] += 1
+            report["bytes_before"] += size
+            if digest not in seen and not db[BODY_COLLECTION].find_one(
+                    {"_id": digest}, {"_id": 1}):
+                report["bytes_stored"] += size
+            seen.add(digest)
+        report["bytes_saved"] = report["bytes_before"] - report["bytes_stored"]
+        return report
+
+    while True:
+        batch = list(db.emails.find(query, {"body": 1}).limit(batch_size))
+        if not batch:
+            break
+
+        migrated = 0
+        for email in batch:
+            digest, created = store_body(db, email["body"])
+            # Matching on the body makes the swap a no-op if the email was
+            # changed or removed since it was read
+            result = db.emails.update_one(
+                {"_id": email["_id"], "body": email["body"]},
+                {"$set": {"body_hash": digest}, "$unset": {"body": ""}})
+
+            size = len(email["body"].encode("utf-8"))
+            if result.modified_count:
+                migrated += 1
+                report["bytes_before"] += size
+                if created:
+                    report["bytes_stored"] += size
+            else:
+                release_bodies(db, [digest])
+
+        report["migrated"] += migrated
+        if migrated == 0:
+            break
+
+    report["bytes_saved"] = report["bytes_before"] - report["bytes_stored"]
+    return report
+
+
+def stats(db):
+    pipeline = [{"$group": {
+        "_id": None,
+        "bodies": {"$sum": 1},
+        "references": {"$sum": "$refcount"},
+        "bytes_stored": {"$sum": "$size"},
+        "bytes_saved": {"$sum": {"$multiply": [
+            "$size", {"$subtract": ["$refcount", 1]}]}}}}]
+    results = list(db[BODY_COLLECTION].aggregate(pipeline))
+    if not results:
+        return {"bodies": 0, "references": 0, "bytes_stored": 0,
+                "bytes_saved": 0}
+
+    result = results[0]
+    result.pop("_id")
+    return result
@@ -1,6 +1,31 @@
 import json
+import time
 
 import requests
+from urllib3.util import request as urllib3_request
+
+from babymailgun import compression
+
+
+def accept_encoding():
+    # requests leaves decoding to urllib3, which only decodes brotli from
+    # 1.25 on. requests==2.18.4 pins an older one, so only offer the
+    # encodings urllib3 says it can decode
+    decodable = urllib3_request.ACCEPT_ENCODING.split(",")
+    return ", ".join(encoding
+                     for encoding in compression.available_encodings()
+                     if encoding in decodable)
+
+
+ACCEPT_ENCODING = accept_encoding()
+
+# Statuses the API answers with when admission control turns a submission
+# away. Both carry a Retry-After header
+RETRY_STATUSES = (429, 503)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_MAX_RETRY_WAIT = 60
+# Ties the client's requests to the API's logs and traces
+CORRELATION_ID_HEADER = "X-Correlation-ID"
 
 
 class ClientError(Exception):
@@ -28,16 +53,62 @@ class CreateFailure(ClientError):
     message = "Creating %(resource)s failed with HTTP %(code)s: %(reason)s"
 
 
+class UpdateFailure(ClientError):
+    message = "Updating %(resource)s failed with HTTP %(code)s: %(reason)s"
+
+
+class MigrateFailure(ClientError):
+    message = "Migrating %(resource)s failed with HTTP %(code)s: %(reason)s"
+
+
+class LeaseFailure(ClientError):
+    message = "Leasing %(resource)s failed with HTTP %(code)s: %(reason)s"
+
+
+class ArchiveFailure(ClientError):
+    message = "Archiving %(resource)s failed with HTTP %(code)s: %(reason)s"
+
+
 class MailgunAPIClient(object):
-    def __init__(self, host, port):
+    def __init__(self, host, port, max_retries=DEFAULT_MAX_RETRIES,
+                 max_retry_wait=DEFAULT_MAX_RETRY_WAIT, correlation_id=None):
         self._host = host
         self._port = port
+        self._max_retries = max_retries
+        self._max_retry_wait = max_retry_wait
+        self._correlation_id = correlation_id
 
     def to_url(self, resource):
         return "http://{}:{}/{}".format(self._host, self._port, resource)
 
+    def to_headers(self, headers):
+        # Listings run to megabytes, and the API compresses anything over
+        # its COMPRESS_MIN_SIZE for clients that ask
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
+        # Without an id of our own the API generates one per request
+        if self._correlation_id:
+            headers[CORRELATION_ID_HEADER] = self._correlation_id
+        return headers
+
+    def retry_delay(self, resp):
+        try:
+            delay = int(resp.headers.get("Retry-After", 1))
+        except (TypeError, ValueError):
+            delay = 1
+        return min(max(delay, 0), self._max_retry_wait)
+
+    def post_with_retry(self, url, **kwargs):
+        # Waits out the delay the server asked for before trying again. The
+        # last rejection is handed back to the caller like any other failure
+        for attempt in range(self._max_retries + 1):
+            resp = requests.post(url, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or \
+                    attempt == self._max_retries:
+                return resp
+            time.sleep(self.retry_delay(resp))
+
     def get_emails(self):
-        headers = {"Accept": "application/json"}
+        headers = self.to_headers({"Accept": "application/json"})
         try:
             resp = requests.get(self.to_url("emails"), headers=headers)
         except requests.exceptions.ConnectionError:
@@ -50,7 +121,7 @@ class MailgunAPIClient(object):
         return resp.json()
 
     def get_email_by_id(self, email_id):
-        headers = {"Accept": "application/json"}
+        headers = self.to_headers({"Accept": "application/json"})
         try:
             resp = requests.get(self.to_url("emails/{}".format(email_id)),
                                 headers=headers)
@@ -67,12 +138,42 @@ class MailgunAPIClient(object):
 
         return resp.json()
 
-    def get_email_recipients(self, email_id):
-        headers = {"Accept": "application/json"}
+    def get_email_recipients(self, email_id, status=None, limit=None,
+                             after=None, domain=None):
+        recipients, _next_cursor = self.get_email_recipients_page(
+            email_id, status=status, limit=limit, after=after,
+            domain=domain)
+        return recipients
+
+    def iter_email_recipients(self, email_id, status=None, limit=None,
+                              domain=None):
+        after = None
+        while True:
+            recipients, after = self.get_email_recipients_page(
+                email_id, status=status, limit=limit, after=after,
+                domain=domain)
+            for recipient in recipients:
+                yield recipient
+            if not after:
+                break
+
+    def get_email_recipients_page(self, email_id, status=None, limit=None,
+                                  after=None, domain=None):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {}
+        if status is not None:
+            params["status"] = status
+        if limit is not None:
+            params["limit"] = limit
+        if after is not None:
+            params["after"] = after
+        if domain is not None:
+            params["domain"] = domain
+
         try:
             resp = requests.get(
                 self.to_url("emails/{}/recipients".format(email_id)),
-                headers=headers)
+                headers=headers, params=params)
         except requests.exceptions.ConnectionError:
             raise ConnectionRefused(host=self._host, port=self._port)
 
@@ -84,18 +185,72 @@ class MailgunAPIClient(object):
                              code=resp.status_code,
                              reason=resp.text)
 
+        return resp.json(), resp.headers.get("X-Next-Cursor")
+
+    def update_email_recipient(self, email_id, address, status, reason=""):
+        headers = self.to_headers({"Content-Type": "application/json",
+                                   "Accept": "application/json"})
+        resource = "emails/{}/recipients/{}".format(email_id, address)
+        data = json.dumps({"status": status, "reason": reason})
+
+        try:
+            resp = requests.patch(self.to_url(resource), headers=headers,
+                                  data=data)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/" + resource)
+
+        if resp.status_code != 204:
+            raise UpdateFailure(resource="/" + resource,
+                                code=resp.status_code,
+                                reason=resp.text)
+
+    def create_email(self, subject, sender, to, cc, bcc, email_body,
+                     mailing_list=False, priority=None, send_at=None):
+        headers = self.to_headers({"Content-Type": "application/json",
+                                   "Accept": "application/json"})
+
+        payload = {"subject": subject, "from": sender,
+                   "to": to, "cc": cc, "bcc": bcc, "body": email_body}
+        if mailing_list:
+            payload["mailing_list"] = True
+        if priority is not None:
+            payload["priority"] = priority
+        if send_at is not None:
+            payload["send_at"] = send_at
+        data = json.dumps(payload)
+
+        try:
+            resp = self.post_with_retry(self.to_url("emails"),
+                                        headers=headers, data=data)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise CreateFailure(resource="/emails",
+                                code=resp.status_code,
+                                reason=resp.text)
         return resp.json()
 
-    def create_email(self, subject, sender, to, cc, bcc, email_body):
-        headers = {"Content-Type": "application/json",
-                   "Accept": "application/json"}
+    def create_template_email(self, subject, sender, recipients, email_body,
+                              priority=None, send_at=None):
+        headers = self.to_headers({"Content-Type": "application/json",
+                                   "Accept": "application/json"})
 
-        data = json.dumps({"subject": subject, "from": sender,
-                           "to": to, "cc": cc, "bcc": bcc, "body": email_body})
+        payload = {"subject": subject, "from": sender,
+                   "recipients": recipients, "body": email_body,
+                   "template": True}
+        if priority is not None:
+            payload["priority"] = priority
+        if send_at is not None:
+            payload["send_at"] = send_at
+        data = json.dumps(payload)
 
         try:
-            resp = requests.post(self.to_url("emails"), headers=headers,
-                                 data=data)
+            resp = self.post_with_retry(self.to_url("emails"),
+                                        headers=headers, data=data)
         except requests.exceptions.ConnectionError:
             raise ConnectionRefused(host=self._host, port=self._port)
 
@@ -105,8 +260,28 @@ class MailgunAPIClient(object):
                                 reason=resp.text)
         return resp.json()
 
+    def preview_email(self, email_id, address):
+        headers = self.to_headers({"Accept": "application/json"})
+        resource = "emails/{}/preview".format(email_id)
+        try:
+            resp = requests.get(self.to_url(resource), headers=headers,
+                                params={"address": address})
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/{}?address={}".format(resource,
+                                                            address))
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/" + resource,
+                             code=resp.status_code,
+                             reason=resp.text)
+
+        return resp.json()
+
     def delete_email(self, email_id):
-        headers = {"Accept": "application/json"}
+        headers = self.to_headers({"Accept": "application/json"})
         try:
             resp = requests.delete(
                 self.to_url("emails/{}".format(email_id)),
@@ -121,3 +296,311 @@ class MailgunAPIClient(object):
             raise DeleteFailure(resource="/emails/{}".format(email_id),
                                 code=resp.status_code,
                                 reason=resp.text)
+
+    def delete_emails(self, status=None, sender=None, before=None,
+                      dry_run=False):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {"dry_run": "true" if dry_run else "false"}
+        if status is not None:
+            params["status"] = status
+        if sender is not None:
+            params["sender"] = sender
+        if before is not None:
+            params["before"] = before
+
+        try:
+            resp = requests.delete(self.to_url("emails"), headers=headers,
+                                   params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise DeleteFailure(resource="/emails",
+                                code=resp.status_code,
+                                reason=resp.text)
+        return resp.json()
+
+    def archive_emails(self, older_than=None, batch_size=None, dry_run=False):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {"dry_run": "true" if dry_run else "false"}
+        if older_than is not None:
+            params["older_than"] = older_than
+        if batch_size is not None:
+            params["batch_size"] = batch_size
+
+        try:
+            resp = requests.post(self.to_url("archive"), headers=headers,
+                                 params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise ArchiveFailure(resource="/archive",
+                                 code=resp.status_code,
+                                 reason=resp.text)
+        return resp.json()
+
+    def migrate_bodies(self, batch_size=None, dry_run=False):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {"dry_run": "true" if dry_run else "false"}
+        if batch_size is not None:
+            params["batch_size"] = batch_size
+
+        try:
+            resp = requests.post(self.to_url("bodies/migrate"),
+                                 headers=headers, params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise MigrateFailure(resource="/bodies/migrate",
+                                 code=resp.status_code,
+                                 reason=resp.text)
+        return resp.json()
+
+    def get_body_stats(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("bodies/stats"), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/bodies/stats", code=resp.status_code,
+                             reason=resp.text)
+
+        return resp.json()
+
+    def claim_emails(self, batch=None, lease_seconds=None, worker_id=None):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {}
+        if batch is not None:
+            params["batch"] = batch
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+        if worker_id is not None:
+            params["worker_id"] = worker_id
+
+        try:
+            resp = requests.post(self.to_url("leases"), headers=headers,
+                                 params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise LeaseFailure(resource="/leases", code=resp.status_code,
+                               reason=resp.text)
+        return resp.json()
+
+    def renew_lease(self, lease_id, lease_seconds=None):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {}
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+
+        try:
+            resp = requests.put(self.to_url("leases/{}".format(lease_id)),
+                                headers=headers, params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/leases/{}".format(lease_id))
+
+        if resp.status_code != 200:
+            raise LeaseFailure(resource="/leases/{}".format(lease_id),
+                               code=resp.status_code,
+                               reason=resp.text)
+        return resp.json()
+
+    def release_lease(self, lease_id, email_ids=None):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {}
+        if email_ids:
+            params["email_id"] = list(email_ids)
+
+        try:
+            resp = requests.delete(self.to_url("leases/{}".format(lease_id)),
+                                   headers=headers, params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise LeaseFailure(resource="/leases/{}".format(lease_id),
+                               code=resp.status_code,
+                               reason=resp.text)
+        return resp.json()
+
+    def run_reaper(self, lease_seconds=None, dry_run=False):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {"dry_run": "true" if dry_run else "false"}
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+
+        try:
+            resp = requests.post(self.to_url("reaper/run"), headers=headers,
+                                 params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise LeaseFailure(resource="/reaper/run", code=resp.status_code,
+                               reason=resp.text)
+        return resp.json()
+
+    def get_schedule(self, limit=None):
+        headers = self.to_headers({"Accept": "application/json"})
+        params = {}
+        if limit is not None:
+            params["limit"] = limit
+        try:
+            resp = requests.get(self.to_url("schedule"), headers=headers,
+                                params=params)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/schedule", code=resp.status_code,
+                             reason=resp.text)
+        return resp.json()
+
+    def get_admission_stats(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("admission"), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/admission", code=resp.status_code,
+                             reason=resp.text)
+        return resp.json()
+
+    def get_address_cache_stats(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("addresses/cache"),
+                                headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/addresses/cache",
+                             code=resp.status_code, reason=resp.text)
+        return resp.json()
+
+    def get_storage_stats(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("storage"), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/storage", code=resp.status_code,
+                             reason=resp.text)
+        return resp.json()
+
+    def get_reaper_stats(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("reaper"), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/reaper", code=resp.status_code,
+                             reason=resp.text)
+        return resp.json()
+
+    def get_servers(self):
+        headers = self.to_headers({"Accept": "application/json"})
+        try:
+            resp = requests.get(self.to_url("servers"), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/servers", code=resp.status_code,
+                             reason=resp.text)
+        return resp.json()
+
+    def create_server(self, hostname, port, username=None, password=None,
+                      weight=None, max_concurrency=None, enabled=None):
+        headers = self.to_headers({"Content-Type": "application/json",
+                                   "Accept": "application/json"})
+        payload = {"hostname": hostname, "port": port}
+        for key, value in (("username", username), ("password", password),
+                           ("weight", weight),
+                           ("max_concurrency", max_concurrency),
+                           ("enabled", enabled)):
+            if value is not None:
+                payload[key] = value
+
+        try:
+            resp = requests.post(self.to_url("servers"), headers=headers,
+                                 data=json.dumps(payload))
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code != 200:
+            raise CreateFailure(resource="/servers", code=resp.status_code,
+                                reason=resp.text)
+        return resp.json()
+
+    def update_server(self, server_id, **changes):
+        headers = self.to_headers({"Content-Type": "application/json",
+                                   "Accept": "application/json"})
+        resource = "servers/{}".format(server_id)
+        try:
+            resp = requests.patch(self.to_url(resource), headers=headers,
+                                  data=json.dumps(changes))
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/" + resource)
+
+        if resp.status_code != 200:
+            raise UpdateFailure(resource="/" + resource,
+                                code=resp.status_code,
+                                reason=resp.text)
+        return resp.json()
+
+    def delete_server(self, server_id):
+        headers = self.to_headers({"Accept": "application/json"})
+        resource = "servers/{}".format(server_id)
+        try:
+            resp = requests.delete(self.to_url(resource), headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/" + resource)
+
+        if resp.status_code != 204:
+            raise DeleteFailure(resource="/" + resource,
+                                code=resp.status_code,
+                                reason=resp.text)
+
+    def get_server_table(self, version=None):
+        # Returns None when the table is still at the given version
+        headers = self.to_headers({"Accept": "application/json"})
+        if version is not None:
+            headers["If-None-Match"] = '"{}"'.format(version)
+        try:
+            resp = requests.get(self.to_url("servers/table"),
+                                headers=headers)
+        except requests.exceptions.ConnectionError:
+            raise ConnectionRefused(host=self._host, port=self._port)
+
+        if resp.status_code == 304:
+            return None
+
+        if resp.status_code == 404:
+            raise NotFound(resource="/servers/table")
+
+        if resp.status_code != 200:
+            raise GetFailure(resource="/servers/table",
+                             code=resp.status_code, reason=resp.text)
+        return resp.json()
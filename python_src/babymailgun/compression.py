@@ -0,0 +1,140 @@
+import zlib
+
+# Brotli compresses JSON noticeably better than gzip, but it's an optional
+# dependency. Without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# zlib writes a gzip header and trailer with a window of 16 + MAX_WBITS
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def available_encodings():
+    # In order of preference when a client weighs several equally
+    encodings = ["gzip"]
+    if brotli is not None:
+        encodings.insert(0, "br")
+    return encodings
+
+
+def parse_accept_encoding(header):
+    # "gzip;q=0.5, br" -> {"gzip": 0.5, "br": 1.0}. Malformed weights count
+    # as 0, so a typo never forces an encoding on anyone
+    weights = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    return weights
+
+
+def negotiate(header):
+    weights = parse_accept_encoding(header)
+    best, best_weight = None, 0.0
+    for encoding in available_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class _Gzip(object):
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                            GZIP_WBITS)
+
+    def process(self, chunk):
+        return self._compressor.compress(chunk)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli(object):
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def process(self, chunk):
+        return self._compressor.process(chunk)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compressor(encoding):
+    if encoding == "br":
+        return _Brotli()
+    return _Gzip()
+
+
+def compress(data, encoding):
+    stream = compressor(encoding)
+    return stream.process(data) + stream.finish()
+
+
+def compress_stream(chunks, encoding):
+    # Flushes after every chunk so a client reading a chunked response sees
+    # each piece as soon as it's produced rather than when the buffer fills
+    stream = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = stream.process(chunk) + stream.flush()
+        if data:
+            yield data
+    yield stream.finish()
+
+
+def _add_vary(response):
+    vary = response.headers.get("Vary")
+    if not vary:
+        response.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response.headers["Vary"] = "{}, Accept-Encoding".format(vary)
+
+
+def compress_response(response, accept_encoding, min_size=DEFAULT_MIN_SIZE):
+    if (response.status_code < 200 or response.status_code in (204, 304) or
+            "Content-Encoding" in response.headers or
+            response.direct_passthrough):
+        return response
+
+    # Whether or not this one is compressed, the next response to the same
+    # URL might be, so caches must key on Accept-Encoding either way
+    _add_vary(response)
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # The length isn't known up front, so the threshold can't apply
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,27 @@
+import os
+import time
+import uuid
+
+ID_SCHEMES = ("uuid4", "uuid7")
+
+
+def uuid7(timestamp_ms=None):
+    # Layout follows the UUIDv7 draft: a 48 bit millisecond unix timestamp,
+    # followed by random bits with the version and variant stamped in. Ids
+    # created later sort after ids created earlier, so new documents are
+    # appended to the right-hand edge of the _id index instead of landing
+    # on a random page of it
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+
+def new_email_id(scheme="uuid4"):
+    if scheme == "uuid7":
+        return str(uuid7())
+    return str(uuid.uuid4())
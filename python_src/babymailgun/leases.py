@@ -0,0 +1,94 @@
+import datetime
+import uuid
+
+import pymongo
+
+from babymailgun import bodies
+from babymailgun import recipient_store
+
+DEFAULT_BATCH = 10
+MAX_BATCH = 100
+DEFAULT_LEASE_SECONDS = 300
+MAX_LEASE_SECONDS = 3600
+
+
+READY_SORT = [("priority", pymongo.DESCENDING),
+              ("send_at", pymongo.ASCENDING)]
+
+
+def ready_query(now, retry_interval):
+    # The same emails the Go worker's FetchReadyEmail would pick up
+    return {"worker_id": None,
+            "status": "incomplete",
+            "send_at": {"$lte": now},
+            "updated_at": {"$lt": now - datetime.timedelta(
+                seconds=retry_interval)},
+            "recipient_storage": {"$ne": recipient_store.STORAGE_EXTERNAL}}
+
+
+def lease_query(lease_id):
+    # Leased emails are held under the lease id itself, and only belong to
+    # the lease while it still holds them. Once the result is written, or
+    # the email is reaped and claimed by someone else, a late renew or
+    # release must leave it alone
+    return {"lease_id": lease_id, "worker_id": lease_id}
+
+
+def ensure_indexes(db):
+    db.emails.create_index([("lease_id", pymongo.ASCENDING)], sparse=True)
+
+
+def claim_emails(db, batch, lease_seconds, retry_interval, worker_id=None,
+                 now=None):
+    now = now or datetime.datetime.utcnow()
+    lease_id = str(uuid.uuid4())
+    expires_at = now + datetime.timedelta(seconds=lease_seconds)
+
+    candidates = [e["_id"] for e in db.emails.find(
+        ready_query(now, retry_interval), {"_id": 1}).sort(
+            READY_SORT).limit(batch)]
+
+    emails = []
+    if candidates:
+        # Each document is claimed atomically. Repeating the ready query in
+        # the filter means anything another worker grabbed in the meantime
+        # is skipped, and reading back by lease id returns exactly the
+        # emails this call won
+        claim_query = ready_query(now, retry_interval)
+        claim_query["_id"] = {"$in": candidates}
+        db.emails.update_many(
+            claim_query,
+            {"$set": {"worker_id": lease_id,
+                      "leased_by": worker_id,
+                      "lease_id": lease_id,
+                      "claimed_at": now,
+                      "lease_expires_at": expires_at}})
+        emails = list(db.emails.find({"lease_id": lease_id}))
+        bodies.resolve_bodies(db, emails)
+
+    return {"lease_id": lease_id,
+            "expires_at": expires_at,
+            "emails": emails}
+
+
+def renew_lease(db, lease_id, lease_seconds, now=None):
+    now = now or datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=lease_seconds)
+    result = db.emails.update_many(
+        lease_query(lease_id),
+        {"$set": {"lease_expires_at": expires_at}})
+    return result.matched_count, expires_at
+
+
+def release_lease(db, lease_id, email_ids=None):
+    query = lease_query(lease_id)
+    if email_ids:
+        query["_id"] = {"$in": list(email_ids)}
+    result = db.emails.update_many(
+        query,
+        {"$set": {"worker_id": None,
+                  "leased_by": None,
+                  "lease_id": None,
+                  "claimed_at": None,
+                  "lease_expires_at": None}})
+    return result.modified_count
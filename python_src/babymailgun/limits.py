@@ -0,0 +1,134 @@
+import codecs
+import json
+import re
+
+# Enough for a mailing list at its recipient limit with room to spare
+DEFAULT_MAX_CONTENT_LENGTH = 32 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# Submissions nest four deep at most, in template recipient variables
+MAX_DEPTH = 8
+RECIPIENT_KEYS = frozenset(["to", "cc", "bcc", "recipients"])
+
+# A complete string, a string still open at the end of what's been read, or
+# a structural character. Numbers, booleans and whitespace are skipped over
+_TOKEN_REGEX = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|"|[{}\[\],:]')
+# A run of plain strings, each followed by a comma, as recipient lists are
+# made of. Without escapes the quotes alone give away how many there are, so
+# a whole run is counted in one match instead of one token at a time
+_STRING_RUN_REGEX = re.compile(r'\s*(?:"[^"\\]*"\s*,\s*)+')
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+def max_string_length(max_chars):
+    # The longest JSON encoding of a string that decodes to max_chars
+    # characters, plus the quotes. A character outside the BMP is escaped
+    # as a surrogate pair, as in \ud83d\ude00, which takes twelve
+    return max_chars * 12 + 2
+
+
+class EmailScanner(object):
+    # Walks a submission's JSON as it arrives, without building anything,
+    # and raises LimitExceeded as soon as it's clear the submission can't be
+    # valid. Anything it lets through is still parsed and validated in full,
+    # so it only has to be conservative, never exact
+    def __init__(self, max_recipients, max_string, max_depth=MAX_DEPTH):
+        self._max_recipients = max_recipients
+        self._max_string = max_string
+        self._max_depth = max_depth
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._pending = ""
+        # One (is_object, holds_recipients) pair per open container
+        self._stack = []
+        self._expect_key = False
+        self._key = None
+        self.recipients = 0
+
+    def feed(self, chunk, final=False):
+        text = self._pending + self._decoder.decode(chunk, final)
+        pos = 0
+        while True:
+            if self._stack and self._stack[-1][1]:
+                run = _STRING_RUN_REGEX.match(text, pos)
+                if run:
+                    self._count(run.group().count('"') // 2)
+                    pos = run.end()
+
+            match = _TOKEN_REGEX.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            if match.group() == '"':
+                # A string that continues in the next chunk
+                pos = match.start()
+                break
+            self._token(match.group())
+            pos = match.end()
+
+        self._pending = text[pos:]
+        if len(self._pending) > self._max_string:
+            raise LimitExceeded("A string is longer than any field allows")
+
+    def _token(self, token):
+        stack = self._stack
+        if token[0] == '"':
+            if len(token) > self._max_string:
+                raise LimitExceeded("A string is longer than any field "
+                                    "allows")
+            if self._expect_key and len(stack) == 1:
+                self._key = json.loads(token)
+            elif stack and stack[-1][1]:
+                self._count()
+            self._expect_key = False
+        elif token in "{[":
+            if len(stack) >= self._max_depth:
+                raise LimitExceeded("The submission is nested more than "
+                                    "{} deep".format(self._max_depth))
+            if stack and stack[-1][1]:
+                self._count()
+            holds_recipients = (token == "[" and len(stack) == 1 and
+                                self._key in RECIPIENT_KEYS)
+            stack.append((token == "{", holds_recipients))
+            self._expect_key = token == "{"
+        elif token in "}]":
+            if stack:
+                stack.pop()
+            self._expect_key = False
+        elif token == ",":
+            self._expect_key = bool(stack) and stack[-1][0]
+        elif token == ":":
+            self._expect_key = False
+
+    def _count(self, recipients=1):
+        self.recipients += recipients
+        if self.recipients > self._max_recipients:
+            raise LimitExceeded("More than {} recipients".format(
+                self._max_recipients))
+
+
+def read_json(stream, max_length, scanner=None, chunk_size=READ_CHUNK_SIZE):
+    # Reads at most max_length bytes, one chunk at a time, so an oversized
+    # or abusive submission costs a chunk of memory rather than all of it.
+    # Raises LimitExceeded, or ValueError for anything that isn't JSON
+    chunks = []
+    length = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        length += len(chunk)
+        if length > max_length:
+            raise LimitExceeded("The request body is larger than {} "
+                                "bytes".format(max_length))
+        chunks.append(chunk)
+        # A body that fits in one chunk costs less to parse than to scan, so
+        # scanning only starts once there's a second
+        if scanner is not None and len(chunks) > 1:
+            if len(chunks) == 2:
+                scanner.feed(chunks[0])
+            scanner.feed(chunk)
+    if scanner is not None and len(chunks) > 1:
+        scanner.feed(b"", final=True)
+    return json.loads(b"".join(chunks).decode("utf-8"))
@@ -0,0 +1,130 @@
+import datetime
+import logging
+import threading
+
+import pymongo
+
+DEFAULT_LEASE_SECONDS = 900
+
+LOG = logging.getLogger(__name__)
+
+
+def stale_query(now, lease_seconds):
+    # Emails claimed by the Go worker only record when they were claimed, so
+    # those are stale once they've been held longer than lease_seconds.
+    # Claims made before claimed_at existed have neither field and are left
+    # alone
+    return {"worker_id": {"$ne": None},
+            "lease_expires_at": None,
+            "claimed_at": {"$lt": now - datetime.timedelta(
+                seconds=lease_seconds)}}
+
+
+def expired_lease_query(lease_id, now):
+    # Emails claimed through /leases carry their own expiry, but only while
+    # the lease still holds them. An email reaped from a lease and claimed
+    # again by the Go worker may keep the old expiry until it's written
+    # back, and must not be handed out a second time
+    return {"lease_id": lease_id,
+            "worker_id": lease_id,
+            "lease_expires_at": {"$lt": now}}
+
+
+def stale_queries(db, now, lease_seconds):
+    expired = db.emails.distinct("lease_id",
+                                 {"lease_expires_at": {"$lt": now}})
+    return [stale_query(now, lease_seconds)] + [
+        expired_lease_query(lease_id, now)
+        for lease_id in expired if lease_id is not None]
+
+
+def ensure_indexes(db):
+    db.emails.create_index([("claimed_at", pymongo.ASCENDING)], sparse=True)
+    db.emails.create_index([("lease_expires_at", pymongo.ASCENDING)],
+                           sparse=True)
+
+
+def release_stale(db, lease_seconds, dry_run=False, now=None):
+    now = now or datetime.datetime.utcnow()
+    queries = stale_queries(db, now, lease_seconds)
+    if dry_run:
+        return sum(int(db.command("count", "emails", query=query)["n"])
+                   for query in queries)
+
+    released = 0
+    for query in queries:
+        result = db.emails.update_many(
+            query,
+            {"$set": {"worker_id": None,
+                      "leased_by": None,
+                      "lease_id": None,
+                      "claimed_at": None,
+                      "lease_expires_at": None}})
+        released += result.modified_count
+    return released
+
+
+class Reaper(object):
+    def __init__(self, get_db, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 interval=None):
+        self._get_db = get_db
+        self._lease_seconds = lease_seconds
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"runs": 0,
+                       "recovered": 0,
+                       "last_recovered": 0,
+                       "last_run_at": None,
+                       "errors": 0}
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["lease_seconds"] = self._lease_seconds
+        stats["interval"] = self._interval
+        stats["running"] = self._thread is not None and \
+            self._thread.is_alive()
+        return stats
+
+    def run_once(self, lease_seconds=None, dry_run=False):
+        lease_seconds = lease_seconds or self._lease_seconds
+        recovered = release_stale(self._get_db(), lease_seconds,
+                                  dry_run=dry_run)
+        if not dry_run:
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["recovered"] += recovered
+                self._stats["last_recovered"] = recovered
+                self._stats["last_run_at"] = datetime.datetime.now()
+            if recovered:
+                LOG.warning("Released %d email(s) held longer than %d "
+                            "seconds", recovered, lease_seconds)
+        return recovered
+
+    def _loop(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.run_once()
+            except Exception:
+                # Keep reaping through transient database trouble
+                LOG.exception("Releasing stale emails failed")
+                with self._lock:
+                    self._stats["errors"] += 1
+
+    def start(self):
+        if not self._interval or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name="stale-lease-reaper")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,112 @@
+import pymongo
+
+from babymailgun import addresses
+
+RECIPIENT_COLLECTION = "recipients"
+STORAGE_EXTERNAL = "external"
+INSERT_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+# Recipient ids are the email id plus a zero padded position, so sorting by
+# _id keeps submission order and the last id of a page is the cursor for the
+# next one
+def recipient_id(email_id, position):
+    return "{}:{:09d}".format(email_id, position)
+
+
+def ensure_indexes(db):
+    collection = db[RECIPIENT_COLLECTION]
+    collection.create_index([("email_id", pymongo.ASCENDING),
+                             ("status", pymongo.ASCENDING),
+                             ("_id", pymongo.ASCENDING)])
+    collection.create_index([("email_id", pymongo.ASCENDING),
+                             ("address", pymongo.ASCENDING)])
+    collection.create_index([("email_id", pymongo.ASCENDING),
+                             ("domain", pymongo.ASCENDING),
+                             ("_id", pymongo.ASCENDING)])
+
+
+def to_recipient_documents(email_id, email_dict):
+    position = 0
+    for recipient_type in ["to", "cc", "bcc"]:
+        for address in email_dict[recipient_type]:
+            yield {"_id": recipient_id(email_id, position),
+                   "email_id": email_id,
+                   "address": address,
+                   "domain": addresses.domain_of(address),
+                   "type": recipient_type,
+                   "status": 0,
+                   "reason": ""}
+            position += 1
+
+
+def to_template_recipient_documents(email_id, template_recipients):
+    # Template recipients are always "to" and carry their merge variables
+    # along, so each one can be rendered on its own at send time
+    for position, recipient in enumerate(template_recipients):
+        yield {"_id": recipient_id(email_id, position),
+               "email_id": email_id,
+               "address": recipient["address"],
+               "domain": addresses.domain_of(recipient["address"]),
+               "type": "to",
+               "variables": recipient.get("variables", {}),
+               "status": 0,
+               "reason": ""}
+
+
+def insert_recipients(db, documents, batch_size=INSERT_BATCH_SIZE):
+    collection = db[RECIPIENT_COLLECTION]
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def list_recipients(db, email_id, status=None, after=None,
+                    limit=DEFAULT_PAGE_SIZE, domain=None):
+    query = {"email_id": email_id}
+    if status is not None:
+        query["status"] = status
+    if domain is not None:
+        query["domain"] = domain
+    if after is not None:
+        query["_id"] = {"$gt": after}
+
+    # Fetch one extra to learn whether there's another page without a count
+    cursor = db[RECIPIENT_COLLECTION].find(query).sort(
+        "_id", pymongo.ASCENDING).limit(limit + 1)
+    page = list(cursor)
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1]["_id"]
+    return page, next_cursor
+
+
+def find_recipient(db, email_id, address):
+    return db[RECIPIENT_COLLECTION].find_one({"email_id": email_id,
+                                              "address": address})
+
+
+def update_recipient(db, email_id, address, status, reason):
+    result = db[RECIPIENT_COLLECTION].update_many(
+        {"email_id": email_id, "address": address},
+        {"$set": {"status": status, "reason": reason}})
+    return result.matched_count
+
+
+def delete_recipients(db, email_ids):
+    if not email_ids:
+        return 0
+    return db[RECIPIENT_COLLECTION].delete_many(
+        {"email_id": {"$in": list(email_ids)}}).deleted_count
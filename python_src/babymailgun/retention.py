@@ -0,0 +1,129 @@
+import datetime
+
+import pymongo
+
+from babymailgun import bodies
+from babymailgun import recipient_store
+
+ARCHIVE_COLLECTION = "emails_archive"
+ARCHIVE_RECIPIENT_COLLECTION = "recipients_archive"
+FINISHED_STATUSES = ["complete", "failed"]
+DEFAULT_BATCH_SIZE = 500
+
+
+def archive_query(cutoff):
+    # Only finished emails that no worker holds are eligible. Anything still
+    # incomplete is part of the active queue and must stay where the worker
+    # can find it
+    return {"status": {"$in": FINISHED_STATUSES},
+            "worker_id": None,
+            "updated_at": {"$lt": cutoff}}
+
+
+def ensure_indexes(db, archive_ttl_days=None):
+    # Backs the archive query so each batch is an index range scan rather
+    # than a walk over the whole collection
+    db.emails.create_index([("status", pymongo.ASCENDING),
+                            ("updated_at", pymongo.ASCENDING)])
+    # Archived list recipients page the same way live ones do
+    db[ARCHIVE_RECIPIENT_COLLECTION].create_index(
+        [("email_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+    if archive_ttl_days:
+        expire_after_seconds = int(archive_ttl_days * 24 * 60 * 60)
+        for collection in (ARCHIVE_COLLECTION, ARCHIVE_RECIPIENT_COLLECTION):
+            ensure_ttl_index(db, collection, expire_after_seconds)
+
+
+def ensure_ttl_index(db, collection, expire_after_seconds):
+    # create_index refuses an index that already exists with other options,
+    # so when ARCHIVE_TTL_DAYS changes the existing one is updated in place
+    archive = db[collection]
+    for index in archive.index_information().values():
+        if index["key"] != [("archived_at", 1)]:
+            continue
+        if index.get("expireAfterSeconds") != expire_after_seconds:
+            db.command("collMod", collection,
+                       index={"keyPattern": {"archived_at": 1},
+                              "expireAfterSeconds": expire_after_seconds})
+        return
+    archive.create_index("archived_at",
+                         expireAfterSeconds=expire_after_seconds)
+
+
+def archive_recipients(db, email_ids, now,
+                       batch_size=recipient_store.INSERT_BATCH_SIZE):
+    # Copies the recipients of mailing lists, each with its delivery status,
+    # a batch at a time since a single list may hold hundreds of thousands
+    if not email_ids:
+        return 0
+    archive = db[ARCHIVE_RECIPIENT_COLLECTION]
+    copied = 0
+    requests = []
+    for recipient in db[recipient_store.RECIPIENT_COLLECTION].find(
+            {"email_id": {"$in": list(email_ids)}}):
+        recipient["archived_at"] = now
+        requests.append(pymongo.ReplaceOne({"_id": recipient["_id"]},
+                                           recipient, upsert=True))
+        if len(requests) == batch_size:
+            archive.bulk_write(requests, ordered=False)
+            copied += len(requests)
+            requests = []
+    if requests:
+        archive.bulk_write(requests, ordered=False)
+        copied += len(requests)
+    return copied
+
+
+def archive_emails(db, older_than_days, batch_size=DEFAULT_BATCH_SIZE,
+                   dry_run=False, now=None):
+    now = now or datetime.datetime.now()
+    cutoff = now - datetime.timedelta(days=older_than_days)
+    query = archive_query(cutoff)
+
+    if dry_run:
+        # Counted by the server on the status index, nothing is shipped back
+        return int(db.command("count", "emails", query=query)["n"])
+
+    archived = 0
+    while True:
+        batch = list(db.emails.find(query).limit(batch_size))
+        if not batch:
+            break
+
+        # The archive keeps a body of its own rather than a reference into
+        # the shared bodies, which are released once the emails are gone
+        bodies.resolve_bodies(db, batch)
+
+        # Upserting makes the copy idempotent, so a run that dies between
+        # the copy and the delete can simply be repeated
+        requests = []
+        for email in batch:
+            archived_email = dict(email, archived_at=now)
+            archived_email.pop("body_hash", None)
+            requests.append(pymongo.ReplaceOne({"_id": email["_id"]},
+                                               archived_email, upsert=True))
+        db[ARCHIVE_COLLECTION].bulk_write(requests, ordered=False)
+        archive_recipients(db, [e["_id"] for e in batch
+                                if e.get("recipient_storage") ==
+                                recipient_store.STORAGE_EXTERNAL], now)
+
+        email_ids = [email["_id"] for email in batch]
+        delete_query = dict(query)
+        delete_query["_id"] = {"$in": email_ids}
+        deleted = db.emails.delete_many(delete_query).deleted_count
+        if deleted < len(batch):
+            remaining = {e["_id"] for e in db.emails.find(
+                {"_id": {"$in": email_ids}}, {"_id": 1})}
+            batch = [e for e in batch if e["_id"] not in remaining]
+
+        # Only once their email is gone, the copies are already in place
+        recipient_store.delete_recipients(
+            db, [e["_id"] for e in batch
+                 if e.get("recipient_storage") ==
+                 recipient_store.STORAGE_EXTERNAL])
+        bodies.release_bodies(db, [e.get("body_hash") for e in batch])
+        archived += deleted
+        if deleted == 0:
+            break
+
+    return archived
@@ -0,0 +1,153 @@
+import datetime
+import functools
+import math
+
+import pymongo
+
+SERVER_COLLECTION = "servers"
+TABLE_COLLECTION = "server_tables"
+TABLE_ID = "current"
+GENERATION_ID = "generation"
+
+DEFAULT_WEIGHT = 1
+MAX_WEIGHT = 1000
+DEFAULT_MAX_CONCURRENCY = 10
+# Weights are reduced by their gcd before the table is built, this only
+# bounds pathological mixes like 999 and 1000
+MAX_TABLE_SIZE = 10000
+
+# Fields the API accepts when registering or updating a server
+SERVER_FIELDS = ("hostname", "port", "username", "password", "weight",
+                 "max_concurrency", "enabled")
+
+
+def to_server_model(server_id, server_dict):
+    now = datetime.datetime.now()
+    return {"_id": server_id,
+            "hostname": server_dict["hostname"],
+            "port": server_dict["port"],
+            "username": server_dict.get("username", ""),
+            "password": server_dict.get("password", ""),
+            "weight": server_dict.get("weight", DEFAULT_WEIGHT),
+            "max_concurrency": server_dict.get("max_concurrency",
+                                               DEFAULT_MAX_CONCURRENCY),
+            "enabled": server_dict.get("enabled", True),
+            "created_at": now,
+            "updated_at": now}
+
+
+def weight_of(server):
+    # Servers registered before weights existed are treated as weight 1
+    if not server.get("enabled", True):
+        return 0
+    return server.get("weight", DEFAULT_WEIGHT)
+
+
+def build_slots(weights):
+    # Smooth weighted round robin, as used by nginx. Every round each server
+    # gains its weight and the leader is picked and pays back the total, so
+    # a 5:1:1 mix comes out as a a b a c a a rather than a a a a a b c
+    divisor = functools.reduce(math.gcd, [w for w in weights if w], 0)
+    if not divisor:
+        return []
+
+    weights = [w // divisor for w in weights]
+    total = sum(weights)
+    if total > MAX_TABLE_SIZE:
+        # Scale down, keeping every server in the table at least once
+        scale = float(MAX_TABLE_SIZE) / total
+        weights = [max(1, int(w * scale)) if w else 0 for w in weights]
+        total = sum(weights)
+
+    current = [0] * len(weights)
+    slots = []
+    for _ in range(total):
+        for i, weight in enumerate(weights):
+            current[i] += weight
+        chosen = max(range(len(weights)), key=lambda i: current[i])
+        current[chosen] -= total
+        slots.append(chosen)
+    return slots
+
+
+def build_table(servers):
+    servers = [s for s in servers if weight_of(s) > 0]
+    servers.sort(key=lambda s: s["_id"])
+    entries = [{"_id": s["_id"],
+                "hostname": s["hostname"],
+                "port": s["port"],
+                "username": s.get("username", ""),
+                "password": s.get("password", ""),
+                "weight": weight_of(s),
+                "max_concurrency": s.get("max_concurrency",
+                                         DEFAULT_MAX_CONCURRENCY)}
+               for s in servers]
+    return {"servers": entries,
+            "slots": build_slots([e["weight"] for e in entries])}
+
+
+def rebuild_table(db):
+    # Every change to the registry takes a new generation before reading the
+    # servers, and a table is only stored over an older one. Two rebuilds
+    # racing each other can't leave the table behind the registry
+    generation = db[TABLE_COLLECTION].find_one_and_update(
+        {"_id": GENERATION_ID},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER)["value"]
+
+    table = build_table(db[SERVER_COLLECTION].find())
+    table["version"] = generation
+    table["built_at"] = datetime.datetime.now()
+    try:
+        db[TABLE_COLLECTION].update_one(
+            {"_id": TABLE_ID, "version": {"$lt": generation}},
+            {"$set": table},
+            upsert=True)
+    except pymongo.errors.DuplicateKeyError:
+        # A newer rebuild already stored its table
+        pass
+    return table
+
+
+def get_table(db):
+    return db[TABLE_COLLECTION].find_one({"_id": TABLE_ID})
+
+
+def ensure_table(db):
+    # Servers added straight to the collection, e.g. by docker/add_server.py
+    # on older images, show up once the API boots
+    if get_table(db) is None:
+        rebuild_table(db)
+
+
+def get_server(db, server_id):
+    return db[SERVER_COLLECTION].find_one({"_id": server_id})
+
+
+def list_servers(db):
+    return list(db[SERVER_COLLECTION].find().sort("_id", pymongo.ASCENDING))
+
+
+def add_server(db, server):
+    db[SERVER_COLLECTION].insert_one(server)
+    return rebuild_table(db)["version"]
+
+
+def update_server(db, server_id, changes):
+    changes = dict(changes)
+    changes["updated_at"] = datetime.datetime.now()
+    server = db[SERVER_COLLECTION].find_one_and_update(
+        {"_id": server_id},
+        {"$set": changes},
+        return_document=pymongo.ReturnDocument.AFTER)
+    if server is None:
+        return None, None
+    return server, rebuild_table(db)["version"]
+
+
+def delete_server(db, server_id):
+    server = db[SERVER_COLLECTION].find_one_and_delete({"_id": server_id})
+    if server is None:
+        return None, None
+    return server, rebuild_table(db)["version"]
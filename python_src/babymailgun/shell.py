@@ -1,3 +1,4 @@
+import csv
 import os
 import sys
 
@@ -15,7 +16,8 @@ def email_cli():
 def get_client():
     host = os.environ.get("API_HOST", "127.0.0.1")
     port = os.environ.get("API_PORT", "5000")
-    return client.MailgunAPIClient(host, port)
+    return client.MailgunAPIClient(
+        host, port, correlation_id=os.environ.get("MAILGUN_CORRELATION_ID"))
 
 
 @email_cli.command(help="Fetch emails")
@@ -67,10 +69,43 @@ def show(email_id, show_body):
     click.echo(str(table))
 
 
-@email_cli.command(help="Delete an email. This won't magically unsend "
-                        "an email ;-)")
-@click.argument("email_id")
-def delete(email_id):
+DELETE_FILTER_KEYS = ("status", "sender", "before")
+
+
+def parse_filters(filters):
+    parsed = {}
+    for f in filters:
+        key, sep, value = f.partition("=")
+        if not sep or key not in DELETE_FILTER_KEYS:
+            raise click.BadParameter(
+                "'{}' must be of the form KEY=VALUE where KEY is one of "
+                "{}".format(f, ", ".join(DELETE_FILTER_KEYS)),
+                param_hint="--filter")
+        parsed[key] = value
+    return parsed
+
+
+@email_cli.command(help="Delete an email, or every email matching --filter. "
+                        "This won't magically unsend an email ;-)")
+@click.argument("email_id", required=False)
+@click.option("-f", "--filter", "filters", multiple=True,
+              help="KEY=VALUE, where KEY is status, sender or before "
+                   "(YYYY-MM-DD). May be repeated")
+@click.option("--threshold", type=int, default=100,
+              help="Ask for confirmation when a filter matches more "
+                   "emails than this")
+@click.option("-y", "--yes", is_flag=True, default=False,
+              help="Don't ask for confirmation")
+def delete(email_id, filters, threshold, yes):
+    if email_id and filters:
+        sys.exit("Supply either an email id or --filter, not both")
+    if not email_id and not filters:
+        sys.exit("Supply an email id or at least one --filter")
+
+    if filters:
+        delete_by_filter(parse_filters(filters), threshold, yes)
+        return
+
     try:
         api_client = get_client()
         api_client.delete_email(email_id)
@@ -80,21 +115,52 @@ def delete(email_id):
     click.echo("Successfully deleted email with ID '{}'".format(email_id))
 
 
+def delete_by_filter(filters, threshold, yes):
+    try:
+        api_client = get_client()
+        matched = api_client.delete_emails(dry_run=True, **filters)["deleted"]
+    except Exception as e:
+        click.echo("Counting matching emails failed with:")
+        sys.exit(e)
+
+    if matched == 0:
+        click.echo("No emails match the given filters")
+        return
+
+    if matched > threshold and not yes:
+        click.confirm("This will delete {} emails. Continue?".format(matched),
+                      abort=True)
+
+    try:
+        deleted = api_client.delete_emails(**filters)["deleted"]
+    except Exception as e:
+        click.echo("Deleting emails failed with:")
+        sys.exit(e)
+    click.echo("Successfully deleted {} email(s)".format(deleted))
+
+
 @email_cli.command(help="Show recipient status of a single email")
 @click.argument("email_id")
-def get_recipients(email_id):
+@click.option("--status", type=int,
+              help="Only show recipients with this status code")
+@click.option("--page-size", type=int,
+              help="Recipients fetched per request for mailing lists")
+@click.option("-d", "--domain",
+              help="Only show recipients at this domain")
+def get_recipients(email_id, status, page_size, domain):
     try:
         api_client = get_client()
-        recipients = api_client.get_email_recipients(email_id)
+        recipients = list(api_client.iter_email_recipients(
+            email_id, status=status, limit=page_size, domain=domain))
     except Exception as e:
         click.echo("Fetching recipients failed with:")
         sys.exit(e)
 
     table = prettytable.PrettyTable()
-    table.field_names = ["Recipient", "Type", "Reason"]
+    table.field_names = ["Recipient", "Type", "Status", "Reason"]
     for recipient in recipients:
         table.add_row([recipient["address"], recipient["type"],
-                       recipient["reason"]])
+                       recipient["status"], recipient["reason"]])
     click.echo(str(table))
 
 
@@ -105,7 +171,22 @@ def get_recipients(email_id):
 @click.option("--bcc", multiple=True)
 @click.option("-s", "--subject")
 @click.option("-b", "--body", help="Path to a file containing the body")
-def send(sender, to, cc, bcc, subject, body):
+@click.option("-l", "--list-file",
+              help="Path to a file of recipient addresses, one per line. "
+                   "Sends as a mailing list")
+@click.option("-p", "--priority", type=click.Choice(["low", "normal", "high"]))
+@click.option("--send-at",
+              help="Hold the email until YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
+def send(sender, to, cc, bcc, subject, body, list_file, priority, send_at):
+    mailing_list = False
+    if list_file:
+        list_file = os.path.expanduser(list_file)
+        if not os.path.exists(list_file):
+            sys.exit("List path '{}' does not exist".format(list_file))
+        with open(list_file, 'r') as f:
+            to = list(to) + [line.strip() for line in f if line.strip()]
+        mailing_list = True
+
     if not body:
         sys.exit("Body path must be supplied with -b/--body!")
     body = os.path.expanduser(body)
@@ -121,11 +202,19 @@ def send(sender, to, cc, bcc, subject, body):
 
     try:
         api_client = get_client()
-        email = api_client.create_email(subject, sender, to, cc, bcc, email_body)
+        email = api_client.create_email(subject, sender, to, cc, bcc,
+                                        email_body, mailing_list=mailing_list,
+                                        priority=priority, send_at=send_at)
     except Exception as e:
         click.echo("Creating an email failed with:")
         sys.exit(e)
 
+    if mailing_list:
+        click.echo("Email from '{}' to {} list recipient(s) with id {} "
+                   "queued".format(email["sender"], email["recipient_count"],
+                                   email["id"]))
+        return
+
     click.echo("Email from '{}' to '{}' with id {} queued "
                "for delivery".format(
                    email["sender"],
@@ -133,6 +222,380 @@ def send(sender, to, cc, bcc, subject, body):
                    email["id"]))
 
 
+@email_cli.command(help="Move finished emails older than N days into the "
+                        "archive collection")
+@click.option("-o", "--older-than", type=int,
+              help="Age in days. Defaults to the server's RETENTION_DAYS")
+@click.option("--batch-size", type=int,
+              help="Number of emails moved per batch")
+@click.option("-n", "--dry-run", is_flag=True, default=False,
+              help="Only report how many emails would be archived")
+def archive(older_than, batch_size, dry_run):
+    try:
+        api_client = get_client()
+        result = api_client.archive_emails(older_than=older_than,
+                                           batch_size=batch_size,
+                                           dry_run=dry_run)
+    except Exception as e:
+        click.echo("Archiving emails failed with:")
+        sys.exit(e)
+
+    if result["dry_run"]:
+        click.echo("{} email(s) older than {} day(s) would be "
+                   "archived".format(result["archived"],
+                                     result["older_than"]))
+    else:
+        click.echo("Archived {} email(s) older than {} day(s)".format(
+            result["archived"], result["older_than"]))
+
+
+def read_template_recipients(path):
+    # A CSV with an "address" column. Every other column is a template
+    # variable of the same name
+    with open(path, 'r') as f:
+        reader = csv.DictReader(f)
+        if "address" not in (reader.fieldnames or []):
+            sys.exit("Recipients file '{}' has no 'address' "
+                     "column".format(path))
+        recipients = []
+        for row in reader:
+            address = row.pop("address")
+            recipients.append({"address": address, "variables": row})
+    return recipients
+
+
+@email_cli.command(help="Send a template email, personalized per recipient "
+                        "with {{ variable }} placeholders")
+@click.argument("sender")
+@click.option("-s", "--subject")
+@click.option("-b", "--body", help="Path to a file containing the body "
+                                   "template")
+@click.option("-r", "--recipients",
+              help="Path to a CSV file with an 'address' column and one "
+                   "column per template variable")
+@click.option("-p", "--priority", type=click.Choice(["low", "normal", "high"]))
+@click.option("--send-at",
+              help="Hold the email until YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
+def send_template(sender, subject, body, recipients, priority, send_at):
+    if not body:
+        sys.exit("Body path must be supplied with -b/--body!")
+    if not recipients:
+        sys.exit("Recipients path must be supplied with -r/--recipients!")
+    if not subject:
+        sys.exit("No subject specified!")
+
+    body = os.path.expanduser(body)
+    recipients = os.path.expanduser(recipients)
+    for path in (body, recipients):
+        if not os.path.exists(path):
+            sys.exit("Path '{}' does not exist".format(path))
+
+    with open(body, 'r') as f:
+        email_body = "".join(f.readlines())
+    template_recipients = read_template_recipients(recipients)
+
+    try:
+        api_client = get_client()
+        email = api_client.create_template_email(subject, sender,
+                                                 template_recipients,
+                                                 email_body,
+                                                 priority=priority,
+                                                 send_at=send_at)
+    except Exception as e:
+        click.echo("Creating a template email failed with:")
+        sys.exit(e)
+
+    click.echo("Template email from '{}' to {} recipient(s) with id {} "
+               "queued".format(email["sender"], email["recipient_count"],
+                               email["id"]))
+
+
+@email_cli.command(help="Show a template email as a single recipient "
+                        "will receive it")
+@click.argument("email_id")
+@click.argument("address")
+def preview(email_id, address):
+    try:
+        api_client = get_client()
+        rendered = api_client.preview_email(email_id, address)
+    except Exception as e:
+        click.echo("Previewing email failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["To", rendered["address"]])
+    table.add_row(["Subject", rendered["subject"]])
+    table.add_row(["Body", rendered["body"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Move inline email bodies into the shared, "
+                        "deduplicated bodies collection")
+@click.option("--batch-size", type=int,
+              help="Number of emails migrated per batch")
+@click.option("-n", "--dry-run", is_flag=True, default=False,
+              help="Only report what the migration would save")
+def migrate_bodies(batch_size, dry_run):
+    try:
+        api_client = get_client()
+        report = api_client.migrate_bodies(batch_size=batch_size,
+                                           dry_run=dry_run)
+    except Exception as e:
+        click.echo("Migrating bodies failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["Emails migrated", report["migrated"]])
+    table.add_row(["Body bytes before", report["bytes_before"]])
+    table.add_row(["Body bytes stored", report["bytes_stored"]])
+    table.add_row(["Bytes saved", report["bytes_saved"]])
+    table.add_row(["Dry run", report["dry_run"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Show how much space shared bodies are saving")
+def body_stats():
+    try:
+        api_client = get_client()
+        stats = api_client.get_body_stats()
+    except Exception as e:
+        click.echo("Fetching body stats failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["Unique bodies", stats["bodies"]])
+    table.add_row(["Emails referencing them", stats["references"]])
+    table.add_row(["Bytes stored", stats["bytes_stored"]])
+    table.add_row(["Bytes saved", stats["bytes_saved"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Show queued emails in the order they'll be sent")
+@click.option("-l", "--limit", type=int, default=100)
+def schedule(limit):
+    try:
+        api_client = get_client()
+        emails = api_client.get_schedule(limit=limit)
+    except Exception as e:
+        click.echo("Getting the schedule failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["ID", "Sender", "Priority", "Send At", "Due",
+                         "Tries"]
+    for email in emails:
+        table.add_row([email["id"], email["sender"], email["priority"],
+                       email["send_at"], email["due"], email["tries"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Show the API's queue depth estimate and whether it "
+                        "is accepting new emails")
+def admission():
+    try:
+        api_client = get_client()
+        stats = api_client.get_admission_stats()
+    except Exception as e:
+        click.echo("Getting admission stats failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["Enabled", stats["enabled"]])
+    table.add_row(["Accepting", not stats["shedding"]])
+    table.add_row(["Queue depth estimate", stats["estimate"]])
+    table.add_row(["High watermark", stats["high_watermark"]])
+    table.add_row(["Low watermark", stats["low_watermark"]])
+    table.add_row(["Admitted", stats["admitted"]])
+    table.add_row(["Rejected", stats["rejected"]])
+    table.add_row(["Last refresh", stats["last_refresh_at"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Show how often the API's address validation is "
+                        "answered from its cache")
+def address_cache():
+    try:
+        api_client = get_client()
+        stats = api_client.get_address_cache_stats()
+    except Exception as e:
+        click.echo("Getting address cache stats failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["Enabled", stats["enabled"]])
+    table.add_row(["Cached addresses", stats["size"]])
+    table.add_row(["Max size", stats["max_size"]])
+    table.add_row(["Hits", stats["hits"]])
+    table.add_row(["Misses", stats["misses"]])
+    table.add_row(["Hit rate", "{:.1%}".format(stats["hit_rate"])])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Show the API's storage backend and how many emails "
+                        "it holds in each status")
+def storage():
+    try:
+        api_client = get_client()
+        stats = api_client.get_storage_stats()
+    except Exception as e:
+        click.echo("Getting storage stats failed with:")
+        sys.exit(e)
+
+    table = prettytable.PrettyTable()
+    table.field_names = ["Field", "Entry"]
+    table.add_row(["Backend", stats["backend"]])
+    table.add_row(["Emails", stats["emails"]])
+    for status in sorted(stats["statuses"]):
+        table.add_row(["Status {}".format(status), stats["statuses"][status]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="Release emails whose worker has held them longer "
+                        "than the lease duration")
+@click.option("--lease-seconds", type=int,
+              help="Claims older than this are released. Defaults to the "
+                   "server's LEASE_DURATION")
+@click.option("-n", "--dry-run", is_flag=True, default=False,
+              help="Only report how many emails would be released")
+@click.option("--stats", is_flag=True, default=False,
+              help="Show the reaper's counters instead of running it")
+def reap(lease_seconds, dry_run, stats):
+    try:
+        api_client = get_client()
+        if stats:
+            result = api_client.get_reaper_stats()
+        else:
+            result = api_client.run_reaper(lease_seconds=lease_seconds,
+                                           dry_run=dry_run)
+    except Exception as e:
+        click.echo("Releasing stale emails failed with:")
+        sys.exit(e)
+
+    if stats:
+        table = prettytable.PrettyTable()
+        table.field_names = ["Field", "Entry"]
+        table.add_row(["Runs", result["runs"]])
+        table.add_row(["Recovered", result["recovered"]])
+        table.add_row(["Last recovered", result["last_recovered"]])
+        table.add_row(["Last run", result["last_run_at"]])
+        table.add_row(["Errors", result["errors"]])
+        table.add_row(["Background", result["running"]])
+        click.echo(str(table))
+    elif result["dry_run"]:
+        click.echo("{} email(s) held longer than {} seconds would be "
+                   "released".format(result["recovered"],
+                                     result["lease_seconds"]))
+    else:
+        click.echo("Released {} email(s) held longer than {} "
+                   "seconds".format(result["recovered"],
+                                    result["lease_seconds"]))
+
+
+def print_servers(registered):
+    table = prettytable.PrettyTable()
+    table.field_names = ["ID", "Hostname", "Port", "Username", "Weight",
+                         "Max Concurrency", "Enabled"]
+    for server in registered:
+        table.add_row([server["id"], server["hostname"], server["port"],
+                       server["username"], server["weight"],
+                       server["max_concurrency"], server["enabled"]])
+    click.echo(str(table))
+
+
+@email_cli.command(help="List registered SMTP servers")
+def servers():
+    try:
+        api_client = get_client()
+        registered = api_client.get_servers()
+    except Exception as e:
+        click.echo("Listing servers failed with:")
+        sys.exit(e)
+    print_servers(registered)
+
+
+@email_cli.command(help="Register an SMTP server")
+@click.argument("hostname")
+@click.argument("port", type=int)
+@click.option("-u", "--username")
+@click.option("-p", "--password")
+@click.option("-w", "--weight", type=int,
+              help="Share of email sent through this server relative to "
+                   "the others, 0 drains it")
+@click.option("--max-concurrency", type=int,
+              help="Sends in flight at once per worker process")
+@click.option("--disabled", is_flag=True, default=False)
+def add_server(hostname, port, username, password, weight, max_concurrency,
+               disabled):
+    try:
+        api_client = get_client()
+        server = api_client.create_server(
+            hostname, port, username=username, password=password,
+            weight=weight, max_concurrency=max_concurrency,
+            enabled=False if disabled else None)
+    except Exception as e:
+        click.echo("Registering the server failed with:")
+        sys.exit(e)
+    print_servers([server])
+
+
+@email_cli.command(help="Change a registered SMTP server")
+@click.argument("server_id")
+@click.option("-w", "--weight", type=int)
+@click.option("--max-concurrency", type=int)
+@click.option("--enable/--disable", default=None)
+def update_server(server_id, weight, max_concurrency, enable):
+    changes = {}
+    if weight is not None:
+        changes["weight"] = weight
+    if max_concurrency is not None:
+        changes["max_concurrency"] = max_concurrency
+    if enable is not None:
+        changes["enabled"] = enable
+    if not changes:
+        sys.exit("Nothing to change!")
+
+    try:
+        api_client = get_client()
+        server = api_client.update_server(server_id, **changes)
+    except Exception as e:
+        click.echo("Updating the server failed with:")
+        sys.exit(e)
+    print_servers([server])
+
+
+@email_cli.command(help="Remove a registered SMTP server")
+@click.argument("server_id")
+def remove_server(server_id):
+    try:
+        api_client = get_client()
+        api_client.delete_server(server_id)
+    except Exception as e:
+        click.echo("Removing the server failed with:")
+        sys.exit(e)
+    click.echo("Server {} removed".format(server_id))
+
+
+@email_cli.command(help="Show the weighted round robin table workers use")
+def server_table():
+    try:
+        api_client = get_client()
+        table = api_client.get_server_table()
+    except Exception as e:
+        click.echo("Getting the server table failed with:")
+        sys.exit(e)
+
+    click.echo("Version {}, built {}".format(table["version"],
+                                             table["built_at"]))
+    hostnames = ["{}:{}".format(s["hostname"], s["port"])
+                 for s in table["servers"]]
+    click.echo(" ".join(hostnames[slot] for slot in table["slots"]))
+
+
 def main():
     email_cli()
 
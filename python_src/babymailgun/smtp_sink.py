@@ -0,0 +1,271 @@
+# An in-process SMTP server that accepts and discards mail, for exercising
+# the worker without MailHog or docker. Like Failhog it can be told to slow
+# down or misbehave, using the replies the worker's ErrorToUpdateStatus
+# understands:
+#
+#   reject rate       RCPT answered "550 Invalid Recipient <address>"
+#   auth failure rate AUTH answered "500 Unrecognised command"
+#   disconnect rate   connection dropped after DATA, the worker sees EOF
+#
+#   python -m babymailgun.smtp_sink --port 1025 --latency 0.05
+import base64
+import collections
+import datetime
+import random
+import socketserver
+import threading
+import time
+
+import click
+
+Message = collections.namedtuple("Message", ["sender", "recipients", "data",
+                                             "received_at"])
+
+INVALID_RECIPIENT = "550 Invalid Recipient"
+UNRECOGNIZED_COMMAND = "500 Unrecognised command"
+MAX_LINE_LENGTH = 65536
+
+
+class _Disconnect(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def __init__(self, request, client_address, server):
+        # The base class serves the whole session from inside __init__, so
+        # the session state has to exist before handing over to it
+        self.sink = server.sink
+        self.sender = None
+        self.recipients = []
+        super().__init__(request, client_address, server)
+
+    def reset(self):
+        self.sender = None
+        self.recipients = []
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def readline(self):
+        line = self.rfile.readline(MAX_LINE_LENGTH)
+        if not line:
+            raise _Disconnect()
+        return line.decode("utf-8", "replace").rstrip("\r\n")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.readline()
+            if line == ".":
+                return "\r\n".join(lines)
+            # Undo the client's dot stuffing
+            if line.startswith(".."):
+                line = line[1:]
+            lines.append(line)
+
+    def handle(self):
+        self.sink.count("sessions")
+        self.reply("220 {} babymailgun sink ready".format(self.sink.hostname))
+        try:
+            while True:
+                if not self.command(self.readline()):
+                    return
+        except (_Disconnect, ConnectionError):
+            return
+
+    def command(self, line):
+        verb, _, argument = line.partition(" ")
+        verb = verb.upper()
+
+        if verb == "EHLO":
+            self.reply("250-{}".format(self.sink.hostname))
+            self.reply("250-AUTH PLAIN")
+            self.reply("250 8BITMIME")
+        elif verb == "HELO":
+            self.reply("250 {}".format(self.sink.hostname))
+        elif verb == "AUTH":
+            self.auth(argument)
+        elif verb == "MAIL":
+            self.reset()
+            self.sender = _address(argument)
+            self.reply("250 OK")
+        elif verb == "RCPT":
+            address = _address(argument)
+            if self.sink.roll("reject_rate"):
+                self.sink.count("rejected")
+                self.reply("{} {}".format(INVALID_RECIPIENT, address))
+            else:
+                self.recipients.append(address)
+                self.reply("250 OK")
+        elif verb == "DATA":
+            if self.sender is None or not self.recipients:
+                self.reply("503 Bad sequence of commands")
+                return True
+            self.reply("354 End data with <CR><LF>.<CR><LF>")
+            data = self.read_data()
+            if self.sink.latency:
+                time.sleep(self.sink.latency)
+            if self.sink.roll("disconnect_rate"):
+                self.sink.count("disconnects")
+                return False
+            self.sink.deliver(Message(self.sender, list(self.recipients),
+                                      data, time.time()))
+            self.reset()
+            self.reply("250 OK queued")
+        elif verb == "RSET":
+            self.reset()
+            self.reply("250 OK")
+        elif verb == "NOOP":
+            self.reply("250 OK")
+        elif verb == "QUIT":
+            self.reply("221 Bye")
+            return False
+        else:
+            self.reply(UNRECOGNIZED_COMMAND)
+        return True
+
+    def auth(self, argument):
+        mechanism, _, response = argument.partition(" ")
+        if mechanism.upper() != "PLAIN":
+            self.reply("504 Unrecognized authentication type")
+            return
+        if not response:
+            self.reply("334 ")
+            response = self.readline()
+        try:
+            base64.b64decode(response)
+        except ValueError:
+            self.reply("501 Malformed AUTH input")
+            return
+
+        # Any credentials will do, failures are only ever injected
+        if self.sink.roll("auth_failure_rate"):
+            self.sink.count("auth_failures")
+            self.reply(UNRECOGNIZED_COMMAND)
+        else:
+            self.reply("235 Authentication successful")
+
+
+def _address(argument):
+    # "FROM:<a@b.com> BODY=8BITMIME" -> "a@b.com"
+    _, _, address = argument.partition(":")
+    address = address.strip().split(" ")[0]
+    return address.strip("<>")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink(object):
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0,
+                 reject_rate=0.0, auth_failure_rate=0.0, disconnect_rate=0.0,
+                 keep_messages=1000, on_message=None, seed=None):
+        self.hostname = host
+        self.latency = latency
+        self._rates = {"reject_rate": reject_rate,
+                       "auth_failure_rate": auth_failure_rate,
+                       "disconnect_rate": disconnect_rate}
+        self._on_message = on_message
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Only the most recent messages are kept, long runs would otherwise
+        # hold every body in memory
+        self.messages = collections.deque(maxlen=keep_messages)
+        self._stats = collections.Counter()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = {key: self._stats[key] for key in (
+                "sessions", "messages", "recipients", "rejected",
+                "auth_failures", "disconnects")}
+        stats.update(self._rates)
+        stats["latency"] = self.latency
+        return stats
+
+    def roll(self, rate):
+        rate = self._rates[rate]
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def deliver(self, message):
+        with self._lock:
+            self._stats["messages"] += 1
+            self._stats["recipients"] += len(message.recipients)
+            self.messages.append(message)
+        if self._on_message:
+            self._on_message(message)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={"poll_interval": 0.1},
+                                        name="smtp-sink")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # shutdown() waits for serve_forever, which never ran if the sink
+        # wasn't started
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=1025)
+@click.option("--latency", type=float, default=0.0,
+              help="Seconds to wait before accepting each message")
+@click.option("--reject-rate", type=float, default=0.0)
+@click.option("--auth-failure-rate", type=float, default=0.0)
+@click.option("--disconnect-rate", type=float, default=0.0)
+@click.option("--report-every", type=int, default=10,
+              help="Seconds between stats lines")
+def main(host, port, latency, reject_rate, auth_failure_rate,
+         disconnect_rate, report_every):
+    sink = SMTPSink(host, port, latency=latency, reject_rate=reject_rate,
+                    auth_failure_rate=auth_failure_rate,
+                    disconnect_rate=disconnect_rate)
+    click.echo("Listening on {}:{}".format(*sink.address))
+    with sink:
+        try:
+            while True:
+                time.sleep(report_every)
+                stats = sink.stats
+                click.echo("{} messages={} recipients={} rejected={} "
+                           "auth_failures={} disconnects={}".format(
+                               datetime.datetime.now().isoformat(),
+                               stats["messages"], stats["recipients"],
+                               stats["rejected"], stats["auth_failures"],
+                               stats["disconnects"]))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
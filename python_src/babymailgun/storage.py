@@ -0,0 +1,200 @@
+import abc
+import bisect
+import collections
+import copy
+import threading
+
+import pymongo
+
+STORAGE_BACKENDS = ["mongo", "memory"]
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class Storage(metaclass=abc.ABCMeta):
+    # The email document lifecycle the API itself drives. Emails are plain
+    # dicts keyed by "_id" whichever engine holds them. Listings page through
+    # emails in _id order, handing back the last _id of a full page as the
+    # cursor for the next
+    name = None
+
+    @abc.abstractmethod
+    def ping(self):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def insert_email(self, email):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_email(self, email_id, projection=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def list_emails(self, status=None, before=None, after=None, limit=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete_email(self, email_id, projection=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def stats(self):
+        raise NotImplementedError()
+
+
+def _to_page(emails, limit):
+    if limit is None or len(emails) <= limit:
+        return emails, None
+    emails = emails[:limit]
+    return emails, emails[-1]["_id"]
+
+
+class MongoStorage(Storage):
+    name = "mongo"
+
+    def __init__(self, db):
+        self._db = db
+
+    def ping(self):
+        self._db.command("ping")
+
+    def insert_email(self, email):
+        self._db.emails.insert_one(email)
+
+    def get_email(self, email_id, projection=None):
+        return self._db.emails.find_one({"_id": email_id}, projection)
+
+    def list_emails(self, status=None, before=None, after=None, limit=None):
+        query = {}
+        if status is not None:
+            query["status"] = status
+        if before is not None:
+            query["created_at"] = {"$lt": before}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+
+        cursor = self._db.emails.find(query).sort("_id", pymongo.ASCENDING)
+        # One extra tells us whether there's another page without a count
+        if limit is not None:
+            cursor = cursor.limit(limit + 1)
+        return _to_page(list(cursor), limit)
+
+    def delete_email(self, email_id, projection=None):
+        return self._db.emails.find_one_and_delete({"_id": email_id},
+                                                   projection)
+
+    def stats(self):
+        statuses = {row["_id"]: row["count"]
+                    for row in self._db.emails.aggregate([
+                        {"$group": {"_id": "$status",
+                                    "count": {"$sum": 1}}}])}
+        return {"backend": self.name,
+                "emails": sum(statuses.values()),
+                "statuses": statuses}
+
+
+class MemoryStorage(Storage):
+    # Keeps emails in the API process, for tests and for benchmarking the API
+    # without a database. Every index is a sorted list, so lookups are a
+    # bisect and listings start from the narrowest one:
+    #
+    #   _emails      _id -> email
+    #   _ids         every _id
+    #   _by_status   status -> _ids with that status
+    #   _by_created  (created_at, _id) pairs
+    #
+    # Documents are copied in and out so callers can't change what's stored
+    # behind its indexes' backs, just as with Mongo
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._emails = {}
+        self._ids = []
+        self._by_status = collections.defaultdict(list)
+        self._by_created = []
+
+    def ping(self):
+        pass
+
+    def insert_email(self, email):
+        email_id = email["_id"]
+        with self._lock:
+            if email_id in self._emails:
+                raise pymongo.errors.DuplicateKeyError(
+                    "E11000 duplicate key _id: {}".format(email_id))
+            self._emails[email_id] = copy.deepcopy(email)
+            bisect.insort(self._ids, email_id)
+            bisect.insort(self._by_status[email["status"]], email_id)
+            bisect.insort(self._by_created, (email["created_at"], email_id))
+
+    def get_email(self, email_id, projection=None):
+        with self._lock:
+            email = self._emails.get(email_id)
+            if email is None:
+                return None
+            return _project(email, projection)
+
+    def _candidates(self, status, before):
+        # Starts from whichever index narrows the listing the most. Whatever
+        # that index doesn't cover is checked email by email
+        ids = self._ids
+        if status is not None:
+            ids = self._by_status.get(status, [])
+        if before is not None:
+            end = bisect.bisect_left(self._by_created, (before,))
+            if end < len(ids):
+                ids = sorted(email_id
+                             for _, email_id in self._by_created[:end])
+        return ids
+
+    def list_emails(self, status=None, before=None, after=None, limit=None):
+        with self._lock:
+            ids = self._candidates(status, before)
+            start = 0 if after is None else bisect.bisect_right(ids, after)
+            page = []
+            for email_id in ids[start:]:
+                email = self._emails[email_id]
+                if status is not None and email["status"] != status:
+                    continue
+                if before is not None and not email["created_at"] < before:
+                    continue
+                page.append(copy.deepcopy(email))
+                if limit is not None and len(page) > limit:
+                    break
+        return _to_page(page, limit)
+
+    def delete_email(self, email_id, projection=None):
+        with self._lock:
+            email = self._emails.pop(email_id, None)
+            if email is None:
+                return None
+            _remove(self._ids, email_id)
+            _remove(self._by_status[email["status"]], email_id)
+            _remove(self._by_created, (email["created_at"], email_id))
+        return _project(email, projection)
+
+    def stats(self):
+        with self._lock:
+            statuses = {status: len(ids)
+                        for status, ids in self._by_status.items() if ids}
+            return {"backend": self.name,
+                    "emails": len(self._emails),
+                    "statuses": statuses}
+
+
+def _project(email, projection):
+    if not projection:
+        return copy.deepcopy(email)
+    projected = {"_id": email["_id"]}
+    for key in projection:
+        if key in email:
+            projected[key] = copy.deepcopy(email[key])
+    return projected
+
+
+def _remove(ordered, value):
+    index = bisect.bisect_left(ordered, value)
+    if index < len(ordered) and ordered[index] == value:
+        del ordered[index]
@@ -0,0 +1,43 @@
+import collections
+import re
+
+# Placeholders look like {{ first_name }}. Deliberately nothing more than
+# substitution, there are no conditionals, loops or filters to evaluate
+PLACEHOLDER_REGEX = re.compile(r"\{\{\s*([a-zA-Z0-9_]+)\s*\}\}")
+
+
+def placeholders(template):
+    return set(PLACEHOLDER_REGEX.findall(template))
+
+
+def placeholder_counts(template):
+    return collections.Counter(PLACEHOLDER_REGEX.findall(template))
+
+
+def strip_placeholders(template):
+    return PLACEHOLDER_REGEX.sub("", template)
+
+
+def rendered_length(static_length, counts, variables):
+    # What len(render()) would be, from the length of the template with its
+    # placeholders stripped and how often each placeholder appears, without
+    # building the string
+    return static_length + sum(len(str(variables.get(name, ""))) * count
+                               for name, count in counts.items())
+
+
+def render(template, variables):
+    # Anything missing renders as an empty string. Submissions are checked
+    # for missing variables up front, so this only matters for previews of
+    # hand edited data
+    def substitute(match):
+        return str(variables.get(match.group(1), ""))
+
+    return PLACEHOLDER_REGEX.sub(substitute, template)
+
+
+def render_email(email, recipient):
+    variables = recipient.get("variables", {})
+    return {"address": recipient["address"],
+            "subject": render(email["subject"], variables),
+            "body": render(email["body"], variables)}
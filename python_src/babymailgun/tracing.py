@@ -0,0 +1,116 @@
+import contextlib
+import datetime
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+
+import flask
+
+HEADER = "X-Correlation-ID"
+# Callers may pass their own ids, but they end up in logs and on stored
+# emails, so only sane ones are kept
+CORRELATION_ID_REGEX = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+EXPORTERS = ["none", "log", "file"]
+DEFAULT_TRACE_FILE = "traces.jsonl"
+
+LOG = logging.getLogger(__name__)
+
+
+def to_correlation_id(value=None):
+    if value and CORRELATION_ID_REGEX.match(value):
+        return value
+    return uuid.uuid4().hex
+
+
+class Trace(object):
+    def __init__(self, correlation_id, name, clock=time.perf_counter):
+        self.correlation_id = correlation_id
+        self.name = name
+        self.spans = []
+        self._clock = clock
+        self._started_at = datetime.datetime.now()
+        self._start = clock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self._start) * 1000, 3),
+                "duration_ms": round((self._clock() - start) * 1000, 3)})
+
+    def finish(self, **fields):
+        record = {"correlation_id": self.correlation_id,
+                  "name": self.name,
+                  "started_at": self._started_at.isoformat(),
+                  "duration_ms": round((self._clock() - self._start) * 1000,
+                                       3),
+                  "spans": self.spans}
+        record.update(fields)
+        return record
+
+
+def current():
+    if not flask.has_request_context():
+        return None
+    return getattr(flask.g, "trace", None)
+
+
+def current_correlation_id():
+    trace = current()
+    return trace.correlation_id if trace else None
+
+
+@contextlib.contextmanager
+def span(name):
+    # A no-op outside of a traced request, so helpers can be timed without
+    # caring who calls them
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def configure_log(stream=None):
+    # Nothing else configures logging, so left alone the logger would
+    # inherit the root's WARNING level and drop every trace. Handlers from
+    # an earlier exporter are replaced so no trace is written twice
+    LOG.setLevel(logging.INFO)
+    LOG.propagate = False
+    for handler in list(LOG.handlers):
+        LOG.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    LOG.addHandler(handler)
+
+
+class Exporter(object):
+    def __init__(self, kind="none", path=DEFAULT_TRACE_FILE, slow_ms=0,
+                 stream=None):
+        self.kind = kind
+        self._path = path
+        self._slow_ms = slow_ms
+        self._lock = threading.Lock()
+        if kind == "log":
+            configure_log(stream)
+
+    def export(self, record):
+        if self.kind == "none" or record["duration_ms"] < self._slow_ms:
+            return
+        line = json.dumps(record, sort_keys=True, default=str)
+        if self.kind == "log":
+            LOG.info(line)
+            return
+        # One JSON document per line. Appends this small are atomic, so
+        # several processes can share the file
+        with self._lock:
+            with open(self._path, "a") as f:
+                f.write(line + "\n")
@@ -0,0 +1,3 @@
+from babymailgun import app as mailgun_app
+
+application = mailgun_app.create_app()
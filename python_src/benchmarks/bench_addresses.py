@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Compares validating every address with the regex against the cached
+# AddressValidator, on traffic that keeps drawing from the same pool of
+# addresses. Popularity is skewed, a few addresses turn up in most
+# submissions, as they do for real senders.
+#
+#   python benchmarks/bench_addresses.py -n 20000 --pool 300000
+import random
+import time
+
+import click
+
+from babymailgun import addresses
+
+
+def make_pool(size):
+    return ["customer{}+news@mail{}.example.com".format(i, i % 500)
+            for i in range(size)]
+
+
+def make_traffic(pool, submissions, recipients, skew, seed):
+    rng = random.Random(seed)
+    # paretovariate gives a long tail: most draws land near the start of
+    # the pool
+    def draw():
+        index = int(rng.paretovariate(skew)) - 1
+        return pool[index % len(pool)]
+    return [[draw() for _ in range(recipients)]
+            for _ in range(submissions)]
+
+
+def run(check, traffic):
+    start = time.perf_counter()
+    for submission in traffic:
+        check(submission)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("-n", "--submissions", type=int, default=20000)
+@click.option("--recipients", type=int, default=10,
+              help="Addresses per submission")
+@click.option("--pool", type=int, default=300000,
+              help="Distinct addresses traffic is drawn from")
+@click.option("--skew", type=float, default=0.6,
+              help="Pareto shape, lower spreads traffic over more of the "
+                   "pool")
+@click.option("--cache-size", type=int, default=addresses.DEFAULT_CACHE_SIZE)
+@click.option("--seed", type=int, default=1)
+def main(submissions, recipients, pool, skew, cache_size, seed):
+    traffic = make_traffic(make_pool(pool), submissions, recipients, skew,
+                           seed)
+    total = submissions * recipients
+    distinct = len({a for submission in traffic for a in submission})
+
+    def uncached(submission):
+        return [a for a in submission
+                if not addresses.is_valid_address(a)]
+
+    per_address = addresses.AddressValidator(cache_size)
+
+    def cached(submission):
+        return [a for a in submission if not per_address.is_valid(a)]
+
+    batched = addresses.AddressValidator(cache_size)
+
+    click.echo("{} addresses, {} distinct, cache of {}".format(
+        total, distinct, cache_size))
+    baseline = run(uncached, traffic)
+    click.echo("{:<24}{:>10.0f} ns/address".format(
+        "regex", baseline / total * 1e9))
+    for name, check, validator in (
+            ("cached, one at a time", cached, per_address),
+            ("cached, batch", batched.invalid_addresses, batched)):
+        elapsed = run(check, traffic)
+        click.echo("{:<24}{:>10.0f} ns/address  {:.1f}x  hit rate "
+                   "{:.1%}".format(name, elapsed / total * 1e9,
+                                   baseline / elapsed,
+                                   validator.stats["hit_rate"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Drives a running API with concurrent clients and reports throughput and
+# latency percentiles. Run it once against the dev server and once against
+# the production entrypoint to compare the two, e.g.
+#
+#   python benchmarks/bench_api.py -n 5000 -c 32 --endpoint send
+#   python benchmarks/bench_api.py -n 5000 -c 32 --endpoint show
+import json
+import os
+import threading
+import time
+
+import click
+import requests
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+def email_payload():
+    return json.dumps({"subject": "Benchmark",
+                       "from": "from@bench.com",
+                       "to": ["to@bench.com"],
+                       "cc": [],
+                       "bcc": [],
+                       "body": "buffalo " * 64})
+
+
+class Worker(threading.Thread):
+    def __init__(self, base_url, endpoint, requests_per_worker, email_id):
+        super().__init__()
+        self._base_url = base_url
+        self._endpoint = endpoint
+        self._count = requests_per_worker
+        self._email_id = email_id
+        self.latencies = []
+        self.errors = 0
+
+    def _request(self, session):
+        if self._endpoint == "send":
+            return session.post(
+                "{}/emails".format(self._base_url), data=email_payload(),
+                headers={"Content-Type": "application/json"})
+        if self._endpoint == "show":
+            return session.get("{}/emails/{}".format(self._base_url,
+                                                     self._email_id))
+        return session.get("{}/emails".format(self._base_url))
+
+    def run(self):
+        session = requests.Session()
+        for _ in range(self._count):
+            start = time.time()
+            try:
+                resp = self._request(session)
+                if resp.status_code >= 400:
+                    self.errors += 1
+            except requests.exceptions.RequestException:
+                self.errors += 1
+            self.latencies.append(time.time() - start)
+
+
+@click.command()
+@click.option("-n", "--requests", "total", type=int, default=2000,
+              help="Total number of requests")
+@click.option("-c", "--concurrency", type=int, default=16)
+@click.option("-e", "--endpoint", type=click.Choice(["send", "show", "list"]),
+              default="send")
+def main(total, concurrency, endpoint):
+    base_url = "http://{}:{}".format(os.environ.get("API_HOST", "127.0.0.1"),
+                                     os.environ.get("API_PORT", "5000"))
+    email_id = None
+    if endpoint == "show":
+        resp = requests.post("{}/emails".format(base_url),
+                             data=email_payload(),
+                             headers={"Content-Type": "application/json"})
+        email_id = resp.json()["id"]
+
+    per_worker = max(1, total // concurrency)
+    workers = [Worker(base_url, endpoint, per_worker, email_id)
+               for _ in range(concurrency)]
+
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    latencies = [l for w in workers for l in w.latencies]
+    errors = sum(w.errors for w in workers)
+    click.echo("endpoint:    {}".format(endpoint))
+    click.echo("requests:    {} ({} errors)".format(len(latencies), errors))
+    click.echo("throughput:  {:.1f} req/s".format(len(latencies) / elapsed))
+    for pct in (50, 90, 99):
+        click.echo("p{:<10} {:.1f} ms".format(
+            "{}:".format(pct), percentile(latencies, pct) * 1000))
+
+
+if __name__ == "__main__":
+    main()
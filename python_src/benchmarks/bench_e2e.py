@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# Pushes emails through the whole pipeline, API -> Mongo -> worker -> SMTP,
+# and reports end to end throughput and latency. The SMTP side is an
+# in-process babymailgun.smtp_sink registered through /servers for the
+# duration of the run, so no MailHog or docker is needed. With a local mongod
+# running, the API and worker can be started by the harness too:
+#
+#   python benchmarks/bench_e2e.py -n 2000 -c 16 \
+#       --api-cmd "flask run -p 5000" \
+#       --worker-cmd "go run ../golang_src/cmd/worker.go"
+#
+# Both commands inherit DB_HOST/DB_PORT/DB_NAME (defaulting to a local
+# mongod) and FLASK_APP. Set WORKER_SLEEP low, the worker sleeps that long
+# whenever it finds nothing to send.
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+import click
+import requests
+
+from babymailgun import client
+from babymailgun import smtp_sink
+# Run as a script, so the other benchmarks are importable alongside it
+from bench_api import percentile
+
+SUBJECT_PREFIX = "e2e "
+
+
+def subject_of(data):
+    for line in data.split("\r\n"):
+        if not line:
+            break
+        if line.lower().startswith("subject:"):
+            return line.split(":", 1)[1].strip()
+    return ""
+
+
+class Tracker(object):
+    # Matches what the sink receives to when each email was accepted by the
+    # API. Subjects carry the sequence number, the worker doesn't rewrite them
+    def __init__(self, total):
+        self._lock = threading.Condition()
+        self.total = total
+        self.submitted = {}
+        self.received = {}
+        self.duplicates = 0
+
+    def submit(self, seq, at):
+        with self._lock:
+            self.submitted[seq] = at
+
+    def on_message(self, message):
+        subject = subject_of(message.data)
+        if not subject.startswith(SUBJECT_PREFIX):
+            return
+        seq = int(subject[len(SUBJECT_PREFIX):])
+        with self._lock:
+            if seq in self.received:
+                self.duplicates += 1
+                return
+            self.received[seq] = message.received_at
+            self._lock.notify_all()
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        with self._lock:
+            while len(self.received) < self.total:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def latencies(self):
+        with self._lock:
+            return [self.received[seq] - self.submitted[seq]
+                    for seq in self.received if seq in self.submitted]
+
+
+class Submitter(threading.Thread):
+    def __init__(self, api_client, tracker, sequence, domains):
+        super().__init__()
+        self._client = api_client
+        self._tracker = tracker
+        self._sequence = sequence
+        self._domains = domains
+        self.errors = 0
+
+    def run(self):
+        for seq in self._sequence:
+            address = "rcpt{}@bench{}.com".format(seq, seq % self._domains)
+            try:
+                self._client.create_email(
+                    "{}{}".format(SUBJECT_PREFIX, seq), "from@bench.com",
+                    [address], [], [], "buffalo " * 64)
+                self._tracker.submit(seq, time.time())
+            except client.ClientError:
+                self.errors += 1
+
+
+def start_process(command, env):
+    if not command:
+        return None
+    return subprocess.Popen(shlex.split(command), env=env)
+
+
+def stop_process(process):
+    if process is None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def wait_for_api(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get("{}/ready".format(base_url)).status_code == 204:
+                return True
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+@click.command()
+@click.option("-n", "--emails", "total", type=int, default=1000)
+@click.option("-c", "--concurrency", type=int, default=8,
+              help="Threads submitting emails to the API")
+@click.option("--domains", type=int, default=10,
+              help="Distinct recipient domains to spread emails over")
+@click.option("--sink-port", type=int, default=2525)
+@click.option("--latency", type=float, default=0.0,
+              help="Seconds the sink waits before accepting each message")
+@click.option("--reject-rate", type=float, default=0.0)
+@click.option("--auth-failure-rate", type=float, default=0.0)
+@click.option("--disconnect-rate", type=float, default=0.0)
+@click.option("--timeout", type=int, default=300,
+              help="Seconds to wait for every email to reach the sink")
+@click.option("--exclusive/--shared", default=True,
+              help="Disable the other registered servers during the run")
+@click.option("--api-cmd", help="Command that starts the API")
+@click.option("--worker-cmd", help="Command that starts the worker")
+def main(total, concurrency, domains, sink_port, latency, reject_rate,
+         auth_failure_rate, disconnect_rate, timeout, exclusive, api_cmd,
+         worker_cmd):
+    host = os.environ.get("API_HOST", "127.0.0.1")
+    port = os.environ.get("API_PORT", "5000")
+    base_url = "http://{}:{}".format(host, port)
+    env = dict(os.environ)
+    env.setdefault("DB_HOST", "127.0.0.1")
+    env.setdefault("DB_PORT", "27017")
+    env.setdefault("DB_NAME", "babymailgun")
+    env.setdefault("FLASK_APP", "babymailgun/wsgi.py")
+    env.setdefault("WORKER_SLEEP", "1")
+
+    tracker = Tracker(total)
+    sink = smtp_sink.SMTPSink("127.0.0.1", sink_port, latency=latency,
+                              reject_rate=reject_rate,
+                              auth_failure_rate=auth_failure_rate,
+                              disconnect_rate=disconnect_rate,
+                              keep_messages=0,
+                              on_message=tracker.on_message)
+    api_client = client.MailgunAPIClient(host, port)
+    processes = []
+    disabled = []
+    server = None
+
+    try:
+        processes.append(start_process(api_cmd, env))
+        if not wait_for_api(base_url, 60):
+            raise click.ClickException("The API at {} never became "
+                                       "ready".format(base_url))
+
+        sink.start()
+        if exclusive:
+            for registered in api_client.get_servers():
+                if registered["enabled"]:
+                    api_client.update_server(registered["id"], enabled=False)
+                    disabled.append(registered["id"])
+        server = api_client.create_server("127.0.0.1", sink_port,
+                                          username="bench",
+                                          password="bench",
+                                          max_concurrency=concurrency * 4)
+        processes.append(start_process(worker_cmd, env))
+
+        submitters = [Submitter(api_client, tracker,
+                                range(i, total, concurrency), domains)
+                      for i in range(concurrency)]
+        start = time.time()
+        for submitter in submitters:
+            submitter.start()
+        for submitter in submitters:
+            submitter.join()
+        submitted_in = time.time() - start
+
+        completed = tracker.wait(timeout)
+        elapsed = time.time() - start
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+        if server is not None:
+            api_client.delete_server(server["id"])
+        for server_id in disabled:
+            api_client.update_server(server_id, enabled=True)
+        sink.stop()
+
+    latencies = tracker.latencies()
+    errors = sum(s.errors for s in submitters)
+    stats = sink.stats
+    click.echo("submitted:   {} in {:.1f}s ({:.1f} emails/s, {} "
+               "errors)".format(len(tracker.submitted), submitted_in,
+                                len(tracker.submitted) / submitted_in,
+                                errors))
+    click.echo("delivered:   {} of {}{}".format(
+        len(tracker.received), total,
+        "" if completed else " (timed out)"))
+    click.echo("end to end:  {:.1f} emails/s".format(
+        len(tracker.received) / elapsed))
+    for pct in (50, 90, 99):
+        click.echo("p{:<10} {:.1f} ms".format(
+            "{}:".format(pct), percentile(latencies, pct) * 1000))
+    click.echo("sink:        sessions={} rejected={} auth_failures={} "
+               "disconnects={} duplicates={}".format(
+                   stats["sessions"], stats["rejected"],
+                   stats["auth_failures"], stats["disconnects"],
+                   tracker.duplicates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Compares insert throughput and _id index size of uuid4 and uuid7 email ids
+# against a real mongod. Point it at a scratch database, it drops the
+# collections it creates when it's done.
+#
+#   DB_HOST=127.0.0.1 DB_PORT=27017 python benchmarks/bench_ids.py -n 200000
+import os
+import time
+
+import click
+import pymongo
+
+from babymailgun import app, ids
+
+
+def email_dict():
+    return {"subject": "Benchmark",
+            "body": "buffalo " * 64,
+            "to": ["to@bench.com"],
+            "cc": [],
+            "bcc": [],
+            "from": "from@bench.com"}
+
+
+def run_scheme(db, scheme, count, batch_size):
+    collection = db["bench_ids_{}".format(scheme)]
+    collection.drop()
+
+    start = time.time()
+    batch = []
+    for _ in range(count):
+        batch.append(app.to_email_model(ids.new_email_id(scheme),
+                                        email_dict()))
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    elapsed = time.time() - start
+
+    stats = db.command("collStats", collection.name)
+    collection.drop()
+    return count / elapsed, stats["indexSizes"]["_id_"]
+
+
+@click.command()
+@click.option("-n", "--count", type=int, default=100000,
+              help="Emails inserted per scheme")
+@click.option("-b", "--batch-size", type=int, default=1000)
+def main(count, batch_size):
+    client = pymongo.MongoClient(os.environ.get("DB_HOST", "127.0.0.1"),
+                                 int(os.environ.get("DB_PORT", "27017")))
+    db = client[os.environ.get("DB_NAME", "babymailgun_bench")]
+
+    click.echo("{:<8} {:>14} {:>16}".format("scheme", "inserts/sec",
+                                            "_id index bytes"))
+    for scheme in ids.ID_SCHEMES:
+        rate, index_size = run_scheme(db, scheme, count, batch_size)
+        click.echo("{:<8} {:>14.0f} {:>16}".format(scheme, rate, index_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Measures what a POST /emails costs the API when it's turned away, against
+# what the same request cost when the whole body was read and parsed before
+# any limit was checked. Runs in process on the memory storage backend, no
+# database or server needed:
+#
+#   python benchmarks/bench_limits.py -n 5
+#
+# Bodies are generated as they're read, so the peak memory reported is the
+# API's own and not the benchmark's copy of the payload.
+import time
+import tracemalloc
+
+import click
+import flask
+import mock
+from werkzeug import test as werkzeug_test
+
+from babymailgun import app as mailgun_app
+
+
+class GeneratedBody(object):
+    # head + item * count + tail, produced a read() at a time
+    def __init__(self, head, item, count, tail):
+        self._parts = [(head, 1), (item, count), (tail, 1)]
+        self.length = len(head) + len(item) * count + len(tail)
+        self._part = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        out = []
+        while size > 0 and self._part < len(self._parts):
+            data, count = self._parts[self._part]
+            end = len(data) * count
+            if self._offset >= end:
+                self._part += 1
+                self._offset = 0
+                continue
+            start = self._offset % len(data)
+            take = min(size, len(data) - start, end - self._offset)
+            out.append(data[start:start + take])
+            self._offset += take
+            size -= take
+        return b"".join(out)
+
+
+def email_body(to_count=1, body_length=64, trailer=b""):
+    head = (b'{"subject": "Benchmark", "from": "from@bench.com", "cc": [], '
+            b'"bcc": [], "body": "' + b"x" * body_length + b'", "to": [')
+    return head, b'"to@bench.com", ', to_count, b'"to@bench.com"]}' + trailer
+
+
+# name, body, whether Content-Length is sent. Without it the body arrives
+# the way a chunked upload would, and only its size on the wire counts
+SCENARIOS = [
+    ("valid email", lambda: email_body(), True),
+    ("declared too large", lambda: email_body(to_count=3 << 20), True),
+    ("chunked too large", lambda: email_body(to_count=3 << 20), False),
+    ("too many recipients", lambda: email_body(to_count=300000), True),
+    ("body too long", lambda: email_body(body_length=8 << 20), True),
+]
+
+
+def new_path(parts, send_length):
+    # Straight through WSGI, the test client wants a stream it can seek
+    body = GeneratedBody(*parts)
+    environ = werkzeug_test.EnvironBuilder(
+        path="/emails", method="POST",
+        content_type="application/json").get_environ()
+    environ["wsgi.input"] = body
+    environ["wsgi.input_terminated"] = True
+    environ.pop("CONTENT_LENGTH", None)
+    if send_length:
+        environ["CONTENT_LENGTH"] = str(body.length)
+    app_iter, status, _headers = werkzeug_test.run_wsgi_app(mailgun_app.app,
+                                                           environ)
+    for _ in app_iter:
+        pass
+    return int(status.split()[0])
+
+
+def old_path(parts, send_length):
+    # What send_email did before: read and parse everything, and only then
+    # validate
+    with mock.patch.object(mailgun_app, "read_email_json",
+                           lambda: flask.request.get_json(force=True)):
+        return new_path(parts, send_length)
+
+
+def measure(path, parts, send_length, repeat):
+    # Timed and traced separately, tracemalloc slows allocation down a lot
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        status = path(parts, send_length)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    path(parts, send_length)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return status, sum(timings) / len(timings), peak
+
+
+@click.command()
+@click.option("-n", "--repeat", type=int, default=5,
+              help="Requests per scenario, the mean is reported")
+@click.option("--max-content-length", type=int, default=32 << 20)
+def main(repeat, max_content_length):
+    mailgun_app.app.config.update(
+        STORAGE_BACKEND="memory", READY=True, DEDUPLICATE_BODIES=False,
+        EMAIL_ID_SCHEME="uuid4", RETENTION_DAYS=30,
+        ADMISSION_HIGH_WATERMARK=0, ADMISSION_LOW_WATERMARK=None,
+        ADMISSION_REFRESH_INTERVAL=5, MAX_CONTENT_LENGTH=max_content_length)
+
+    click.echo("{:<22}{:>10}{:>8}{:>9}{:>10}{:>8}{:>9}{:>10}".format(
+        "scenario", "bytes", "status", "ms", "peak KB", "old", "old ms",
+        "old KB"))
+    for name, make_parts, send_length in SCENARIOS:
+        parts = make_parts()
+        size = GeneratedBody(*parts).length
+        status, seconds, peak = measure(new_path, parts, send_length, repeat)
+        old_status, old_seconds, old_peak = measure(old_path, parts,
+                                                    send_length, repeat)
+        click.echo("{:<22}{:>10}{:>8}{:>9.2f}{:>10.0f}{:>8}{:>9.2f}"
+                   "{:>10.0f}".format(name, size, status, seconds * 1000,
+                                      peak / 1024.0, old_status,
+                                      old_seconds * 1000,
+                                      old_peak / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import uuid
 
 import pymongo
 
+from babymailgun import servers
+
 
 def get_env(key):
     if key not in os.environ:
@@ -32,13 +34,13 @@ def add_smtp_server_if_not_exist():
     server = db.servers.find_one({})
     if not server:
         server_id = str(uuid.uuid4())
-        data = {
-                "_id": server_id,
+        data = servers.to_server_model(server_id, {
                 "hostname": "127.0.0.1",
                 "port": 1025,
                 "username": "admin@mailgun.com",
                 "password": "password"
-                }
-        db.servers.insert_one(data)
+                })
+        # Further servers can be registered through POST /servers
+        servers.add_server(db, data)
 
 add_smtp_server_if_not_exist()
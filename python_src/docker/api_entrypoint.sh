@@ -1,4 +1,9 @@
 #!/bin/sh
 
 python add_server.py
+
+if [ "$API_MODE" = "production" ]; then
+    exec dockerize -timeout 60s -wait tcp://database:27017 gunicorn -c gunicorn_conf.py babymailgun.wsgi:application
+fi
+
 dockerize -timeout 60s -wait tcp://database:27017 flask run -h 0.0.0.0 -p5000 --reload
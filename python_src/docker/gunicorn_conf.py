@@ -0,0 +1,32 @@
+# Gunicorn settings for serving the API in production. Everything can be
+# tuned through the environment, e.g.
+#
+#   API_WORKERS=8 API_THREADS=4 gunicorn -c gunicorn_conf.py babymailgun.wsgi
+#
+# Send the master SIGHUP to gracefully replace the workers after a deploy.
+import multiprocessing
+import os
+
+bind = "{}:{}".format(os.environ.get("API_BIND_HOST", "0.0.0.0"),
+                      os.environ.get("API_BIND_PORT", "5000"))
+workers = int(os.environ.get("API_WORKERS",
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("API_THREADS", "2"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.environ.get("API_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("API_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("API_KEEPALIVE", "5"))
+# Recycle workers now and then so slow leaks can't grow without bound
+max_requests = int(os.environ.get("API_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.environ.get("API_MAX_REQUESTS_JITTER", "1000"))
+preload_app = os.environ.get("API_PRELOAD", "false").lower() in (
+    "1", "true", "yes")
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(_server, _worker):
+    # With preload_app the master imports the app before forking, so each
+    # worker has to build its own Mongo connection pool
+    from babymailgun import app as mailgun_app
+    mailgun_app.reset_db_client()
@@ -0,0 +1,136 @@
+import random
+
+from babymailgun import addresses
+import tests
+
+
+class TestNormalizeAddress(tests.TestBase):
+    def test_normalize_address(self):
+        assert addresses.normalize_address(" Bob.Smith@Example.COM ") == \
+            "Bob.Smith@example.com"
+
+    def test_normalize_address_no_domain(self):
+        assert addresses.normalize_address("nobody") == "nobody"
+
+    def test_domain_of(self):
+        assert addresses.domain_of("a@Mail.Example.com") == \
+            "mail.example.com"
+
+
+class TestNormalizeRecipients(tests.TestBase):
+    def test_dedupes_across_types(self):
+        email = {"subject": "Subject",
+                 "to": ["a@x.com", "A@X.COM", "b@y.com"],
+                 "cc": ["b@Y.com", "c@x.com"],
+                 "bcc": ["a@x.com", "d@z.com"]}
+
+        normalized = addresses.normalize_recipients(email)
+
+        assert normalized["to"] == ["a@x.com", "b@y.com"]
+        assert normalized["cc"] == ["c@x.com"]
+        assert normalized["bcc"] == ["d@z.com"]
+        assert normalized["subject"] == "Subject"
+        # The submission itself is left alone
+        assert len(email["to"]) == 3
+
+    def test_large_mixed_domain_list(self):
+        rng = random.Random(4)
+        domains = ["domain{}.com".format(i) for i in range(50)]
+        unique = ["user{}@{}".format(i, rng.choice(domains))
+                  for i in range(20000)]
+        # Every address submitted twice more with different casing, spread
+        # over all three recipient types
+        submitted = unique + [a.upper() for a in unique] + \
+            [a.title() for a in unique]
+        rng.shuffle(submitted)
+        email = {"to": submitted[:30000], "cc": submitted[30000:45000],
+                 "bcc": submitted[45000:]}
+
+        normalized = addresses.normalize_recipients(email)
+        kept = normalized["to"] + normalized["cc"] + normalized["bcc"]
+
+        assert len(kept) == len(unique)
+        assert {a.lower() for a in kept} == set(unique)
+        groups = addresses.group_by_domain(kept)
+        assert {g["domain"] for g in groups} <= set(domains)
+        assert sum(len(g["addresses"]) for g in groups) == len(unique)
+        for group in groups:
+            assert all(addresses.domain_of(a) == group["domain"]
+                       for a in group["addresses"])
+
+    def test_template_recipients(self):
+        recipients = [{"address": "a@X.com", "variables": {"n": "1"}},
+                      {"address": "A@x.com", "variables": {"n": "2"}},
+                      {"address": "b@x.com", "variables": {"n": "3"}}]
+
+        unique = addresses.normalize_template_recipients(recipients)
+
+        assert [r["address"] for r in unique] == ["a@x.com", "b@x.com"]
+        assert unique[0]["variables"] == {"n": "1"}
+
+
+class TestGroupByDomain(tests.TestBase):
+    def test_group_by_domain(self):
+        groups = addresses.group_by_domain(
+            ["a@y.com", "b@x.com", "c@y.com", "d@X.com"])
+
+        assert groups == [{"domain": "y.com",
+                           "addresses": ["a@y.com", "c@y.com"]},
+                          {"domain": "x.com",
+                           "addresses": ["b@x.com", "d@X.com"]}]
+
+
+class TestAddressValidator(tests.TestBase):
+    def test_is_valid(self):
+        validator = addresses.AddressValidator()
+        assert validator.is_valid("a.b+c@example.com")
+        assert not validator.is_valid("not an address")
+        assert not validator.is_valid(" a@example.com")
+
+    def test_cached(self):
+        validator = addresses.AddressValidator(cache_size=10)
+        for _ in range(3):
+            validator.is_valid("a@example.com")
+        validator.is_valid("nope")
+
+        stats = validator.stats
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["size"] == 2
+        assert stats["hit_rate"] == 0.5
+
+    def test_evicts_least_recently_used(self):
+        validator = addresses.AddressValidator(cache_size=2)
+        validator.is_valid("a@example.com")
+        validator.is_valid("b@example.com")
+        validator.is_valid("a@example.com")
+        validator.is_valid("c@example.com")
+        assert validator.stats["size"] == 2
+
+        validator.is_valid("a@example.com")
+        assert validator.stats["hits"] == 2
+        validator.is_valid("b@example.com")
+        assert validator.stats["misses"] == 4
+
+    def test_invalid_addresses(self):
+        validator = addresses.AddressValidator(cache_size=10)
+        assert validator.invalid_addresses(
+            ["a@example.com", "bad", "b@example.com", "worse"]) == \
+            ["bad", "worse"]
+        assert validator.invalid_addresses([]) == []
+
+    def test_large_batch_skips_cache(self):
+        validator = addresses.AddressValidator(cache_size=2)
+        validator.is_valid("a@example.com")
+        assert validator.invalid_addresses(
+            ["a@example.com", "b@example.com", "c@example.com"]) == []
+        assert validator.stats["size"] == 1
+        assert validator.stats["hits"] == 0
+
+    def test_disabled(self):
+        validator = addresses.AddressValidator(cache_size=0)
+        assert validator.is_valid("a@example.com")
+        assert validator.invalid_addresses(["bad"]) == ["bad"]
+        assert validator.stats == {"enabled": False, "size": 0,
+                                   "max_size": 0, "hits": 0, "misses": 0,
+                                   "hit_rate": 0.0}
@@ -0,0 +1,104 @@
+import mock
+
+from babymailgun import admission
+import tests
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_db(*depths):
+    db = mock.MagicMock()
+    db.command.side_effect = [{"n": depth} for depth in depths]
+    return db
+
+
+class TestQueueDepth(tests.TestBase):
+    def test_queue_depth(self):
+        db = make_db(42)
+        assert admission.queue_depth(db) == 42
+        db.command.assert_called_once_with(
+            "count", "emails", query={"status": "incomplete"})
+
+
+class TestAdmissionController(tests.TestBase):
+    def test_disabled(self):
+        db = mock.MagicMock()
+        controller = admission.AdmissionController(lambda: db, 0)
+
+        assert controller.check() is None
+        assert not db.command.called
+
+    def test_default_low_watermark(self):
+        controller = admission.AdmissionController(None, 100)
+        assert controller.stats["low_watermark"] == 80
+
+    def test_counts_once_per_interval(self):
+        clock = FakeClock()
+        db = make_db(10, 10)
+        controller = admission.AdmissionController(
+            lambda: db, 100, refresh_interval=5, clock=clock)
+
+        for _ in range(20):
+            assert controller.check() is None
+        assert db.command.call_count == 1
+        assert controller.estimate == 30
+
+        clock.now = 5
+        controller.check()
+        assert db.command.call_count == 2
+        assert controller.estimate == 11
+
+    def test_rejects_over_high_watermark(self):
+        clock = FakeClock()
+        db = make_db(100)
+        controller = admission.AdmissionController(
+            lambda: db, 100, refresh_interval=5, clock=clock)
+
+        assert controller.check() == 429
+        assert controller.retry_after() == 5
+        clock.now = 1.5
+        assert controller.retry_after() == 4
+        assert controller.stats["rejected"] == 1
+
+    def test_admitted_emails_close_admission(self):
+        db = make_db(98)
+        controller = admission.AdmissionController(lambda: db, 100,
+                                                   clock=FakeClock())
+
+        assert controller.check() is None
+        assert controller.check() is None
+        assert controller.check() == 429
+
+    def test_reopens_at_low_watermark(self):
+        clock = FakeClock()
+        db = make_db(150, 90, 80)
+        controller = admission.AdmissionController(
+            lambda: db, 100, low_watermark=80, refresh_interval=5,
+            clock=clock)
+
+        assert controller.check() == 429
+        # Under the high watermark, but still above the low one
+        clock.now = 5
+        assert controller.check() == 429
+        clock.now = 10
+        assert controller.check() is None
+        assert not controller.stats["shedding"]
+
+    def test_unmeasured_backlog(self):
+        clock = FakeClock()
+        db = mock.MagicMock()
+        db.command.side_effect = Exception("no database")
+        controller = admission.AdmissionController(
+            lambda: db, 100, refresh_interval=5, clock=clock)
+
+        assert controller.check() == 503
+        assert controller.check() == 503
+        # The failed count isn't retried until the interval passes
+        assert db.command.call_count == 1
+        assert controller.stats["errors"] == 1
@@ -1,7 +1,10 @@
 import datetime
+import json
 import os
 import uuid
 
+import mock
+import pymongo
 import pytest
 
 from babymailgun import app as mailgun_app
@@ -18,6 +21,22 @@ class TestGetEnv(tests.TestBase):
         with pytest.raises(mailgun_app.ConfigKeyNotFound):
             mailgun_app.get_env("TEST_FOO")
 
+    def test_get_env_bool(self):
+        os.environ["TEST_FOO"] = "True"
+        assert mailgun_app.get_env_bool("TEST_FOO") is True
+        os.environ["TEST_FOO"] = "0"
+        assert mailgun_app.get_env_bool("TEST_FOO", True) is False
+        os.environ.pop("TEST_FOO", None)
+        assert mailgun_app.get_env_bool("TEST_FOO", True) is True
+
+    def test_get_env_bool_invalid(self):
+        os.environ["TEST_FOO"] = "maybe"
+        try:
+            with pytest.raises(mailgun_app.ConfigTypeError):
+                mailgun_app.get_env_bool("TEST_FOO")
+        finally:
+            os.environ.pop("TEST_FOO", None)
+
 
 class TestEmailModel(tests.TestBase):
     def test_to_email_model(self):
@@ -43,6 +62,8 @@ class TestEmailModel(tests.TestBase):
         assert model["reason"] == ""
         assert model["tries"] == 0
         assert model["worker_id"] is None
+        assert model["priority"] == mailgun_app.PRIORITIES["normal"]
+        assert isinstance(model["send_at"], datetime.datetime)
 
         expected_recipients = {
             "to@unittests.com": "to",
@@ -57,6 +78,138 @@ class TestEmailModel(tests.TestBase):
             assert recipient["status"] == 0
             assert recipient["reason"] == ""
 
+        assert model["domains"] == [
+            {"domain": "unittests.com",
+             "addresses": ["to@unittests.com", "cc@unittests.com",
+                           "bcc@unittests.com"]}]
+
+    def test_to_email_model_mailing_list(self):
+        email_id = str(uuid.uuid4())
+        email_dict = {"subject": "Subject",
+                      "body": "buffalo" * 8,
+                      "to": ["to{}@unittests.com".format(i)
+                             for i in range(500)],
+                      "cc": [],
+                      "bcc": ["bcc@unittests.com"],
+                      "from": "from@tester.me",
+                      "mailing_list": True}
+
+        model = mailgun_app.to_email_model(email_id, email_dict)
+
+        assert model["recipients"] == []
+        assert model["recipient_storage"] == "external"
+        assert model["recipient_count"] == 501
+        assert "domains" not in model
+
+    def test_to_email_model_scheduled(self):
+        email_dict = {"subject": "Subject",
+                      "body": "buffalo",
+                      "to": ["to@unittests.com"],
+                      "cc": [],
+                      "bcc": [],
+                      "from": "from@tester.me",
+                      "priority": "high",
+                      "send_at": "2018-01-01T12:30:00"}
+
+        model = mailgun_app.to_email_model(str(uuid.uuid4()), email_dict)
+
+        assert model["priority"] == mailgun_app.PRIORITIES["high"]
+        assert model["send_at"] == datetime.datetime(2018, 1, 1, 12, 30)
+
+    def test_to_template_model(self):
+        email_id = str(uuid.uuid4())
+        email_dict = {"subject": "Hi {{ name }}",
+                      "body": "Dear {{ name }}",
+                      "from": "from@tester.me",
+                      "template": True,
+                      "recipients": [{"address": "a@unittests.com",
+                                      "variables": {"name": "A"}}] * 3}
+
+        model = mailgun_app.to_template_model(email_id, email_dict)
+
+        assert model["_id"] == email_id
+        assert model["subject"] == email_dict["subject"]
+        assert model["body"] == email_dict["body"]
+        assert model["template"] is True
+        assert model["recipients"] == []
+        assert model["recipient_storage"] == "external"
+        assert model["recipient_count"] == 3
+
+
+class TestValidateTemplateEmail(tests.TestBase):
+    @pytest.fixture()
+    def email_dict(self):
+        return {"subject": "Hello {{ name }}",
+                "body": "Your code is {{ code }}",
+                "from": "from@tester.me",
+                "template": True,
+                "recipients": [
+                    {"address": "a@unittests.com",
+                     "variables": {"name": "Alice", "code": 1234}},
+                    {"address": "b@unittests.com",
+                     "variables": {"name": "Bob", "code": "x{}"}}]}
+
+    def test_validate_template_email(self, email_dict):
+        with self.not_raises():
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_no_recipients(self, email_dict):
+        email_dict["recipients"] = []
+        with pytest.raises(mailgun_app.NoRecipients):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_missing_variable(self, email_dict):
+        email_dict["recipients"][1]["variables"].pop("code")
+        with pytest.raises(mailgun_app.MissingTemplateVariable):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_invalid_subject_variable(self,
+                                                              email_dict):
+        email_dict["recipients"][0]["variables"]["name"] = "{}"
+        with pytest.raises(mailgun_app.InvalidTemplateVariable):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_variable_too_long(self, email_dict):
+        email_dict["recipients"][0]["variables"]["code"] = "A" * (
+            mailgun_app.MAX_VARIABLE_LENGTH + 1)
+        with pytest.raises(mailgun_app.InvalidTemplateVariable):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_subject_renders_too_long(self,
+                                                               email_dict):
+        email_dict["subject"] = "{{ name }} {{ name }}"
+        email_dict["recipients"][0]["variables"]["name"] = "A" * (
+            mailgun_app.MAX_SUBJECT_LENGTH // 2 + 1)
+        with pytest.raises(mailgun_app.RenderedTooLong):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_body_renders_too_long(self,
+                                                            email_dict):
+        email_dict["body"] = "{{ code }}" * 20
+        email_dict["recipients"][1]["variables"]["code"] = "x" * (
+            mailgun_app.MAX_BODY_LENGTH // 20 + 1)
+        with pytest.raises(mailgun_app.RenderedTooLong) as e:
+            mailgun_app.validate_template_email(email_dict)
+        assert "b@unittests.com" in str(e.value)
+
+    def test_validate_template_email_renders_at_limit(self, email_dict):
+        email_dict["body"] = "{{ code }}" * 16
+        for recipient in email_dict["recipients"]:
+            recipient["variables"]["code"] = "x" * (
+                mailgun_app.MAX_BODY_LENGTH // 16)
+        with self.not_raises():
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_invalid_recipient(self, email_dict):
+        email_dict["recipients"][0]["address"] = "nope"
+        with pytest.raises(mailgun_app.InvalidEmailAddress):
+            mailgun_app.validate_template_email(email_dict)
+
+    def test_validate_template_email_invalid_subject(self, email_dict):
+        email_dict["subject"] = "Hello {{ name }}!"
+        with pytest.raises(mailgun_app.InvalidSubject):
+            mailgun_app.validate_template_email(email_dict)
+
 
 class TestSetupApp(tests.TestBase):
     @pytest.fixture()
@@ -65,6 +218,13 @@ class TestSetupApp(tests.TestBase):
         os.environ.pop("DB_HOST", None)
         os.environ.pop("DB_PORT", None)
         os.environ.pop("DB_NAME", None)
+        os.environ.pop("RETENTION_DAYS", None)
+        os.environ.pop("EMAIL_ID_SCHEME", None)
+        os.environ.pop("ADMISSION_HIGH_WATERMARK", None)
+        os.environ.pop("ADMISSION_LOW_WATERMARK", None)
+        os.environ.pop("TRACE_EXPORT", None)
+        os.environ.pop("STORAGE_BACKEND", None)
+        os.environ.pop("DEDUPLICATE_BODIES", None)
 
     def test_setup_app_all_variables_provided(self, _envvars):
         os.environ["DB_HOST"] = "database"
@@ -74,6 +234,38 @@ class TestSetupApp(tests.TestBase):
         with self.not_raises():
             mailgun_app.setup_app()
 
+    def test_setup_admission_watermarks(self, _envvars):
+        os.environ["DB_HOST"] = "database"
+        os.environ["DB_PORT"] = "27017"
+        os.environ["DB_NAME"] = "testdb"
+        os.environ["ADMISSION_HIGH_WATERMARK"] = "1000"
+        os.environ["ADMISSION_LOW_WATERMARK"] = "2000"
+
+        with pytest.raises(mailgun_app.InvalidWatermarks):
+            mailgun_app.setup_app()
+
+    def test_setup_unknown_trace_exporter(self, _envvars):
+        os.environ["DB_HOST"] = "database"
+        os.environ["DB_PORT"] = "27017"
+        os.environ["DB_NAME"] = "testdb"
+        os.environ["TRACE_EXPORT"] = "zipkin"
+
+        with pytest.raises(mailgun_app.ConfigValueError):
+            mailgun_app.setup_app()
+
+    def test_setup_memory_storage_needs_no_db(self, _envvars):
+        os.environ["STORAGE_BACKEND"] = "memory"
+
+        with self.not_raises():
+            mailgun_app.setup_app()
+
+    def test_setup_memory_storage_unsupported_option(self, _envvars):
+        os.environ["STORAGE_BACKEND"] = "memory"
+        os.environ["DEDUPLICATE_BODIES"] = "true"
+
+        with pytest.raises(mailgun_app.StorageNotSupported):
+            mailgun_app.setup_app()
+
     def test_setup_missing_db_host(self, _envvars):
         os.environ["DB_PORT"] = "27017"
         os.environ["DB_NAME"] = "testdb"
@@ -103,6 +295,109 @@ class TestSetupApp(tests.TestBase):
         with pytest.raises(mailgun_app.ConfigTypeError):
             mailgun_app.setup_app()
 
+    def test_setup_retention_days_not_an_integer(self, _envvars):
+        os.environ["DB_HOST"] = "database"
+        os.environ["DB_PORT"] = "27017"
+        os.environ["DB_NAME"] = "testdb"
+        os.environ["RETENTION_DAYS"] = "forever"
+
+        with pytest.raises(mailgun_app.ConfigTypeError):
+            mailgun_app.setup_app()
+
+    def test_setup_unknown_id_scheme(self, _envvars):
+        os.environ["DB_HOST"] = "database"
+        os.environ["DB_PORT"] = "27017"
+        os.environ["DB_NAME"] = "testdb"
+        os.environ["EMAIL_ID_SCHEME"] = "objectid"
+
+        with pytest.raises(mailgun_app.ConfigValueError):
+            mailgun_app.setup_app()
+
+
+class TestDBClient(tests.TestBase):
+    @pytest.fixture()
+    def _config(self):
+        mailgun_app.reset_db_client()
+        mailgun_app.app.config.update(DB_HOST="database", DB_PORT=27017,
+                                      DB_NAME="testdb", DB_CONNECT_TIMEOUT=5)
+        yield
+        mailgun_app.reset_db_client()
+
+    def test_get_db_client_reuses_client(self, _config):
+        with mock.patch("pymongo.MongoClient") as mongo_client:
+            mailgun_app.get_db_client()
+            mailgun_app.get_db_client()
+
+        mongo_client.assert_called_once_with("database", 27017,
+                                             connect=False,
+                                             serverSelectionTimeoutMS=5000)
+
+    def test_reset_db_client(self, _config):
+        with mock.patch("pymongo.MongoClient") as mongo_client:
+            mailgun_app.get_db_client()
+            mailgun_app.reset_db_client()
+            mailgun_app.get_db_client()
+
+        assert mongo_client.call_count == 2
+
+
+class TestCreateApp(tests.TestBase):
+    def test_create_app(self):
+        with mock.patch.object(mailgun_app, "setup_app") as setup_app:
+            with mock.patch.object(mailgun_app, "warm_up") as warm_up:
+                assert mailgun_app.create_app() is mailgun_app.app
+        setup_app.assert_called_once_with()
+        warm_up.assert_called_once_with()
+
+    def test_create_app_config_error_skips_warm_up(self):
+        with mock.patch.object(mailgun_app, "setup_app") as setup_app:
+            setup_app.side_effect = mailgun_app.ConfigKeyNotFound(key="x")
+            with mock.patch.object(mailgun_app, "warm_up") as warm_up:
+                with pytest.raises(mailgun_app.ConfigKeyNotFound):
+                    mailgun_app.create_app()
+        assert not warm_up.called
+
+
+class TestWarmUp(tests.TestBase):
+    @pytest.fixture()
+    def _config(self):
+        mailgun_app.app.config.update(DB_HOST="database", DB_PORT=27017,
+                                      DB_CONNECT_RETRIES=3,
+                                      ARCHIVE_TTL_DAYS=None, READY=False)
+        yield
+        mailgun_app.app.config["READY"] = False
+
+    def test_wait_for_db_retries(self, _config):
+        db = mock.MagicMock()
+        db.command.side_effect = [pymongo.errors.AutoReconnect,
+                                  {"ok": 1}]
+        with mock.patch("time.sleep"):
+            mailgun_app.wait_for_db(db)
+        assert db.command.call_count == 2
+
+    def test_wait_for_db_gives_up(self, _config):
+        db = mock.MagicMock()
+        db.command.side_effect = pymongo.errors.AutoReconnect
+        with mock.patch("time.sleep"):
+            with pytest.raises(mailgun_app.DatabaseUnavailable):
+                mailgun_app.wait_for_db(db)
+        assert db.command.call_count == 3
+
+    def test_warm_up_marks_ready(self, _config):
+        db = mock.MagicMock()
+        with mock.patch.object(mailgun_app, "get_db_client",
+                               return_value=db):
+            mailgun_app.warm_up()
+            resp = mailgun_app.app.test_client().get("/ready")
+
+        assert mailgun_app.app.config["READY"]
+        assert db.emails.create_index.called
+        assert resp.status_code == 204
+
+    def test_ready_before_warm_up(self, _config):
+        resp = mailgun_app.app.test_client().get("/ready")
+        assert resp.status_code == 503
+
 
 class TestValidateEmail(tests.TestBase):
     @pytest.fixture()
@@ -132,6 +427,21 @@ class TestValidateEmail(tests.TestBase):
         with pytest.raises(mailgun_app.TooManyRecipients):
             mailgun_app.validate_email(email_dict)
 
+    def test_validate_email_mailing_list_recipients(self, email_dict):
+        email_dict["to"] = ["to@unittests.com"] * 1000
+        email_dict["mailing_list"] = True
+
+        with self.not_raises():
+            mailgun_app.validate_email(email_dict)
+
+    def test_validate_email_too_many_list_recipients(self, email_dict):
+        email_dict["to"] = ["to@unittests.com"] * (
+            mailgun_app.MAX_LIST_RECIPIENTS + 1)
+        email_dict["mailing_list"] = True
+
+        with pytest.raises(mailgun_app.TooManyListRecipients):
+            mailgun_app.validate_email(email_dict)
+
     def test_validate_email_invalid_subject(self, email_dict):
         email_dict["subject"] = "{}"
         with pytest.raises(mailgun_app.InvalidSubject):
@@ -151,3 +461,305 @@ class TestValidateEmail(tests.TestBase):
         email_dict["body"] = "A" * (mailgun_app.MAX_BODY_LENGTH + 1)
         with pytest.raises(mailgun_app.BodyTooLong):
             mailgun_app.validate_email(email_dict)
+
+    def test_validate_email_invalid_priority(self, email_dict):
+        email_dict["priority"] = "urgent"
+        with pytest.raises(mailgun_app.InvalidPriority):
+            mailgun_app.validate_email(email_dict)
+
+    def test_validate_email_invalid_send_at(self, email_dict):
+        email_dict["send_at"] = "tomorrow"
+        with pytest.raises(mailgun_app.InvalidSendAt):
+            mailgun_app.validate_email(email_dict)
+
+
+class TestSchedule(tests.TestBase):
+    def test_to_schedule_defaults(self):
+        priority, send_at = mailgun_app.to_schedule({})
+        assert priority == mailgun_app.PRIORITIES["normal"]
+        assert isinstance(send_at, datetime.datetime)
+
+    def test_to_schedule_defaults_to_utc(self):
+        before = datetime.datetime.utcnow()
+        _, send_at = mailgun_app.to_schedule({})
+        assert before <= send_at <= datetime.datetime.utcnow()
+
+    def test_to_schedule_date_only(self):
+        priority, send_at = mailgun_app.to_schedule(
+            {"priority": "low", "send_at": "2018-01-02"})
+        assert priority == mailgun_app.PRIORITIES["low"]
+        assert send_at == datetime.datetime(2018, 1, 2)
+
+    def test_priority_name(self):
+        assert mailgun_app.priority_name(2) == "high"
+        assert mailgun_app.priority_name(None) == "normal"
+
+    def test_backfill_schedule(self):
+        db = mock.MagicMock()
+        mailgun_app.backfill_schedule(db)
+
+        queries = [c[0][0] for c in db.emails.update_many.call_args_list]
+        assert {"status": "incomplete",
+                "priority": {"$exists": False}} in queries
+        assert {"status": "incomplete",
+                "send_at": {"$exists": False}} in queries
+
+    def test_backfill_schedule_nothing_to_fill(self):
+        db = mock.MagicMock()
+        db.emails.find_one.return_value = None
+        mailgun_app.backfill_schedule(db)
+
+        assert db.emails.find_one.call_count == 2
+        assert not db.emails.update_many.called
+
+
+class TestValidateServer(tests.TestBase):
+    def test_validate_server(self):
+        with self.not_raises():
+            mailgun_app.validate_server({"hostname": "smtp.unittests.com",
+                                         "port": 25, "weight": 3,
+                                         "max_concurrency": 4,
+                                         "enabled": True})
+
+    def test_validate_server_partial(self):
+        with self.not_raises():
+            mailgun_app.validate_server({"weight": 0}, partial=True)
+
+    def test_validate_server_missing_port(self):
+        with pytest.raises(mailgun_app.MissingServerField):
+            mailgun_app.validate_server({"hostname": "smtp.unittests.com"})
+
+    def test_validate_server_unknown_field(self):
+        with pytest.raises(mailgun_app.UnknownServerField):
+            mailgun_app.validate_server({"hostname": "a", "port": 25,
+                                         "_id": "x"})
+
+    @pytest.mark.parametrize("field,value", [
+        ("port", 0), ("port", "25"), ("weight", -1), ("weight", 1001),
+        ("weight", True), ("max_concurrency", 0), ("enabled", "yes"),
+        ("hostname", "")])
+    def test_validate_server_invalid(self, field, value):
+        server = {"hostname": "smtp.unittests.com", "port": 25}
+        server[field] = value
+        with pytest.raises(mailgun_app.InvalidServerField):
+            mailgun_app.validate_server(server)
+
+
+class TestDeleteFilter(tests.TestBase):
+    def test_to_delete_filter(self):
+        query = mailgun_app.to_delete_filter({"status": "incomplete",
+                                              "sender": "bad@campaign.com",
+                                              "before": "2018-01-02"})
+
+        assert query["status"] == "incomplete"
+        assert query["sender"] == "bad@campaign.com"
+        assert query["created_at"] == {"$lt": datetime.datetime(2018, 1, 2)}
+        assert query["worker_id"] is None
+
+    def test_to_delete_filter_before_with_time(self):
+        query = mailgun_app.to_delete_filter({"before": "2018-01-02T03:04:05"})
+        assert query["created_at"] == {
+            "$lt": datetime.datetime(2018, 1, 2, 3, 4, 5)}
+
+    def test_to_delete_filter_no_filters(self):
+        with pytest.raises(mailgun_app.MissingFilter):
+            mailgun_app.to_delete_filter({})
+
+    def test_to_delete_filter_invalid_status(self):
+        with pytest.raises(mailgun_app.InvalidFilter):
+            mailgun_app.to_delete_filter({"status": "sent"})
+
+    def test_to_delete_filter_invalid_before(self):
+        with pytest.raises(mailgun_app.InvalidFilter):
+            mailgun_app.to_delete_filter({"before": "yesterday"})
+
+    def test_count_matching(self):
+        collection = mock.MagicMock()
+        collection.name = "emails"
+        collection.database.command.return_value = {"n": 3}
+
+        query = {"status": "incomplete", "worker_id": None}
+        assert mailgun_app.count_matching(collection, query) == 3
+        collection.database.command.assert_called_once_with(
+            "count", "emails", query=query)
+        assert not collection.find.called
+
+
+class TestDeleteMatching(tests.TestBase):
+    def _db(self, batches, deleted_counts):
+        db = mock.MagicMock()
+        db.emails.find.return_value.limit.side_effect = batches
+        db.emails.delete_many.side_effect = [
+            mock.MagicMock(deleted_count=count) for count in deleted_counts]
+        collections = {"recipients": mock.MagicMock(),
+                       "bodies": mock.MagicMock()}
+        db.__getitem__.side_effect = collections.__getitem__
+        return db, collections
+
+    def test_delete_matching(self):
+        db, _collections = self._db(
+            [[{"_id": "a"}, {"_id": "b"}], [{"_id": "c"}], []], [2, 1])
+        query = {"status": "incomplete", "worker_id": None}
+
+        assert mailgun_app.delete_matching(db, query, batch_size=2) == 3
+
+        deletes = [c[0][0] for c in db.emails.delete_many.call_args_list]
+        assert [d["_id"] for d in deletes] == [{"$in": ["a", "b"]},
+                                               {"$in": ["c"]}]
+        assert all(d["worker_id"] is None for d in deletes)
+        assert query == {"status": "incomplete", "worker_id": None}
+
+    def test_delete_matching_releases(self):
+        db, collections = self._db(
+            [[{"_id": "a", "body_hash": "h1", "recipient_storage": "external"},
+              {"_id": "b", "body_hash": "h1"},
+              {"_id": "c"}], []], [3])
+
+        assert mailgun_app.delete_matching(db, {"status": "failed"}) == 3
+
+        collections["recipients"].delete_many.assert_called_once_with(
+            {"email_id": {"$in": ["a"]}})
+        collections["bodies"].update_one.assert_called_once_with(
+            {"_id": "h1"}, {"$inc": {"refcount": -2}})
+
+    def test_delete_matching_email_claimed_mid_delete(self):
+        db, collections = self._db(
+            [[{"_id": "a", "body_hash": "h1"},
+              {"_id": "b", "body_hash": "h2",
+               "recipient_storage": "external"}], []], [1])
+        # "b" was claimed by a worker between the find and the delete
+        db.emails.find.return_value.__iter__.return_value = iter(
+            [{"_id": "b"}])
+
+        assert mailgun_app.delete_matching(db, {"status": "failed"}) == 1
+
+        assert not collections["recipients"].delete_many.called
+        collections["bodies"].update_one.assert_called_once_with(
+            {"_id": "h1"}, {"$inc": {"refcount": -1}})
+
+    def test_delete_matching_stops_when_nothing_deleted(self):
+        db, _collections = self._db([[{"_id": "a"}]], [0])
+
+        assert mailgun_app.delete_matching(db, {"status": "failed"}) == 0
+        assert db.emails.delete_many.call_count == 1
+
+
+class TestMemoryStorage(tests.TestBase):
+    @pytest.fixture()
+    def _memory(self):
+        mailgun_app.app.config.update(STORAGE_BACKEND="memory", READY=True,
+                                      DEDUPLICATE_BODIES=False,
+                                      EMAIL_ID_SCHEME="uuid4",
+                                      RETENTION_DAYS=30,
+                                      ADMISSION_HIGH_WATERMARK=0,
+                                      ADMISSION_LOW_WATERMARK=None,
+                                      ADMISSION_REFRESH_INTERVAL=5)
+        mailgun_app.resources.admission = None
+        yield
+        mailgun_app.app.config.pop("STORAGE_BACKEND")
+        mailgun_app.app.config["READY"] = False
+        mailgun_app.resources.memory_storage = None
+        mailgun_app.resources.admission = None
+
+    def _send(self, test_client, **extra):
+        payload = {"subject": "Subject", "from": "from@unittests.com",
+                   "to": ["to@unittests.com"], "cc": [], "bcc": [],
+                   "body": "Body"}
+        payload.update(extra)
+        return test_client.post("/emails", data=json.dumps(payload),
+                                content_type="application/json")
+
+    def test_send_show_list(self, _memory):
+        test_client = mailgun_app.app.test_client()
+        sent = [json.loads(self._send(test_client).data)["id"]
+                for _ in range(3)]
+
+        resp = test_client.get("/emails/{}".format(sent[0]))
+        assert json.loads(resp.data)["body"] == "Body"
+
+        resp = test_client.get("/emails?limit=2")
+        assert len(json.loads(resp.data)) == 2
+        resp = test_client.get("/emails?limit=2&after={}".format(
+            resp.headers["X-Next-Cursor"]))
+        assert len(json.loads(resp.data)) == 1
+        assert "X-Next-Cursor" not in resp.headers
+
+        stats = json.loads(test_client.get("/storage").data)
+        assert stats["emails"] == 3
+
+    def test_delete(self, _memory):
+        test_client = mailgun_app.app.test_client()
+        email_id = json.loads(self._send(test_client).data)["id"]
+
+        assert test_client.delete(
+            "/emails/{}".format(email_id)).status_code == 204
+        assert test_client.get(
+            "/emails/{}".format(email_id)).status_code == 404
+
+    def test_list_bad_limit(self, _memory):
+        resp = mailgun_app.app.test_client().get("/emails?limit=0")
+        assert resp.status_code == 400
+
+    def test_mongo_only_route(self, _memory):
+        resp = mailgun_app.app.test_client().get("/servers")
+        assert resp.status_code == 501
+
+    def test_mailing_list(self, _memory):
+        resp = self._send(mailgun_app.app.test_client(), mailing_list=True)
+        assert resp.status_code == 501
+
+
+class TestUndeliverable(tests.TestBase):
+    def _post(self, payload):
+        with mock.patch.object(mailgun_app, "get_db_client") as get_db:
+            resp = mailgun_app.app.test_client().post(
+                "/emails", data=json.dumps(payload),
+                content_type="application/json")
+        assert not get_db.called
+        return resp
+
+    def test_mailing_list_refused(self):
+        resp = self._post({"subject": "Subject", "from": "from@unittests.com",
+                           "to": ["to@unittests.com"], "cc": [], "bcc": [],
+                           "body": "Body", "mailing_list": True})
+        assert resp.status_code == 501
+        assert b"Mailing lists" in resp.data
+
+    def test_template_refused(self):
+        resp = self._post({"subject": "Hi {{ name }}",
+                           "from": "from@unittests.com",
+                           "body": "Body", "template": True,
+                           "recipients": [{"address": "a@unittests.com",
+                                           "variables": {"name": "A"}}]})
+        assert resp.status_code == 501
+        assert b"Template emails" in resp.data
+
+
+class TestSendEmailLimits(tests.TestBase):
+    @pytest.fixture()
+    def _config(self):
+        mailgun_app.app.config["MAX_CONTENT_LENGTH"] = 1024
+        yield
+        mailgun_app.app.config.pop("MAX_CONTENT_LENGTH")
+
+    def _post(self, data):
+        return mailgun_app.app.test_client().post(
+            "/emails", data=data, content_type="application/json")
+
+    def test_declared_length_too_large(self, _config):
+        with mock.patch.object(mailgun_app.limits, "read_json") as read:
+            resp = self._post(b"x" * 1025)
+        assert resp.status_code == 413
+        assert resp.headers["Connection"] == "close"
+        assert not read.called
+
+    def test_too_many_recipients(self, _config):
+        mailgun_app.app.config["MAX_CONTENT_LENGTH"] = 32 << 20
+        resp = self._post(json.dumps({"to": ["a@b.com"] * 250001}))
+        assert resp.status_code == 413
+
+    def test_invalid_json(self, _config):
+        assert self._post(b'{"to": ').status_code == 400
+
+    def test_not_an_object(self, _config):
+        assert self._post(b"[]").status_code == 400
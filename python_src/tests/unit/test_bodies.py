@@ -0,0 +1,122 @@
+import hashlib
+
+import mock
+
+from babymailgun import bodies
+import tests
+
+
+class TestBodyHash(tests.TestBase):
+    def test_body_hash(self):
+        expected = hashlib.sha256("buffalo".encode("utf-8")).hexdigest()
+        assert bodies.body_hash("buffalo") == expected
+
+    def test_body_hash_unicode(self):
+        assert bodies.body_hash("büffalo") != bodies.body_hash("buffalo")
+
+
+class TestStoreBody(tests.TestBase):
+    def test_store_body(self):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+        collection.update_one.return_value.upserted_id = "abc"
+
+        digest, created = bodies.store_body(db, "buffalo")
+
+        assert digest == bodies.body_hash("buffalo")
+        assert created
+        query, update = collection.update_one.call_args[0]
+        assert query == {"_id": digest}
+        assert update["$inc"] == {"refcount": 1}
+        assert update["$setOnInsert"]["body"] == "buffalo"
+        assert update["$setOnInsert"]["size"] == 7
+        assert collection.update_one.call_args[1] == {"upsert": True}
+
+    def test_store_body_existing(self):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+        collection.update_one.return_value.upserted_id = None
+
+        _digest, created = bodies.store_body(db, "buffalo")
+        assert not created
+
+
+class TestReleaseBodies(tests.TestBase):
+    def test_release_bodies_counts_duplicates(self):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+
+        bodies.release_bodies(db, ["a", "a", "b", None])
+
+        decrements = {c[0][0]["_id"]: c[0][1]["$inc"]["refcount"]
+                      for c in collection.update_one.call_args_list}
+        assert decrements == {"a": -2, "b": -1}
+        delete_query = collection.delete_many.call_args[0][0]
+        assert sorted(delete_query["_id"]["$in"]) == ["a", "b"]
+        assert delete_query["refcount"] == {"$lte": 0}
+
+    def test_release_bodies_nothing_to_release(self):
+        db = mock.MagicMock()
+        assert bodies.release_bodies(db, [None, None]) == 0
+        assert not db.__getitem__.called
+
+
+class TestResolveBody(tests.TestBase):
+    def test_resolve_inline_body(self):
+        db = mock.MagicMock()
+        assert bodies.resolve_body(db, {"body": "inline"}) == "inline"
+        assert not db.__getitem__.called
+
+    def test_resolve_shared_body(self):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+        collection.find_one.return_value = {"body": "shared"}
+
+        assert bodies.resolve_body(db, {"body_hash": "abc"}) == "shared"
+        assert collection.find_one.call_args[0][0] == {"_id": "abc"}
+
+
+class TestDeduplicateModel(tests.TestBase):
+    def test_deduplicate_model(self):
+        db = mock.MagicMock()
+        email = {"_id": "1", "body": "buffalo", "subject": "Subject"}
+
+        stored = bodies.deduplicate_model(db, email)
+
+        assert "body" not in stored
+        assert stored["body_hash"] == bodies.body_hash("buffalo")
+        assert stored["subject"] == "Subject"
+        assert email["body"] == "buffalo"
+
+
+class TestMigrateBodies(tests.TestBase):
+    def test_migrate_bodies(self):
+        db = mock.MagicMock()
+        body_collection = db.__getitem__.return_value
+        body_collection.update_one.side_effect = [
+            mock.MagicMock(upserted_id="x"), mock.MagicMock(upserted_id=None)]
+        db.emails.find.return_value.limit.side_effect = [
+            [{"_id": "1", "body": "same"}, {"_id": "2", "body": "same"}],
+            []]
+        db.emails.update_one.return_value.modified_count = 1
+
+        report = bodies.migrate_bodies(db)
+
+        assert report == {"migrated": 2, "bytes_before": 8,
+                          "bytes_stored": 4, "bytes_saved": 4}
+        update = db.emails.update_one.call_args_list[0][0][1]
+        assert update["$unset"] == {"body": ""}
+
+    def test_migrate_bodies_dry_run(self):
+        db = mock.MagicMock()
+        body_collection = db.__getitem__.return_value
+        body_collection.find_one.return_value = None
+        db.emails.find.return_value.batch_size.return_value = [
+            {"_id": "1", "body": "same"}, {"_id": "2", "body": "same"},
+            {"_id": "3", "body": "other"}]
+
+        report = bodies.migrate_bodies(db, dry_run=True)
+
+        assert report == {"migrated": 3, "bytes_before": 13,
+                          "bytes_stored": 9, "bytes_saved": 4}
+        assert not db.emails.update_one.called
@@ -1,3 +1,4 @@
+import json
 import uuid
 
 import mock
@@ -155,6 +156,50 @@ class TestGetEmailRecipients(tests.TestBase):
             with pytest.raises(client.GetFailure):
                 api_client.get_email_recipients(email_id)
 
+    def test_iter_email_recipients_follows_cursor(self, email_id, api_client):
+        first = mock.MagicMock(status_code=200,
+                               headers={"X-Next-Cursor": "abc:1"})
+        first.json.return_value = [{"address": "a@unittests.com"}]
+        second = mock.MagicMock(status_code=200, headers={})
+        second.json.return_value = [{"address": "b@unittests.com"}]
+
+        with mock.patch("requests.get") as mock_get:
+            mock_get.side_effect = [first, second]
+            recipients = list(api_client.iter_email_recipients(email_id))
+
+        assert [r["address"] for r in recipients] == ["a@unittests.com",
+                                                      "b@unittests.com"]
+        assert mock_get.call_args_list[1][1]["params"] == {"after": "abc:1"}
+
+
+class TestUpdateEmailRecipient(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def _mock(self, status_code):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = status_code
+        def mock_patch(*_args, **_kwargs):
+            return mock_response
+
+        return mock_patch
+
+    def test_update_email_recipient(self, api_client):
+        with self.not_raises():
+            with mock.patch("requests.patch", self._mock(204)):
+                api_client.update_email_recipient("abc", "a@b.com", 550)
+
+    def test_update_email_recipient_not_found(self, api_client):
+        with mock.patch("requests.patch", self._mock(404)):
+            with pytest.raises(client.NotFound):
+                api_client.update_email_recipient("abc", "a@b.com", 550)
+
+    def test_update_email_recipient_other_failure(self, api_client):
+        with mock.patch("requests.patch", self._mock(400)):
+            with pytest.raises(client.UpdateFailure):
+                api_client.update_email_recipient("abc", "a@b.com", 550)
+
 
 class TestCreateEmail(tests.TestBase):
     @pytest.fixture()
@@ -213,6 +258,87 @@ class TestCreateEmail(tests.TestBase):
             with pytest.raises(client.CreateFailure):
                 api_client.create_email(**self.create_signature())
 
+    def test_create_email_scheduled(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            api_client.create_email(priority="high",
+                                    send_at="2018-01-01T12:00:00",
+                                    **self.create_signature())
+
+        data = json.loads(mock_post.call_args[1]["data"])
+        assert data["priority"] == "high"
+        assert data["send_at"] == "2018-01-01T12:00:00"
+
+
+class TestGetSchedule(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def test_get_schedule(self, api_client):
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.return_value = []
+            assert api_client.get_schedule(limit=5) == []
+
+        assert mock_get.call_args[1]["params"] == {"limit": 5}
+
+    def test_get_schedule_failure(self, api_client):
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 500
+            with pytest.raises(client.GetFailure):
+                api_client.get_schedule()
+
+
+class TestCreateTemplateEmail(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def test_create_template_email(self, api_client):
+        recipients = [{"address": "a@unittests.com",
+                       "variables": {"name": "A"}}]
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            api_client.create_template_email("Hi {{ name }}",
+                                             "sender@unittests.com",
+                                             recipients, "Body")
+
+        data = json.loads(mock_post.call_args[1]["data"])
+        assert data["template"] is True
+        assert data["recipients"] == recipients
+
+    def test_create_template_email_failure(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 400
+            with pytest.raises(client.CreateFailure):
+                api_client.create_template_email("Hi", "s@unittests.com",
+                                                 [], "Body")
+
+
+class TestPreviewEmail(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def test_preview_email(self, api_client):
+        expected = {"address": "a@unittests.com", "subject": "Hi A",
+                    "body": "Body"}
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 200
+            mock_get.return_value.json.return_value = expected
+            assert api_client.preview_email("abc",
+                                            "a@unittests.com") == expected
+
+        assert mock_get.call_args[1]["params"] == {
+            "address": "a@unittests.com"}
+
+    def test_preview_email_not_found(self, api_client):
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 404
+            with pytest.raises(client.NotFound):
+                api_client.preview_email("abc", "a@unittests.com")
+
 
 class TestDeleteEmail(tests.TestBase):
     @pytest.fixture()
@@ -257,3 +383,257 @@ class TestDeleteEmail(tests.TestBase):
         with mock.patch("requests.delete", mock_get):
             with pytest.raises(client.DeleteFailure):
                 api_client.delete_email(email_id)
+
+
+class TestDeleteEmails(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def _mock(self, expected, status_code):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = status_code
+        def from_json():
+            return expected
+
+        mock_response.json = from_json
+        def mock_delete(*_args, **_kwargs):
+            return mock_response
+
+        return mock_delete
+
+    def test_delete_emails(self, api_client):
+        expected = {"deleted": 50000, "dry_run": False}
+        mock_delete = self._mock(expected, 200)
+
+        with mock.patch("requests.delete", mock_delete):
+            resp = api_client.delete_emails(status="incomplete")
+
+        assert resp == expected
+
+    def test_delete_emails_params(self, api_client):
+        with mock.patch("requests.delete") as mock_delete:
+            mock_delete.return_value.status_code = 200
+            api_client.delete_emails(sender="a@b.com", before="2018-01-01",
+                                     dry_run=True)
+
+        params = mock_delete.call_args[1]["params"]
+        assert params == {"dry_run": "true", "sender": "a@b.com",
+                          "before": "2018-01-01"}
+
+    def test_delete_emails_connection_error(self, api_client):
+        with mock.patch("requests.delete") as mock_delete:
+            mock_delete.side_effect = requests.exceptions.ConnectionError
+            with pytest.raises(client.ConnectionRefused):
+                api_client.delete_emails(status="failed")
+
+    def test_delete_emails_other_failure(self, api_client):
+        mock_delete = self._mock(None, 400)
+
+        with mock.patch("requests.delete", mock_delete):
+            with pytest.raises(client.DeleteFailure):
+                api_client.delete_emails()
+
+
+class TestLeases(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def test_claim_emails(self, api_client):
+        expected = {"lease_id": "abc", "emails": []}
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            mock_post.return_value.json.return_value = expected
+            assert api_client.claim_emails(batch=5,
+                                           lease_seconds=30) == expected
+
+        assert mock_post.call_args[1]["params"] == {"batch": 5,
+                                                    "lease_seconds": 30}
+
+    def test_claim_emails_failure(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 400
+            with pytest.raises(client.LeaseFailure):
+                api_client.claim_emails(batch=1000)
+
+    def test_renew_lease_not_found(self, api_client):
+        with mock.patch("requests.put") as mock_put:
+            mock_put.return_value.status_code = 404
+            with pytest.raises(client.NotFound):
+                api_client.renew_lease("abc")
+
+    def test_release_lease(self, api_client):
+        with mock.patch("requests.delete") as mock_delete:
+            mock_delete.return_value.status_code = 200
+            api_client.release_lease("abc", email_ids=["1", "2"])
+
+        assert mock_delete.call_args[1]["params"] == {"email_id": ["1", "2"]}
+
+    def test_lease_connection_error(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.side_effect = requests.exceptions.ConnectionError
+            with pytest.raises(client.ConnectionRefused):
+                api_client.claim_emails()
+
+
+class TestArchiveEmails(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def _mock(self, expected, status_code):
+        mock_response = mock.MagicMock()
+        mock_response.status_code = status_code
+        def from_json():
+            return expected
+
+        mock_response.json = from_json
+        def mock_archive(*_args, **_kwargs):
+            return mock_response
+
+        return mock_archive
+
+    def test_archive_emails(self, api_client):
+        expected = {"archived": 10, "older_than": 30, "dry_run": False}
+        mock_post = self._mock(expected, 200)
+
+        with mock.patch("requests.post", mock_post):
+            resp = api_client.archive_emails(older_than=30)
+
+        assert resp == expected
+
+    def test_archive_emails_dry_run_params(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            api_client.archive_emails(older_than=7, dry_run=True)
+
+        params = mock_post.call_args[1]["params"]
+        assert params == {"dry_run": "true", "older_than": 7}
+
+    def test_archive_emails_connection_error(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.side_effect = requests.exceptions.ConnectionError
+            with pytest.raises(client.ConnectionRefused):
+                api_client.archive_emails()
+
+    def test_archive_emails_other_failure(self, api_client):
+        mock_post = self._mock(None, 500)
+
+        with mock.patch("requests.post", mock_post):
+            with pytest.raises(client.ArchiveFailure):
+                api_client.archive_emails()
+
+
+class TestRetryAfter(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234", max_retries=2,
+                                       max_retry_wait=10)
+
+    def _response(self, status_code, retry_after=None):
+        resp = mock.MagicMock()
+        resp.status_code = status_code
+        resp.headers = {}
+        if retry_after is not None:
+            resp.headers["Retry-After"] = retry_after
+        return resp
+
+    def test_retries_after_delay(self, api_client):
+        responses = [self._response(429, "3"), self._response(503, "120"),
+                     self._response(200)]
+        with mock.patch("requests.post", side_effect=responses), \
+                mock.patch("time.sleep") as mock_sleep:
+            resp = api_client.post_with_retry("http://1.2.3.4:1234/emails")
+
+        assert resp.status_code == 200
+        assert [c[0][0] for c in mock_sleep.call_args_list] == [3, 10]
+
+    def test_gives_up(self, api_client):
+        with mock.patch("requests.post") as mock_post, \
+                mock.patch("time.sleep"):
+            mock_post.return_value = self._response(429, "1")
+            with pytest.raises(client.CreateFailure):
+                api_client.create_email("Subject", "s@unittests.com",
+                                        ["to@unittests.com"], [], [], "Body")
+
+        assert mock_post.call_count == 3
+
+    def test_unparseable_retry_after(self, api_client):
+        resp = self._response(429, "Wed, 21 Oct 2015 07:28:00 GMT")
+        assert api_client.retry_delay(resp) == 1
+
+
+class TestServers(tests.TestBase):
+    @pytest.fixture()
+    def api_client(self):
+        return client.MailgunAPIClient("1.2.3.4", "1234")
+
+    def test_create_server(self, api_client):
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            api_client.create_server("smtp.unittests.com", 25, weight=3)
+
+        data = json.loads(mock_post.call_args[1]["data"])
+        assert data == {"hostname": "smtp.unittests.com", "port": 25,
+                        "weight": 3}
+
+    def test_update_server_not_found(self, api_client):
+        with mock.patch("requests.patch") as mock_patch:
+            mock_patch.return_value.status_code = 404
+            with pytest.raises(client.NotFound):
+                api_client.update_server("abc", weight=2)
+
+    def test_delete_server(self, api_client):
+        with mock.patch("requests.delete") as mock_delete:
+            mock_delete.return_value.status_code = 204
+            with self.not_raises():
+                api_client.delete_server("abc")
+
+    def test_get_server_table_unchanged(self, api_client):
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 304
+            assert api_client.get_server_table(version=4) is None
+
+        headers = mock_get.call_args[1]["headers"]
+        assert headers["If-None-Match"] == '"4"'
+
+
+class TestAcceptEncoding(tests.TestBase):
+    def test_brotli_not_offered_unless_urllib3_decodes_it(self):
+        with mock.patch("babymailgun.compression.available_encodings",
+                        return_value=["br", "gzip"]), \
+                mock.patch.object(client.urllib3_request, "ACCEPT_ENCODING",
+                                  "gzip,deflate"):
+            assert client.accept_encoding() == "gzip"
+
+    def test_brotli_offered_when_urllib3_decodes_it(self):
+        with mock.patch("babymailgun.compression.available_encodings",
+                        return_value=["br", "gzip"]), \
+                mock.patch.object(client.urllib3_request, "ACCEPT_ENCODING",
+                                  "gzip,deflate,br"):
+            assert client.accept_encoding() == "br, gzip"
+
+
+class TestCorrelationId(tests.TestBase):
+    def test_no_correlation_id(self):
+        api_client = client.MailgunAPIClient("1.2.3.4", "1234")
+        with mock.patch("requests.get") as mock_get:
+            mock_get.return_value.status_code = 200
+            api_client.get_emails()
+
+        headers = mock_get.call_args[1]["headers"]
+        assert client.CORRELATION_ID_HEADER not in headers
+        assert headers["Accept-Encoding"] == client.ACCEPT_ENCODING
+
+    def test_correlation_id_sent(self):
+        api_client = client.MailgunAPIClient("1.2.3.4", "1234",
+                                             correlation_id="batch-42")
+        with mock.patch("requests.post") as mock_post:
+            mock_post.return_value.status_code = 200
+            api_client.create_email("subject", "from@unittests.com",
+                                    ["to@unittests.com"], [], [], "body")
+
+        headers = mock_post.call_args[1]["headers"]
+        assert headers[client.CORRELATION_ID_HEADER] == "batch-42"
+        assert headers["Content-Type"] == "application/json"
@@ -0,0 +1,107 @@
+import gzip
+
+import flask
+import mock
+
+from babymailgun import compression
+import tests
+
+
+def make_app():
+    app = flask.Flask(__name__)
+
+    @app.route("/big")
+    def big():
+        return "x" * 4096
+
+    @app.route("/small")
+    def small():
+        return "x" * 10
+
+    @app.route("/empty")
+    def empty():
+        return ("", 204)
+
+    @app.route("/stream")
+    def stream():
+        def chunks():
+            for i in range(3):
+                yield "chunk {}\n".format(i)
+        return flask.Response(chunks())
+
+    @app.after_request
+    def compress(response):
+        return compression.compress_response(
+            response, flask.request.headers.get("Accept-Encoding"),
+            min_size=1024)
+
+    return app.test_client()
+
+
+class TestNegotiate(tests.TestBase):
+    def test_parse_accept_encoding(self):
+        assert compression.parse_accept_encoding(
+            "gzip;q=0.5, BR , identity;q=nope") == {"gzip": 0.5, "br": 1.0,
+                                                   "identity": 0.0}
+
+    def test_no_header(self):
+        assert compression.negotiate(None) is None
+        assert compression.negotiate("identity") is None
+
+    def test_gzip(self):
+        with mock.patch.object(compression, "brotli", None):
+            assert compression.negotiate("gzip, br") == "gzip"
+            assert compression.negotiate("*") == "gzip"
+
+    def test_refused(self):
+        assert compression.negotiate("gzip;q=0") is None
+        assert compression.negotiate("*;q=0") is None
+
+    def test_prefers_brotli(self):
+        with mock.patch.object(compression, "brotli", mock.MagicMock()):
+            assert compression.negotiate("gzip, br") == "br"
+            assert compression.negotiate("gzip, br;q=0.5") == "gzip"
+
+
+class TestCompressResponse(tests.TestBase):
+    def test_large_response(self):
+        resp = make_app().get("/big", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert int(resp.headers["Content-Length"]) == len(resp.data)
+        assert gzip.decompress(resp.data) == b"x" * 4096
+
+    def test_below_threshold(self):
+        resp = make_app().get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in resp.headers
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert resp.data == b"x" * 10
+
+    def test_not_requested(self):
+        resp = make_app().get("/big")
+        assert "Content-Encoding" not in resp.headers
+        assert len(resp.data) == 4096
+
+    def test_no_content(self):
+        resp = make_app().get("/empty", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in resp.headers
+        assert "Vary" not in resp.headers
+
+    def test_streamed(self):
+        resp = make_app().get("/stream",
+                              headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in resp.headers
+        assert gzip.decompress(resp.data) == \
+            b"chunk 0\nchunk 1\nchunk 2\n"
+
+    def test_stream_flushes_each_chunk(self):
+        chunks = compression.compress_stream([b"first", b"second"], "gzip")
+        stream = gzip.zlib.decompressobj(compression.GZIP_WBITS)
+        assert stream.decompress(next(chunks)) == b"first"
+        assert stream.decompress(next(chunks)) == b"second"
+
+    def test_existing_vary(self):
+        response = flask.Response("x", headers={"Vary": "Cookie"})
+        compression.compress_response(response, None)
+        assert response.headers["Vary"] == "Cookie, Accept-Encoding"
@@ -0,0 +1,27 @@
+import uuid
+
+from babymailgun import ids
+import tests
+
+
+class TestUUID7(tests.TestBase):
+    def test_uuid7_version_and_variant(self):
+        value = ids.uuid7()
+        assert value.version == 7
+        assert value.variant == uuid.RFC_4122
+
+    def test_uuid7_time_ordered(self):
+        earlier = [str(ids.uuid7(timestamp_ms=1000 + i)) for i in range(50)]
+        assert earlier == sorted(earlier)
+
+    def test_uuid7_unique_within_a_millisecond(self):
+        generated = {ids.uuid7(timestamp_ms=1000) for _ in range(100)}
+        assert len(generated) == 100
+
+
+class TestNewEmailId(tests.TestBase):
+    def test_new_email_id_default_is_uuid4(self):
+        assert uuid.UUID(ids.new_email_id()).version == 4
+
+    def test_new_email_id_uuid7(self):
+        assert uuid.UUID(ids.new_email_id("uuid7")).version == 7
@@ -0,0 +1,86 @@
+import datetime
+
+import mock
+
+from babymailgun import leases
+import tests
+
+
+class TestReadyQuery(tests.TestBase):
+    def test_ready_query(self):
+        now = datetime.datetime(2018, 1, 1, 0, 10)
+        query = leases.ready_query(now, 600)
+
+        assert query["worker_id"] is None
+        assert query["status"] == "incomplete"
+        assert query["updated_at"] == {"$lt": datetime.datetime(2018, 1, 1)}
+        assert query["recipient_storage"] == {"$ne": "external"}
+        assert query["send_at"] == {"$lte": now}
+
+
+class TestClaimEmails(tests.TestBase):
+    def test_claim_emails(self):
+        db = mock.MagicMock()
+        db.emails.find.return_value.sort.return_value.limit.return_value = [{"_id": "1"},
+                                                          {"_id": "2"}]
+        claimed = [{"_id": "1", "body": "a"}]
+        db.emails.find.side_effect = [db.emails.find.return_value, claimed]
+        now = datetime.datetime(2018, 1, 1)
+
+        lease = leases.claim_emails(db, 2, 60, 600, now=now)
+
+        assert lease["emails"] == claimed
+        assert lease["expires_at"] == now + datetime.timedelta(seconds=60)
+        claim_query, update = db.emails.update_many.call_args[0]
+        assert claim_query["_id"] == {"$in": ["1", "2"]}
+        assert claim_query["worker_id"] is None
+        assert update["$set"]["lease_id"] == lease["lease_id"]
+        assert update["$set"]["worker_id"] == lease["lease_id"]
+        assert db.emails.find.call_args[0][0] == {
+            "lease_id": lease["lease_id"]}
+        db.emails.find.return_value.sort.assert_called_once_with(
+            leases.READY_SORT)
+
+    def test_claim_emails_with_worker_id(self):
+        db = mock.MagicMock()
+        db.emails.find.return_value.sort.return_value.limit.return_value = [{"_id": "1"}]
+
+        leases.claim_emails(db, 1, 60, 600, worker_id="worker-1")
+
+        update = db.emails.update_many.call_args[0][1]
+        assert update["$set"]["worker_id"] == update["$set"]["lease_id"]
+        assert update["$set"]["leased_by"] == "worker-1"
+
+    def test_claim_emails_nothing_ready(self):
+        db = mock.MagicMock()
+        db.emails.find.return_value.sort.return_value.limit.return_value = []
+
+        lease = leases.claim_emails(db, 10, 60, 600)
+
+        assert lease["emails"] == []
+        assert not db.emails.update_many.called
+
+
+class TestRenewAndRelease(tests.TestBase):
+    def test_renew_lease(self):
+        db = mock.MagicMock()
+        db.emails.update_many.return_value.matched_count = 3
+        now = datetime.datetime(2018, 1, 1)
+
+        renewed, expires_at = leases.renew_lease(db, "abc", 30, now=now)
+
+        assert renewed == 3
+        assert expires_at == now + datetime.timedelta(seconds=30)
+        assert db.emails.update_many.call_args[0][0] == {"lease_id": "abc",
+                                                         "worker_id": "abc"}
+
+    def test_release_lease_some_emails(self):
+        db = mock.MagicMock()
+        db.emails.update_many.return_value.modified_count = 1
+
+        assert leases.release_lease(db, "abc", email_ids=["1"]) == 1
+        query, update = db.emails.update_many.call_args[0]
+        assert query == {"lease_id": "abc", "worker_id": "abc",
+                         "_id": {"$in": ["1"]}}
+        assert update["$set"]["worker_id"] is None
+        assert update["$set"]["lease_id"] is None
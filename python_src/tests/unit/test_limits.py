@@ -0,0 +1,110 @@
+import io
+import json
+
+import pytest
+
+from babymailgun import limits
+import tests
+
+
+def make_scanner(max_recipients=10, max_string=100,
+                 max_depth=limits.MAX_DEPTH):
+    return limits.EmailScanner(max_recipients, max_string, max_depth)
+
+
+def feed(scanner, data, chunk_size=7):
+    # Small chunks, so tokens keep getting split between them
+    data = data.encode("utf-8")
+    for i in range(0, len(data), chunk_size):
+        scanner.feed(data[i:i + chunk_size])
+    scanner.feed(b"", final=True)
+
+
+class TestEmailScanner(tests.TestBase):
+    def test_counts_recipients(self):
+        scanner = make_scanner()
+        feed(scanner, json.dumps({
+            "subject": "to, cc [and] {bcc}", "to": ["a@b.com", "c@d.com"],
+            "cc": ["e@f.com"], "bcc": [], "body": "\"to\": [\"x\"]"}))
+        assert scanner.recipients == 3
+
+    def test_counts_template_recipients(self):
+        scanner = make_scanner()
+        feed(scanner, json.dumps({"recipients": [
+            {"address": "a@b.com", "variables": {"to": ["x", "y"]}},
+            {"address": "c@d.com", "variables": {}}]}))
+        assert scanner.recipients == 2
+
+    def test_escaped_recipients(self):
+        scanner = make_scanner()
+        feed(scanner, r'{"to": ["a\"b@c.com", "d@e.com", "f\\@g.com"]}')
+        assert scanner.recipients == 3
+
+    def test_too_many_recipients(self):
+        scanner = make_scanner(max_recipients=10)
+        with pytest.raises(limits.LimitExceeded):
+            feed(scanner, json.dumps(
+                {"to": ["a@b.com"] * 6, "bcc": ["a@b.com"] * 5}))
+
+    def test_too_many_recipients_stops_early(self):
+        scanner = make_scanner(max_recipients=10)
+        with pytest.raises(limits.LimitExceeded):
+            scanner.feed(b'{"to": [' + b'"a@b.com", ' * 11)
+
+    def test_string_too_long(self):
+        scanner = make_scanner(max_string=100)
+        with pytest.raises(limits.LimitExceeded):
+            feed(scanner, json.dumps({"body": "x" * 99}))
+
+    def test_unterminated_string_too_long(self):
+        scanner = make_scanner(max_string=100)
+        with pytest.raises(limits.LimitExceeded):
+            scanner.feed(b'{"body": "' + b"x" * 100)
+
+    def test_too_deep(self):
+        scanner = make_scanner(max_depth=4)
+        with pytest.raises(limits.LimitExceeded):
+            scanner.feed(b"[[[[[")
+
+    def test_max_string_length(self):
+        assert len(json.dumps("\U0001f600" * 10, ensure_ascii=True)) == \
+            limits.max_string_length(10)
+
+
+class TestReadJson(tests.TestBase):
+    def test_read(self):
+        data = {"to": ["a@b.com"] * 100}
+        stream = io.BytesIO(json.dumps(data).encode("utf-8"))
+        assert limits.read_json(stream, 10000, chunk_size=64) == data
+
+    def test_too_long(self):
+        stream = io.BytesIO(b"[" + b"1," * 1000 + b"1]")
+        with pytest.raises(limits.LimitExceeded):
+            limits.read_json(stream, 1000, chunk_size=64)
+        # Reading stopped at the first chunk past the limit
+        assert stream.tell() < 1100
+
+    def test_single_chunk_not_scanned(self):
+        scanner = make_scanner()
+        stream = io.BytesIO(json.dumps({"to": ["a@b.com"]}).encode("utf-8"))
+        limits.read_json(stream, 1000, scanner, chunk_size=1000)
+        assert scanner.recipients == 0
+
+    def test_scanned_across_chunks(self):
+        scanner = make_scanner(max_recipients=10)
+        stream = io.BytesIO(json.dumps({"to": ["a@b.com"] * 20}).encode(
+            "utf-8"))
+        with pytest.raises(limits.LimitExceeded):
+            limits.read_json(stream, 1000, scanner, chunk_size=16)
+
+    def test_emoji_body_within_limit(self):
+        # Each emoji is escaped as a surrogate pair, twelve bytes apiece
+        scanner = make_scanner(max_string=limits.max_string_length(16384))
+        data = {"body": "\U0001f600" * 9000}
+        stream = io.BytesIO(json.dumps(data).encode("utf-8"))
+        assert limits.read_json(stream, limits.DEFAULT_MAX_CONTENT_LENGTH,
+                                scanner) == data
+
+    def test_invalid_json(self):
+        with pytest.raises(ValueError):
+            limits.read_json(io.BytesIO(b'{"to": '), 1000)
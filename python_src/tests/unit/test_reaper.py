@@ -0,0 +1,110 @@
+import datetime
+import time
+
+import mock
+
+from babymailgun import reaper
+import tests
+
+
+class TestStaleQuery(tests.TestBase):
+    def test_stale_query(self):
+        now = datetime.datetime(2018, 1, 1, 0, 15)
+        query = reaper.stale_query(now, 900)
+
+        assert query["worker_id"] == {"$ne": None}
+        assert query["lease_expires_at"] is None
+        assert query["claimed_at"] == {"$lt": datetime.datetime(2018, 1, 1)}
+
+    def test_expired_lease_query_scoped_to_holder(self):
+        now = datetime.datetime(2018, 1, 1)
+        query = reaper.expired_lease_query("abc", now)
+
+        assert query == {"lease_id": "abc", "worker_id": "abc",
+                         "lease_expires_at": {"$lt": now}}
+
+    def test_stale_queries(self):
+        now = datetime.datetime(2018, 1, 1)
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = ["abc", None, "def"]
+
+        queries = reaper.stale_queries(db, now, 900)
+
+        assert queries[0] == reaper.stale_query(now, 900)
+        assert queries[1:] == [reaper.expired_lease_query("abc", now),
+                               reaper.expired_lease_query("def", now)]
+
+
+class TestReleaseStale(tests.TestBase):
+    def test_release_stale(self):
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = ["abc"]
+        db.emails.update_many.return_value.modified_count = 2
+
+        assert reaper.release_stale(db, 900) == 4
+        assert db.emails.update_many.call_count == 2
+        update = db.emails.update_many.call_args[0][1]
+        assert update["$set"]["worker_id"] is None
+        assert update["$set"]["leased_by"] is None
+        assert update["$set"]["claimed_at"] is None
+
+    def test_release_stale_dry_run(self):
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = ["abc"]
+        db.command.return_value = {"n": 2}
+
+        assert reaper.release_stale(db, 900, dry_run=True) == 4
+        assert db.command.call_args[0] == ("count", "emails")
+        assert not db.emails.find.called
+        assert not db.emails.update_many.called
+
+
+class TestReaper(tests.TestBase):
+    def test_run_once_counts(self):
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = []
+        db.emails.update_many.return_value.modified_count = 3
+        service = reaper.Reaper(lambda: db, lease_seconds=60)
+
+        service.run_once()
+        service.run_once()
+
+        stats = service.stats
+        assert stats["runs"] == 2
+        assert stats["recovered"] == 6
+        assert stats["last_recovered"] == 3
+        assert stats["last_run_at"] is not None
+        assert not stats["running"]
+
+    def test_run_once_dry_run_not_counted(self):
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = []
+        db.command.return_value = {"n": 1}
+        service = reaper.Reaper(lambda: db)
+
+        assert service.run_once(dry_run=True) == 1
+        assert service.stats["runs"] == 0
+
+    def test_start_without_interval_does_nothing(self):
+        service = reaper.Reaper(mock.MagicMock())
+        service.start()
+        assert not service.stats["running"]
+
+    def test_background_thread(self):
+        db = mock.MagicMock()
+        db.emails.distinct.return_value = []
+        db.emails.update_many.return_value.modified_count = 1
+        service = reaper.Reaper(lambda: db, interval=0.01)
+
+        service.start()
+        try:
+            assert service.stats["running"]
+            for _ in range(100):
+                if service.stats["runs"]:
+                    break
+                time.sleep(0.01)
+        finally:
+            service.stop()
+
+        assert service.stats["runs"] >= 1
+        assert not service.stats["running"]
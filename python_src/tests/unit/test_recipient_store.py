@@ -0,0 +1,100 @@
+import mock
+
+from babymailgun import recipient_store
+import tests
+
+
+def email_dict(count):
+    return {"to": ["to{}@unittests.com".format(i) for i in range(count)],
+            "cc": ["cc@unittests.com"],
+            "bcc": []}
+
+
+class TestRecipientDocuments(tests.TestBase):
+    def test_recipient_id_sorts_by_position(self):
+        ids = [recipient_store.recipient_id("abc", i) for i in (2, 10, 100)]
+        assert ids == sorted(ids)
+
+    def test_to_recipient_documents(self):
+        docs = list(recipient_store.to_recipient_documents("abc",
+                                                           email_dict(2)))
+
+        assert [d["address"] for d in docs] == [
+            "to0@unittests.com", "to1@unittests.com", "cc@unittests.com"]
+        assert [d["type"] for d in docs] == ["to", "to", "cc"]
+        for doc in docs:
+            assert doc["email_id"] == "abc"
+            assert doc["domain"] == "unittests.com"
+            assert doc["status"] == 0
+            assert doc["reason"] == ""
+        assert len({d["_id"] for d in docs}) == 3
+
+    def test_to_template_recipient_documents(self):
+        template_recipients = [
+            {"address": "a@unittests.com", "variables": {"name": "A"}},
+            {"address": "b@unittests.com"}]
+        docs = list(recipient_store.to_template_recipient_documents(
+            "abc", template_recipients))
+
+        assert docs[0]["variables"] == {"name": "A"}
+        assert docs[1]["variables"] == {}
+        assert [d["type"] for d in docs] == ["to", "to"]
+        assert docs[0]["_id"] < docs[1]["_id"]
+
+
+class TestInsertRecipients(tests.TestBase):
+    def test_insert_recipients_batches(self):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+
+        documents = recipient_store.to_recipient_documents("abc",
+                                                           email_dict(4))
+        inserted = recipient_store.insert_recipients(db, documents,
+                                                     batch_size=2)
+
+        assert inserted == 5
+        sizes = [len(c[0][0]) for c in collection.insert_many.call_args_list]
+        assert sizes == [2, 2, 1]
+
+
+class TestListRecipients(tests.TestBase):
+    def _db(self, documents):
+        db = mock.MagicMock()
+        collection = db.__getitem__.return_value
+        collection.find.return_value.sort.return_value.limit.return_value = \
+            documents
+        return db, collection
+
+    def test_list_recipients_last_page(self):
+        db, collection = self._db([{"_id": "abc:1"}])
+        page, next_cursor = recipient_store.list_recipients(db, "abc",
+                                                            limit=2)
+
+        assert page == [{"_id": "abc:1"}]
+        assert next_cursor is None
+        collection.find.assert_called_once_with({"email_id": "abc"})
+
+    def test_list_recipients_more_pages(self):
+        db, collection = self._db([{"_id": "abc:1"}, {"_id": "abc:2"},
+                                   {"_id": "abc:3"}])
+        page, next_cursor = recipient_store.list_recipients(
+            db, "abc", status=550, after="abc:0", limit=2)
+
+        assert len(page) == 2
+        assert next_cursor == "abc:2"
+        collection.find.assert_called_once_with(
+            {"email_id": "abc", "status": 550, "_id": {"$gt": "abc:0"}})
+
+    def test_list_recipients_by_domain(self):
+        db, collection = self._db([])
+        recipient_store.list_recipients(db, "abc", domain="unittests.com")
+
+        collection.find.assert_called_once_with(
+            {"email_id": "abc", "domain": "unittests.com"})
+
+
+class TestDeleteRecipients(tests.TestBase):
+    def test_delete_recipients_nothing_to_do(self):
+        db = mock.MagicMock()
+        assert recipient_store.delete_recipients(db, []) == 0
+        assert not db.__getitem__.called
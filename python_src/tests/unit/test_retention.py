@@ -0,0 +1,182 @@
+import collections
+import datetime
+
+import mock
+
+from babymailgun import retention
+import tests
+
+
+def make_db():
+    # Each collection reached through db[name] is a mock of its own
+    db = mock.MagicMock()
+    named = collections.defaultdict(mock.MagicMock)
+    db.__getitem__.side_effect = named.__getitem__
+    return db, named
+
+
+class TestArchiveQuery(tests.TestBase):
+    def test_archive_query(self):
+        cutoff = datetime.datetime(2018, 1, 1)
+        query = retention.archive_query(cutoff)
+
+        assert query["status"] == {"$in": ["complete", "failed"]}
+        assert query["worker_id"] is None
+        assert query["updated_at"] == {"$lt": cutoff}
+
+
+class TestEnsureIndexes(tests.TestBase):
+    def test_ensure_indexes_no_ttl(self):
+        db, named = make_db()
+        retention.ensure_indexes(db)
+
+        assert db.emails.create_index.call_count == 1
+        assert not named[retention.ARCHIVE_COLLECTION].create_index.called
+        named[retention.ARCHIVE_RECIPIENT_COLLECTION].create_index.\
+            assert_called_once_with([("email_id", 1), ("_id", 1)])
+
+    def test_ensure_indexes_with_ttl(self):
+        db, named = make_db()
+        retention.ensure_indexes(db, archive_ttl_days=2)
+
+        named[retention.ARCHIVE_COLLECTION].create_index.\
+            assert_called_once_with("archived_at",
+                                    expireAfterSeconds=2 * 24 * 60 * 60)
+        named[retention.ARCHIVE_RECIPIENT_COLLECTION].create_index.\
+            assert_called_with("archived_at",
+                               expireAfterSeconds=2 * 24 * 60 * 60)
+
+    def test_ensure_indexes_ttl_changed(self):
+        db, named = make_db()
+        archive = named[retention.ARCHIVE_COLLECTION]
+        archive.index_information.return_value = {
+            "_id_": {"key": [("_id", 1)]},
+            "archived_at_1": {"key": [("archived_at", 1)],
+                              "expireAfterSeconds": 24 * 60 * 60}}
+        retention.ensure_indexes(db, archive_ttl_days=2)
+
+        assert not archive.create_index.called
+        db.command.assert_called_once_with(
+            "collMod", retention.ARCHIVE_COLLECTION,
+            index={"keyPattern": {"archived_at": 1},
+                   "expireAfterSeconds": 2 * 24 * 60 * 60})
+
+    def test_ensure_indexes_ttl_unchanged(self):
+        db, named = make_db()
+        archive = named[retention.ARCHIVE_COLLECTION]
+        archive.index_information.return_value = {
+            "archived_at_1": {"key": [("archived_at", 1)],
+                              "expireAfterSeconds": 2 * 24 * 60 * 60}}
+        retention.ensure_indexes(db, archive_ttl_days=2)
+
+        assert not archive.create_index.called
+        assert not db.command.called
+
+
+class TestArchiveEmails(tests.TestBase):
+    def test_archive_emails_dry_run(self):
+        db = mock.MagicMock()
+        db.command.return_value = {"n": 2}
+
+        now = datetime.datetime(2018, 1, 31)
+        assert retention.archive_emails(db, 30, dry_run=True, now=now) == 2
+
+        args, kwargs = db.command.call_args
+        assert args == ("count", "emails")
+        assert kwargs["query"]["updated_at"] == {
+            "$lt": datetime.datetime(2018, 1, 1)}
+        assert not db.emails.find.called
+        assert not db.emails.delete_many.called
+        assert not db.__getitem__.return_value.bulk_write.called
+
+    def test_archive_emails_batches(self):
+        db = mock.MagicMock()
+        batches = [[{"_id": "a"}, {"_id": "b"}], [{"_id": "c"}], []]
+        db.emails.find.return_value.limit.side_effect = batches
+        db.emails.delete_many.side_effect = [
+            mock.MagicMock(deleted_count=2),
+            mock.MagicMock(deleted_count=1)]
+
+        now = datetime.datetime(2018, 1, 31)
+        archived = retention.archive_emails(db, 30, batch_size=2, now=now)
+
+        assert archived == 3
+        archive = db.__getitem__.return_value
+        assert archive.bulk_write.call_count == 2
+        first_delete = db.emails.delete_many.call_args_list[0][0][0]
+        assert first_delete["_id"] == {"$in": ["a", "b"]}
+        assert first_delete["status"] == {"$in": ["complete", "failed"]}
+
+    def test_archive_emails_stops_when_nothing_deleted(self):
+        db = mock.MagicMock()
+        db.emails.find.return_value.limit.return_value = [{"_id": "a"}]
+        db.emails.delete_many.return_value = mock.MagicMock(deleted_count=0)
+
+        assert retention.archive_emails(db, 30) == 0
+        assert db.emails.delete_many.call_count == 1
+
+    def test_archive_emails_archives_external_recipients(self):
+        db, named = make_db()
+        batches = [[{"_id": "a", "recipient_storage": "external"},
+                    {"_id": "b"},
+                    {"_id": "c", "recipient_storage": "external"}], []]
+        db.emails.find.return_value.limit.side_effect = batches
+        db.emails.delete_many.return_value = mock.MagicMock(deleted_count=2)
+        # "c" was deleted by someone else between the copy and the delete
+        db.emails.find.return_value.__iter__.return_value = iter(
+            [{"_id": "c"}])
+        recipients = named["recipients"]
+        recipients.find.return_value = [
+            {"_id": "a:000000000", "email_id": "a", "status": 250},
+            {"_id": "c:000000000", "email_id": "c", "status": 0}]
+
+        now = datetime.datetime(2018, 1, 31)
+        assert retention.archive_emails(db, 30, now=now) == 2
+
+        recipients.find.assert_called_once_with(
+            {"email_id": {"$in": ["a", "c"]}})
+        archived = named[retention.ARCHIVE_RECIPIENT_COLLECTION]
+        requests = archived.bulk_write.call_args[0][0]
+        assert len(requests) == 2
+        recipients.delete_many.assert_called_once_with(
+            {"email_id": {"$in": ["a"]}})
+
+    def test_archive_recipients_batches(self):
+        db, named = make_db()
+        named["recipients"].find.return_value = [
+            {"_id": "a:{:09d}".format(i), "email_id": "a", "status": 0}
+            for i in range(5)]
+
+        now = datetime.datetime(2018, 1, 31)
+        with mock.patch.object(retention.pymongo, "ReplaceOne") as replace:
+            assert retention.archive_recipients(db, ["a"], now,
+                                                batch_size=2) == 5
+
+        archived = named[retention.ARCHIVE_RECIPIENT_COLLECTION]
+        assert [len(c[0][0]) for c in archived.bulk_write.call_args_list] \
+            == [2, 2, 1]
+        copies = [c[0][1] for c in replace.call_args_list]
+        assert all(c["archived_at"] == now for c in copies)
+
+    def test_archive_recipients_none(self):
+        db, named = make_db()
+        assert retention.archive_recipients(db, [], None) == 0
+        assert not named["recipients"].find.called
+
+    def test_archive_emails_transfers_bodies(self):
+        batches = [[{"_id": "a", "body_hash": "h1"},
+                    {"_id": "b", "body_hash": "h1"},
+                    {"_id": "c", "body": "inline"}], []]
+        db, named = make_db()
+        db.emails.find.return_value.limit.side_effect = batches
+        db.emails.delete_many.return_value = mock.MagicMock(deleted_count=3)
+        named["bodies"].find.return_value = [{"_id": "h1", "body": "shared"}]
+
+        with mock.patch.object(retention.pymongo, "ReplaceOne") as replace:
+            assert retention.archive_emails(db, 30) == 3
+
+        copies = [c[0][1] for c in replace.call_args_list]
+        assert [c["body"] for c in copies] == ["shared", "shared", "inline"]
+        assert not any("body_hash" in c for c in copies)
+        named["bodies"].update_one.assert_called_once_with(
+            {"_id": "h1"}, {"$inc": {"refcount": -2}})
@@ -0,0 +1,92 @@
+import collections
+
+import mock
+import pymongo
+
+from babymailgun import servers
+import tests
+
+
+class TestBuildSlots(tests.TestBase):
+    def test_smooth_interleaving(self):
+        assert servers.build_slots([5, 1, 1]) == [0, 0, 1, 0, 2, 0, 0]
+
+    def test_reduces_by_gcd(self):
+        assert servers.build_slots([200, 100]) == [0, 1, 0]
+
+    def test_proportions(self):
+        slots = servers.build_slots([3, 7, 0, 11])
+        counts = collections.Counter(slots)
+        assert counts == {0: 3, 1: 7, 3: 11}
+
+    def test_no_weight(self):
+        assert servers.build_slots([]) == []
+        assert servers.build_slots([0, 0]) == []
+
+    def test_bounded_size(self):
+        weights = [999, 1000] * 20
+        slots = servers.build_slots(weights)
+        assert len(slots) <= servers.MAX_TABLE_SIZE + len(weights)
+        assert set(slots) == set(range(len(weights)))
+
+
+class TestBuildTable(tests.TestBase):
+    def test_build_table(self):
+        registered = [
+            {"_id": "b", "hostname": "b.com", "port": 25, "weight": 2},
+            {"_id": "a", "hostname": "a.com", "port": 25, "weight": 1,
+             "password": "secret"},
+            {"_id": "c", "hostname": "c.com", "port": 25, "weight": 5,
+             "enabled": False},
+            {"_id": "d", "hostname": "d.com", "port": 25, "weight": 0}]
+
+        table = servers.build_table(registered)
+
+        assert [e["_id"] for e in table["servers"]] == ["a", "b"]
+        assert table["servers"][0]["password"] == "secret"
+        assert sorted(table["slots"]) == [0, 1, 1]
+
+    def test_legacy_servers(self):
+        table = servers.build_table([{"_id": "a", "hostname": "a.com",
+                                      "port": 1025}])
+
+        assert table["servers"][0]["weight"] == servers.DEFAULT_WEIGHT
+        assert table["servers"][0]["max_concurrency"] == \
+            servers.DEFAULT_MAX_CONCURRENCY
+        assert table["slots"] == [0]
+
+
+class TestRebuildTable(tests.TestBase):
+    def _db(self, generation):
+        db = mock.MagicMock()
+        db["server_tables"].find_one_and_update.return_value = {
+            "value": generation}
+        db["servers"].find.return_value = [
+            {"_id": "a", "hostname": "a.com", "port": 25, "weight": 1}]
+        return db
+
+    def test_rebuild_table(self):
+        db = self._db(7)
+
+        table = servers.rebuild_table(db)
+
+        assert table["version"] == 7
+        query, update = db["server_tables"].update_one.call_args[0]
+        assert query == {"_id": "current", "version": {"$lt": 7}}
+        assert update["$set"]["slots"] == [0]
+
+    def test_rebuild_table_superseded(self):
+        db = self._db(3)
+        db["server_tables"].update_one.side_effect = \
+            pymongo.errors.DuplicateKeyError("newer table")
+
+        with self.not_raises():
+            servers.rebuild_table(db)
+
+    def test_update_missing_server(self):
+        db = self._db(1)
+        db["servers"].find_one_and_update.return_value = None
+
+        assert servers.update_server(db, "nope", {"weight": 2}) == \
+            (None, None)
+        assert not db["server_tables"].update_one.called
@@ -0,0 +1,71 @@
+import smtplib
+
+import pytest
+
+from babymailgun import smtp_sink
+import tests
+
+MESSAGE = "Subject: Hello\r\n\r\nbuffalo\r\n.leading dot\r\n"
+
+
+class TestSMTPSink(tests.TestBase):
+    @pytest.fixture()
+    def sink(self):
+        received = []
+        with smtp_sink.SMTPSink(on_message=received.append) as sink:
+            sink.received = received
+            yield sink
+
+    def _client(self, sink):
+        host, port = sink.address
+        return smtplib.SMTP(host, port, timeout=5)
+
+    def test_delivers(self, sink):
+        with self._client(sink) as client:
+            client.login("user", "password")
+            client.sendmail("from@unittests.com",
+                            ["a@unittests.com", "b@unittests.com"], MESSAGE)
+
+        assert len(sink.received) == 1
+        message = sink.received[0]
+        assert message.sender == "from@unittests.com"
+        assert message.recipients == ["a@unittests.com", "b@unittests.com"]
+        assert ".leading dot" in message.data
+        assert sink.stats["messages"] == 1
+        assert sink.stats["recipients"] == 2
+
+    def test_rejects_recipients(self):
+        with smtp_sink.SMTPSink(reject_rate=1.0) as sink:
+            with self._client(sink) as client:
+                with pytest.raises(smtplib.SMTPRecipientsRefused) as e:
+                    client.sendmail("from@unittests.com",
+                                    ["a@unittests.com"], MESSAGE)
+
+        code, reply = e.value.recipients["a@unittests.com"]
+        assert code == 550
+        assert reply == b"Invalid Recipient a@unittests.com"
+        assert sink.stats["rejected"] == 1
+
+    def test_auth_failure(self):
+        with smtp_sink.SMTPSink(auth_failure_rate=1.0) as sink:
+            with self._client(sink) as client:
+                with pytest.raises(smtplib.SMTPAuthenticationError) as e:
+                    client.login("user", "password")
+
+        assert e.value.smtp_code == 500
+        assert sink.stats["auth_failures"] == 1
+
+    def test_disconnects(self):
+        with smtp_sink.SMTPSink(disconnect_rate=1.0) as sink:
+            client = self._client(sink)
+            with pytest.raises(smtplib.SMTPServerDisconnected):
+                client.sendmail("from@unittests.com", ["a@unittests.com"],
+                                MESSAGE)
+
+        assert sink.stats["disconnects"] == 1
+        assert sink.stats["messages"] == 0
+
+    def test_unknown_command(self, sink):
+        with self._client(sink) as client:
+            assert client.docmd("VRFY", "a@unittests.com") == (
+                500, b"Unrecognised command")
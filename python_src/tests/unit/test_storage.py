@@ -0,0 +1,146 @@
+import datetime
+
+import mock
+import pymongo
+import pytest
+
+from babymailgun import storage
+import tests
+
+
+def make_email(email_id, status="incomplete", day=1):
+    return {"_id": email_id,
+            "status": status,
+            "sender": "from@unittests.com",
+            "recipients": [{"address": "to@unittests.com", "status": 0}],
+            "created_at": datetime.datetime(2017, 1, day)}
+
+
+class TestStorage(tests.TestBase):
+    def test_every_method_is_abstract(self):
+        # A backend missing any of these can't be instantiated
+        assert storage.Storage.__abstractmethods__ == frozenset(
+            ["ping", "insert_email", "get_email", "list_emails",
+             "delete_email", "stats"])
+
+
+class TestMemoryStorage(tests.TestBase):
+    @pytest.fixture()
+    def store(self):
+        store = storage.MemoryStorage()
+        store.insert_email(make_email("c", day=3))
+        store.insert_email(make_email("a", status="complete", day=1))
+        store.insert_email(make_email("d", status="failed", day=4))
+        store.insert_email(make_email("b", day=2))
+        return store
+
+    def _ids(self, emails):
+        return [e["_id"] for e in emails]
+
+    def test_get(self, store):
+        assert store.get_email("c")["status"] == "incomplete"
+        assert store.get_email("missing") is None
+
+    def test_get_projection(self, store):
+        assert store.get_email("c", {"status": 1}) == {"_id": "c",
+                                                       "status": "incomplete"}
+
+    def test_insert_duplicate(self, store):
+        with pytest.raises(pymongo.errors.DuplicateKeyError):
+            store.insert_email(make_email("a"))
+
+    def test_documents_are_copies(self, store):
+        email = make_email("e")
+        store.insert_email(email)
+        email["recipients"][0]["status"] = 250
+        store.get_email("e")["recipients"][0]["status"] = 550
+        assert store.get_email("e")["recipients"][0]["status"] == 0
+
+    def test_list_in_id_order(self, store):
+        emails, next_cursor = store.list_emails()
+        assert self._ids(emails) == ["a", "b", "c", "d"]
+        assert next_cursor is None
+
+    def test_list_pages(self, store):
+        emails, next_cursor = store.list_emails(limit=3)
+        assert self._ids(emails) == ["a", "b", "c"]
+        assert next_cursor == "c"
+
+        emails, next_cursor = store.list_emails(after=next_cursor, limit=3)
+        assert self._ids(emails) == ["d"]
+        assert next_cursor is None
+
+    def test_list_exact_page(self, store):
+        emails, next_cursor = store.list_emails(limit=4)
+        assert len(emails) == 4
+        assert next_cursor is None
+
+    def test_list_by_status(self, store):
+        emails, _ = store.list_emails(status="incomplete")
+        assert self._ids(emails) == ["b", "c"]
+        assert store.list_emails(status="nonsense") == ([], None)
+
+    def test_list_before(self, store):
+        emails, _ = store.list_emails(before=datetime.datetime(2017, 1, 3))
+        assert self._ids(emails) == ["a", "b"]
+
+    def test_list_by_status_before(self, store):
+        emails, _ = store.list_emails(status="incomplete",
+                                      before=datetime.datetime(2017, 1, 3))
+        assert self._ids(emails) == ["b"]
+
+    def test_delete(self, store):
+        deleted = store.delete_email("b", {"status": 1})
+        assert deleted == {"_id": "b", "status": "incomplete"}
+        assert store.get_email("b") is None
+        assert store.delete_email("b") is None
+
+        emails, _ = store.list_emails(status="incomplete")
+        assert self._ids(emails) == ["c"]
+        emails, _ = store.list_emails(before=datetime.datetime(2017, 1, 3))
+        assert self._ids(emails) == ["a"]
+
+    def test_stats(self, store):
+        store.delete_email("d")
+        assert store.stats() == {"backend": "memory",
+                                 "emails": 3,
+                                 "statuses": {"incomplete": 2,
+                                              "complete": 1}}
+
+
+class TestMongoStorage(tests.TestBase):
+    def test_list_query(self):
+        db = mock.MagicMock()
+        page = [make_email("a"), make_email("b"), make_email("c")]
+        db.emails.find.return_value.sort.return_value.limit.return_value = \
+            page
+        before = datetime.datetime(2017, 1, 3)
+
+        emails, next_cursor = storage.MongoStorage(db).list_emails(
+            status="incomplete", before=before, after="0", limit=2)
+
+        db.emails.find.assert_called_once_with(
+            {"status": "incomplete", "created_at": {"$lt": before},
+             "_id": {"$gt": "0"}})
+        db.emails.find.return_value.sort.return_value.limit \
+            .assert_called_once_with(3)
+        assert [e["_id"] for e in emails] == ["a", "b"]
+        assert next_cursor == "b"
+
+    def test_list_without_limit(self):
+        db = mock.MagicMock()
+        db.emails.find.return_value.sort.return_value = [make_email("a")]
+
+        emails, next_cursor = storage.MongoStorage(db).list_emails()
+
+        assert len(emails) == 1
+        assert next_cursor is None
+
+    def test_stats(self):
+        db = mock.MagicMock()
+        db.emails.aggregate.return_value = [
+            {"_id": "incomplete", "count": 3}, {"_id": "failed", "count": 1}]
+
+        assert storage.MongoStorage(db).stats() == {
+            "backend": "mongo", "emails": 4,
+            "statuses": {"incomplete": 3, "failed": 1}}
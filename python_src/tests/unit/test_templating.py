@@ -0,0 +1,50 @@
+from babymailgun import templating
+import tests
+
+
+class TestPlaceholders(tests.TestBase):
+    def test_placeholders(self):
+        template = "Hi {{ first_name }}, your code is {{code}}. {{ code }}"
+        assert templating.placeholders(template) == {"first_name", "code"}
+
+    def test_placeholders_none(self):
+        assert templating.placeholders("No variables here") == set()
+
+    def test_placeholder_counts(self):
+        counts = templating.placeholder_counts("{{ a }} {{b}} {{ a }}")
+        assert counts == {"a": 2, "b": 1}
+
+    def test_strip_placeholders(self):
+        assert templating.strip_placeholders("Hi {{ name }}") == "Hi "
+
+
+class TestRender(tests.TestBase):
+    def test_render(self):
+        rendered = templating.render("Hi {{ name }}, you owe {{amount}}",
+                                     {"name": "Bob", "amount": 10})
+        assert rendered == "Hi Bob, you owe 10"
+
+    def test_render_missing_variable(self):
+        assert templating.render("Hi {{ name }}!", {}) == "Hi !"
+
+    def test_render_leaves_other_braces(self):
+        assert templating.render("{ name } {{ }}", {"name": "x"}) == \
+            "{ name } {{ }}"
+
+    def test_rendered_length(self):
+        template = "Hi {{ name }}, {{ name }} owes {{amount}} {{ missing }}"
+        variables = {"name": "Bob", "amount": 10}
+        length = templating.rendered_length(
+            len(templating.strip_placeholders(template)),
+            templating.placeholder_counts(template), variables)
+        assert length == len(templating.render(template, variables))
+
+    def test_render_email(self):
+        email = {"subject": "Hello {{ name }}", "body": "Dear {{ name }}"}
+        recipient = {"address": "bob@unittests.com",
+                     "variables": {"name": "Bob"}}
+
+        assert templating.render_email(email, recipient) == {
+            "address": "bob@unittests.com",
+            "subject": "Hello Bob",
+            "body": "Dear Bob"}
@@ -0,0 +1,145 @@
+import io
+import json
+
+import flask
+import mock
+
+from babymailgun import app as mailgun_app
+from babymailgun import tracing
+import tests
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCorrelationId(tests.TestBase):
+    def test_keeps_valid_id(self):
+        assert tracing.to_correlation_id("abc-123.x:y_z") == "abc-123.x:y_z"
+
+    def test_generates_missing_id(self):
+        generated = tracing.to_correlation_id(None)
+        assert len(generated) == 32
+        assert generated != tracing.to_correlation_id(None)
+
+    def test_replaces_invalid_id(self):
+        for value in ("has spaces", "new\nline", "x" * 129):
+            assert tracing.to_correlation_id(value) != value
+
+
+class TestTrace(tests.TestBase):
+    def test_spans(self):
+        clock = FakeClock()
+        trace = tracing.Trace("abc", "POST /emails", clock=clock)
+        clock.now = 0.001
+        with trace.span("validate"):
+            clock.now = 0.004
+        clock.now = 0.010
+
+        record = trace.finish(status=200)
+        assert record["correlation_id"] == "abc"
+        assert record["name"] == "POST /emails"
+        assert record["status"] == 200
+        assert record["duration_ms"] == 10.0
+        assert record["spans"] == [{"name": "validate", "start_ms": 1.0,
+                                    "duration_ms": 3.0}]
+
+    def test_span_recorded_on_error(self):
+        trace = tracing.Trace("abc", "test")
+        try:
+            with trace.span("db.insert_email"):
+                raise ValueError()
+        except ValueError:
+            pass
+        assert [s["name"] for s in trace.spans] == ["db.insert_email"]
+
+    def test_span_outside_request(self):
+        assert tracing.current() is None
+        with self.not_raises():
+            with tracing.span("validate"):
+                pass
+
+
+class TestExporter(tests.TestBase):
+    def _record(self, duration_ms):
+        return {"correlation_id": "abc", "duration_ms": duration_ms,
+                "spans": []}
+
+    def test_none(self):
+        with mock.patch("builtins.open") as mock_open:
+            tracing.Exporter("none").export(self._record(5))
+        assert not mock_open.called
+
+    def test_log(self):
+        with mock.patch.object(tracing.LOG, "info") as mock_info:
+            tracing.Exporter("log").export(self._record(5))
+        assert json.loads(mock_info.call_args[0][0])["correlation_id"] == \
+            "abc"
+
+    def test_log_emitted(self):
+        stream = io.StringIO()
+        tracing.Exporter("log", stream=stream).export(self._record(5))
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["correlation_id"] == "abc"
+
+    def test_log_handler_replaced(self):
+        first, second = io.StringIO(), io.StringIO()
+        tracing.Exporter("log", stream=first)
+        tracing.Exporter("log", stream=second).export(self._record(5))
+
+        assert first.getvalue() == ""
+        assert len(second.getvalue().splitlines()) == 1
+
+    def test_file(self, tmpdir):
+        path = str(tmpdir.join("traces.jsonl"))
+        exporter = tracing.Exporter("file", path=path)
+        exporter.export(self._record(5))
+        exporter.export(self._record(6))
+
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        assert [line["duration_ms"] for line in lines] == [5, 6]
+
+    def test_slow_only(self):
+        exporter = tracing.Exporter("log", slow_ms=100)
+        with mock.patch.object(tracing.LOG, "info") as mock_info:
+            exporter.export(self._record(99))
+            exporter.export(self._record(100))
+        assert mock_info.call_count == 1
+
+
+class TestRequestTracing(tests.TestBase):
+    def test_correlation_id_echoed(self):
+        resp = mailgun_app.app.test_client().get(
+            "/ready", headers={tracing.HEADER: "batch-42"})
+        assert resp.headers[tracing.HEADER] == "batch-42"
+
+    def test_correlation_id_generated(self):
+        resp = mailgun_app.app.test_client().get("/ready")
+        assert len(resp.headers[tracing.HEADER]) == 32
+
+    def test_trace_exported(self):
+        exporter = mock.MagicMock()
+        with mock.patch.object(mailgun_app, "_get_trace_exporter",
+                               return_value=exporter):
+            mailgun_app.app.test_client().get(
+                "/ready", headers={tracing.HEADER: "batch-42"})
+
+        record = exporter.export.call_args[0][0]
+        assert record["correlation_id"] == "batch-42"
+        assert record["name"] == "GET /ready"
+        assert record["status"] in (204, 503)
+
+    def test_current_in_request(self):
+        with mailgun_app.app.test_request_context("/emails"):
+            flask.g.trace = tracing.Trace("abc", "test")
+            with tracing.span("validate"):
+                pass
+            assert tracing.current_correlation_id() == "abc"
+            assert flask.g.trace.spans[0]["name"] == "validate"